@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify, session, render_template, redirect, url_for, send_file
+from flask import Flask, request, jsonify, session, render_template, redirect, url_for, send_file, Response
 from flask_cors import CORS
 import sqlite3
 import os
@@ -7,9 +7,32 @@ import hashlib
 from cryptography.fernet import Fernet
 from datetime import datetime, timedelta
 import json
+import base64
+import io
+import threading
 from werkzeug.utils import secure_filename
 import math
 import re
+from db_pool import ConnectionPool, bind_to_app
+from secure_video import ChunkedCipher, is_chunked_file
+from dispatch import DispatchIndex, load_from_db as load_dispatch_index
+from geodistance import haversine_km
+from fares import FareEngine
+from road_graph import RoadGraph
+from geocoder import Geocoder
+from passwords import PasswordHasher, HasherBusy
+from location_ingest import LocationIngestBuffer, parse_ping
+from retention import RetentionWorker
+from migrations import migrate, start_backfills, LATEST_VERSION
+from rental_calendar import RentalCalendar, ACTIVE_RENTAL_STATUSES
+from notifications import NotificationDispatcher
+from emergency_rules import RuleCache, compile_rule, parse_home
+from telemetry import TelemetryMonitor
+from sos_counter import make_counter, load_from_db as load_sos_counter
+from rate_limit import make_limiter
+from otp_store import OtpStore
+from tokens import TokenSigner, RevocationList, RevocationListFull, InvalidToken, parse_keys, ephemeral_keys
+from vehicle_catalog import VehicleCatalog, TAGS as CATALOG_TAGS
 
 app = Flask(__name__)
 CORS(app)
@@ -35,154 +58,132 @@ def generate_key():
 # Store encryption key securely
 ENCRYPTION_KEY = generate_key()
 cipher_suite = Fernet(ENCRYPTION_KEY)
-
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-def verify_database():
-    print("Verifying database structure...")  # Debug log
+# Videos are streamed to disk in authenticated chunks instead of one Fernet token
+video_cipher = ChunkedCipher.from_fernet_key(ENCRYPTION_KEY)
+
+# Pooled SQLite connections: one per app context, returned to the pool on teardown
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+# Name of the shared-memory block worker processes share counters through;
+# unset keeps counters per process
+SHARED_STATE_NAME = os.environ.get('SHARED_STATE_NAME')
+# Bearer token keys as 'kid:secret,kid:secret', signing key first; unset
+# signs with a random per-process key
+TOKEN_SIGNING_KEYS = os.environ.get('TOKEN_SIGNING_KEYS')
+# Compiled road graph (python road_graph.py build ...); unset estimates routes
+ROAD_GRAPH_PATH = os.environ.get('ROAD_GRAPH_PATH')
+# CSV of places (name, latitude, longitude[, weight]) for offline geocoding
+GEOCODER_DATA_PATH = os.environ.get('GEOCODER_DATA_PATH')
+db_pool = ConnectionPool(DB_NAME, max_size=DB_POOL_SIZE)
+get_db_connection = bind_to_app(app, db_pool)
+# Hands the request's connection back early, before slow work like hashing
+release_db_connection = get_db_connection.release
+
+def _load_dispatch_index(index):
+    # Inside a request this is the request's own connection, so the first
+    # dispatch query never waits on the pool for a second one
     conn = get_db_connection()
-    cursor = conn.cursor()
-    
     try:
-        # Check users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                email TEXT UNIQUE NOT NULL,
-                phone TEXT NOT NULL,
-                password TEXT NOT NULL,
-                gender TEXT NOT NULL,
-                driver_gender_preference TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Check vehicles table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS vehicles (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                driver_id TEXT,
-                driver_name TEXT,
-                driver_gender TEXT NOT NULL,
-                car_model TEXT,
-                car_number TEXT UNIQUE,
-                car_type TEXT,
-                aadhaar_number TEXT,
-                status TEXT DEFAULT 'available',
-                rental_price REAL,
-                is_rental BOOLEAN DEFAULT 0,
-                customer_gender_preference TEXT
-            )
-        ''')
-        
-        # Check bookings table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS bookings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                vehicle_id INTEGER,
-                service_type TEXT NOT NULL,
-                pickup TEXT NOT NULL,
-                destination TEXT NOT NULL,
-                pickup_time TEXT NOT NULL,
-                passengers INTEGER NOT NULL,
-                instructions TEXT,
-                status TEXT DEFAULT 'pending',
-                price REAL NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id),
-                FOREIGN KEY(vehicle_id) REFERENCES vehicles(id)
-            )
-        ''')
-
-        # Check rentals table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS rentals (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                vehicle_id INTEGER,
-                start_date DATE NOT NULL,
-                end_date DATE NOT NULL,
-                status TEXT DEFAULT 'pending',
-                total_price REAL NOT NULL,
-                requirements TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY(user_id) REFERENCES users(id),
-                FOREIGN KEY(vehicle_id) REFERENCES vehicles(id)
-            )
-        ''')
-        
-        # Add sample data if tables are empty
-        cursor.execute('SELECT COUNT(*) FROM users')
-        if cursor.fetchone()[0] == 0:
-            print("Adding sample user...")  # Debug log
-            cursor.execute('''
-                INSERT INTO users (name, email, phone, password, gender, driver_gender_preference)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (
-                'Test User',
-                'test@example.com',
-                '1234567890',
-                hashlib.sha256('password123'.encode()).hexdigest(),
-                'male',
-                'any'
-            ))
-        
-        cursor.execute('SELECT COUNT(*) FROM vehicles')
-        if cursor.fetchone()[0] == 0:
-            print("Adding sample vehicles...")  # Debug log
-            # Add vehicles for booking
-            cursor.execute('''
-                INSERT INTO vehicles (
-                    driver_name, driver_gender, car_model, car_number, 
-                    car_type, status, customer_gender_preference, is_rental, rental_price
-                ) VALUES 
-                    ('John Doe', 'male', 'Toyota Camry', 'ABC123', 'standard', 'available', 'any', 0, NULL),
-                    ('Jane Smith', 'female', 'Honda Civic', 'XYZ789', 'standard', 'available', 'any', 0, NULL),
-                    ('Mike Johnson', 'male', 'Mercedes E-Class', 'DEF456', 'premium', 'available', 'any', 0, NULL),
-                    ('Sarah Wilson', 'female', 'Toyota Corolla', 'GHI789', 'shared', 'available', 'any', 0, NULL)
-            ''')
-            
-            # Add vehicles for rental
-            cursor.execute('''
-                INSERT INTO vehicles (
-                    driver_name, driver_gender, car_model, car_number, 
-                    car_type, status, customer_gender_preference, is_rental, rental_price
-                ) VALUES 
-                    ('David Brown', 'male', 'BMW 5 Series', 'JKL123', 'premium', 'available', 'any', 1, 100.00),
-                    ('Emma Davis', 'female', 'Audi A4', 'MNO456', 'premium', 'available', 'any', 1, 90.00),
-                    ('James Wilson', 'male', 'Toyota Camry', 'PQR789', 'standard', 'available', 'any', 1, 50.00),
-                    ('Lisa Anderson', 'female', 'Honda Civic', 'STU123', 'standard', 'available', 'any', 1, 45.00)
-            ''')
-        
-        conn.commit()
-        print("Database verification completed successfully")  # Debug log
-        
-    except Exception as e:
-        print(f"Error verifying database: {str(e)}")  # Debug log
-        conn.rollback()
-        raise e
+        load_dispatch_index(conn, index)
     finally:
         conn.close()
 
+# Latest position and availability of every vehicle, for nearest-driver dispatch
+dispatch_index = DispatchIndex(loader=_load_dispatch_index)
+
+# Memory-mapped road graph shared by all workers, when one is configured
+road_graph = RoadGraph(ROAD_GRAPH_PATH) if ROAD_GRAPH_PATH else None
+
+# Place-name index for pickup/destination text, when a dataset is configured
+geocoder = Geocoder.from_csv(GEOCODER_DATA_PATH) if GEOCODER_DATA_PATH else None
+
+# Fares from route distance, time of day and zone surge
+fare_engine = FareEngine(
+    dispatch_index,
+    geocoder=geocoder.resolve if geocoder else None,
+    router=road_graph.route_km if road_graph else None
+)
+
+# Location pings are group-committed in the background
+MAX_PINGS_PER_BATCH = 500
+location_buffer = LocationIngestBuffer(db_pool)
+
+# Moves old location pings and SOS triggers into day partitions in the background
+retention_worker = RetentionWorker(db_pool)
+
+# Date-range reservations per rental vehicle
+rental_calendar = RentalCalendar()
+
+# Serialized vehicle listings, invalidated by the writes that change them
+vehicle_catalog = VehicleCatalog(SHARED_STATE_NAME)
+
+def catalog_response(entry):
+    # Cached listing with an ETag; a matching If-None-Match gets an empty 304
+    response = Response(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# scrypt password hashing on a bounded pool
+password_hasher = PasswordHasher()
+
+# Compiled emergency conditions per user, invalidated by save_emergency_conditions
+emergency_rules = RuleCache(db_pool)
+
+# Live OTPs, cached with expiry; the otps table keeps the audit trail
+otp_store = OtpStore()
+
+# Signed bearer tokens issued after OTP verification
+token_keys = parse_keys(TOKEN_SIGNING_KEYS)
+if not token_keys:
+    print("Warning: TOKEN_SIGNING_KEYS has no keys; signing tokens with a random per-process key. "
+          "Tokens will not verify in other workers or after a restart.")  # Debug log
+    token_keys = ephemeral_keys()
+token_signer = TokenSigner(token_keys, revocations=RevocationList(SHARED_STATE_NAME))
+
+def token_claims():
+    # Claims of the request's bearer token, None without one; raises InvalidToken
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        return None
+    return token_signer.verify(header[7:].strip())
+
+# SOS triggers per user over the last five minutes, for escalation
+sos_counter = make_counter(SHARED_STATE_NAME)
+
+# Token buckets for login and OTP attempts per IP, email and user
+rate_limiter = make_limiter(SHARED_STATE_NAME)
+
+def rate_limited(*checks):
+    # 429 response if any (rule, key) bucket is empty, else None
+    retry_after = rate_limiter.check(*checks)
+    if retry_after:
+        return jsonify({
+            'success': False,
+            'message': 'Too many attempts. Please try again later.'
+        }), 429, {'Retry-After': str(retry_after)}
+    return None
+
 def init_db():
     print("Initializing database...")  # Debug log
-    verify_database()
-    print("Database initialized successfully!")  # Debug log
-
-def migrate_db():
     conn = get_db_connection()
-    cursor = conn.cursor()
     try:
-        cursor.execute('ALTER TABLE bookings ADD COLUMN document_path TEXT')
-    except Exception:
-        pass  # Already exists
-    conn.commit()
-    conn.close()
+        applied = migrate(conn)
+        print(f"Applied {applied} migrations, schema at version {LATEST_VERSION}")  # Debug log
+    except Exception as e:
+        print(f"Error migrating database: {str(e)}")  # Debug log
+        raise
+    finally:
+        conn.close()
+    # Long backfills run online in small batches
+    start_backfills(db_pool)
+    # A shared counter is rebuilt only by the worker that created it
+    if sos_counter.created:
+        conn = get_db_connection()
+        try:
+            print(f"Loaded {load_sos_counter(conn, sos_counter)} recent SOS triggers")  # Debug log
+        finally:
+            conn.close()
+    print("Database initialized successfully!")  # Debug log
 
 @app.route('/')
 def index():
@@ -289,9 +290,6 @@ def handle_register():
                 'message': 'Password must be at least 8 characters long and contain at least one uppercase letter, one lowercase letter, and one number'
             }), 400
 
-        # Hash password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -301,7 +299,13 @@ def handle_register():
             conn.close()
             return jsonify({'success': False, 'message': 'Email already registered'}), 400
 
+        # Hash password without holding a pooled connection
+        release_db_connection()
+        hashed_password = password_hasher.hash(password)
+
         # Insert new user
+        conn = get_db_connection()
+        cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO users (name, email, phone, password, gender, driver_gender_preference)
             VALUES (?, ?, ?, ?, ?, ?)
@@ -315,6 +319,8 @@ def handle_register():
             'message': 'Registration successful! Please login.'
         }), 201
 
+    except HasherBusy:
+        return jsonify({'success': False, 'message': 'Server busy. Please try again shortly.'}), 503, {'Retry-After': '1'}
     except Exception as e:
         print(f"Registration error: {str(e)}")  # Debug log
         return jsonify({'success': False, 'message': 'Registration failed. Please try again.'}), 500
@@ -334,6 +340,10 @@ def handle_login():
                 'message': 'Email and password are required'
             }), 400
 
+        limited = rate_limited(('login_ip', request.remote_addr), ('login_email', email.strip().lower()))
+        if limited:
+            return limited
+
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -349,16 +359,24 @@ def handle_login():
                 'message': 'Invalid email or password'
             }), 401
 
-        # Verify password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
-        print(f"Password match: {user['password'] == hashed_password}")  # Debug log
+        # Verify password without holding a pooled connection; legacy sha256
+        # hashes are upgraded on a successful login
+        release_db_connection()
+        matches, new_hash = password_hasher.verify(password, user['password'])
+        print(f"Password match: {matches}")  # Debug log
 
-        if user['password'] != hashed_password:
+        if not matches:
             return jsonify({
                 'success': False,
                 'message': 'Invalid email or password'
             }), 401
 
+        if new_hash:
+            conn = get_db_connection()
+            conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                         (new_hash, user['id'], user['password']))
+            conn.commit()
+
         # Set session
         session['user_id'] = user['id']
         session['username'] = user['name']
@@ -371,12 +389,11 @@ def handle_login():
             'username': user['name'],
             'message': 'Login successful'
         })
+    except HasherBusy:
+        return jsonify({'success': False, 'message': 'Server busy. Please try again shortly.'}), 503, {'Retry-After': '1'}
     except Exception as e:
         print(f"Login error: {str(e)}")  # Debug log
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 400
+        return jsonify({'success': False, 'message': 'Login failed. Please try again.'}), 500
 
 @app.route('/api/auth/verify-otp', methods=['POST'])
 def verify_otp():
@@ -391,55 +408,33 @@ def verify_otp():
                 'message': 'User ID and OTP are required'
             }), 400
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Get latest OTP
-        cursor.execute('''
-            SELECT otp, expires_at, used
-            FROM otps
-            WHERE user_id = ?
-            ORDER BY created_at DESC
-            LIMIT 1
-        ''', (user_id,))
-        
-        otp_record = cursor.fetchone()
+        limited = rate_limited(('otp_verify_ip', request.remote_addr), ('otp_verify_user', str(user_id)))
+        if limited:
+            return limited
 
-        if not otp_record:
+        # Checked and consumed in one step against the cached code
+        error = otp_store.verify(get_db_connection(), user_id, otp)
+        if error:
             return jsonify({
                 'success': False,
-                'message': 'No OTP found'
+                'message': error
             }), 400
 
-        if otp_record['used']:
-            return jsonify({
-                'success': False,
-                'message': 'OTP already used'
-            }), 400
-
-        if time.time() > otp_record['expires_at']:
-            return jsonify({
-                'success': False,
-                'message': 'OTP expired'
-            }), 400
-
-        if otp != otp_record['otp']:
+        # The claims let hot endpoints skip looking the user up again
+        user = get_db_connection().execute(
+            'SELECT id, gender, driver_gender_preference FROM users WHERE id = ?', (user_id,)
+        ).fetchone()
+        if not user:
             return jsonify({
                 'success': False,
-                'message': 'Invalid OTP'
-            }), 400
-
-        # Mark OTP as used
-        cursor.execute('UPDATE otps SET used = 1 WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
-
-        # In production, generate a proper JWT token
-        token = 'dummy_token'  # Replace with proper JWT token
+                'message': 'User not found'
+            }), 404
+        token = token_signer.issue(user['id'], user['gender'], user['driver_gender_preference'])
 
         return jsonify({
             'success': True,
             'token': token,
+            'expiresIn': token_signer.ttl,
             'message': 'Login successful'
         })
     except Exception as e:
@@ -448,6 +443,21 @@ def verify_otp():
             'message': str(e)
         }), 400
 
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    session.pop('user_id', None)
+    session.pop('username', None)
+    try:
+        claims = token_claims()
+        if claims:
+            token_signer.revoke(claims)
+    except InvalidToken:
+        pass  # Nothing left to revoke
+    except RevocationListFull:
+        print("Revocation list full; bearer token left valid")  # Debug log
+        return jsonify({'success': False, 'message': 'Server busy. Please try again shortly.'}), 503, {'Retry-After': '1'}
+    return jsonify({'success': True, 'message': 'Logged out'})
+
 @app.route('/api/auth/resend-otp', methods=['POST'])
 def resend_otp():
     try:
@@ -460,11 +470,15 @@ def resend_otp():
                 'message': 'User ID is required'
             }), 400
 
+        limited = rate_limited(('otp_resend_ip', request.remote_addr), ('otp_resend_user', str(user_id)))
+        if limited:
+            return limited
+
         conn = get_db_connection()
         cursor = conn.cursor()
 
         # Get user email
-        cursor.execute('SELECT email FROM users WHERE id = ?', (user_id,))
+        cursor.execute('SELECT id, email FROM users WHERE id = ?', (user_id,))
         user = cursor.fetchone()
 
         if not user:
@@ -473,18 +487,8 @@ def resend_otp():
                 'message': 'User not found'
             }), 404
 
-        # Generate new OTP
-        import random
-        otp = ''.join([str(random.randint(0, 9)) for _ in range(6)])
-        expires_at = time.time() + 300  # 5 minutes
-
-        # Store new OTP
-        cursor.execute('''
-            INSERT INTO otps (user_id, otp, expires_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, otp, expires_at))
-
-        conn.commit()
+        # New OTP, valid for 5 minutes; earlier ones stop working
+        otp = otp_store.issue(conn, user['id'])
         conn.close()
 
         # In production, send OTP via email/SMS
@@ -506,38 +510,109 @@ def get_vehicles():
     vtype = request.args.get('type')  # booking or rental
     category = request.args.get('category')
     subcategory = request.args.get('subcategory')
-    conn = get_db_connection()
-    query = 'SELECT * FROM vehicles WHERE 1=1'
-    params = []
-    if vtype:
-        query += ' AND type=?'
-        params.append(vtype)
-    if category:
-        query += ' AND category=?'
-        params.append(category)
-    if subcategory:
-        query += ' AND subcategory=?'
-        params.append(subcategory)
-    vehicles = conn.execute(query, params).fetchall()
-    conn.close()
-    return jsonify([dict(row) for row in vehicles])
-
-def calculate_price(service_type, pickup, destination):
-    # Base prices for different service types
-    base_prices = {
-        'standard': 50,
-        'premium': 100,
-        'shared': 30
-    }
-    
-    # Get base price for the service type
-    base_price = base_prices.get(service_type, 50)
-    
-    # In a real application, you would calculate distance between pickup and destination
-    # For now, we'll use a simple multiplier
-    distance_multiplier = 1.5
-    
-    return base_price * distance_multiplier
+
+    def load():
+        conn = get_db_connection()
+        query = 'SELECT * FROM vehicles WHERE 1=1'
+        params = []
+        if vtype:
+            query += ' AND type=?'
+            params.append(vtype)
+        if category:
+            query += ' AND category=?'
+            params.append(category)
+        if subcategory:
+            query += ' AND subcategory=?'
+            params.append(subcategory)
+        vehicles = [dict(row) for row in conn.execute(query, params).fetchall()]
+        conn.close()
+        return vehicles, len(vehicles)
+
+    return catalog_response(vehicle_catalog.get(('vehicles', vtype, category, subcategory), ('all',), load))
+
+def claim_vehicle(cursor, where, params, status):
+    # Atomically moves one available vehicle matching where to status and
+    # returns its row, or None if no vehicle matched. A single conditional
+    # UPDATE cannot hand the same vehicle to two callers.
+    cursor.execute(f'''
+        UPDATE vehicles SET status = ?
+        WHERE id = (
+            SELECT v.id FROM vehicles v
+            WHERE v.status = 'available' AND {where}
+            LIMIT 1
+        )
+        AND status = 'available'
+        RETURNING *
+    ''', [status, *params])
+    rows = cursor.fetchall()
+    return rows[0] if rows else None
+
+def get_point(data, prefix):
+    # Reads coordinates sent as {prefix}_location: {latitude, longitude}
+    # or as flat {prefix}_lat / {prefix}_lng fields
+    location = data.get(f'{prefix}_location') or {}
+    latitude = location.get('latitude', data.get(f'{prefix}_lat'))
+    longitude = location.get('longitude', data.get(f'{prefix}_lng'))
+    try:
+        return float(latitude), float(longitude)
+    except (TypeError, ValueError):
+        return None
+
+def calculate_price(service_type, pickup, destination, pickup_point=None, destination_point=None):
+    # Distance, time-of-day and surge aware fare; see fares.py
+    return fare_engine.quote(service_type, pickup, destination, pickup_point, destination_point)['price']
+
+# Place suggestions while typing a pickup or destination
+@app.route('/api/geocode/autocomplete', methods=['GET'])
+def geocode_autocomplete():
+    if geocoder is None:
+        return jsonify({'success': False, 'message': 'Geocoding is not configured'}), 503
+    return jsonify({'success': True, 'places': geocoder.autocomplete(request.args.get('q', ''))})
+
+@app.route('/api/geocode', methods=['GET'])
+def geocode():
+    if geocoder is None:
+        return jsonify({'success': False, 'message': 'Geocoding is not configured'}), 503
+    place = geocoder.lookup(request.args.get('q', ''))
+    if place is None:
+        return jsonify({'success': False, 'message': 'Place not found'}), 404
+    return jsonify({'success': True, 'place': place})
+
+# Road route between two points
+@app.route('/api/route', methods=['POST'])
+def get_route():
+    data = request.get_json(silent=True) or {}
+    origin = get_point(data, 'pickup')
+    destination = get_point(data, 'destination')
+    if not (origin and destination):
+        return jsonify({'success': False, 'message': 'pickup and destination coordinates are required'}), 400
+    if road_graph is None:
+        return jsonify({'success': False, 'message': 'Routing is not configured'}), 503
+    route = road_graph.route(origin, destination)
+    if route is None:
+        return jsonify({'success': False, 'message': 'No route between these points'}), 404
+    return jsonify({
+        'success': True,
+        'distance_km': round(route['distance_km'], 3),
+        'duration_s': round(route['duration_s'])
+    })
+
+# Fare quote shown before booking
+@app.route('/api/fare/quote', methods=['POST'])
+def fare_quote():
+    try:
+        data = request.get_json(silent=True) or {}
+        service_type = data.get('service_type', 'standard')
+        quote = fare_engine.quote(
+            service_type, data.get('pickup'), data.get('destination'),
+            get_point(data, 'pickup'), get_point(data, 'destination')
+        )
+        return jsonify({'success': True, 'service_type': service_type, **quote})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
 
 @app.route('/api/bookings/create', methods=['POST'])
 def create_booking():
@@ -550,9 +625,10 @@ def create_booking():
         data = request.get_json()
         print(f"Request Data: {data}")  # Debug log
         
-        # Get user ID from session or request data
-        user_id = session.get('user_id') or data.get('user_id')
-        print(f"User ID from session/data: {user_id}")  # Debug log
+        # Get user ID from the bearer token, session or request data
+        claims = token_claims()
+        user_id = claims['sub'] if claims else session.get('user_id') or data.get('user_id')
+        print(f"User ID from token/session/data: {user_id}")  # Debug log
         
         if not user_id:
             print("No user ID found in session or request data")  # Debug log
@@ -566,18 +642,22 @@ def create_booking():
         cursor = conn.cursor()
         
         try:
-            # Verify user exists
-            cursor.execute('SELECT id, name, gender, driver_gender_preference FROM users WHERE id = ?', (user_id,))
-            user = cursor.fetchone()
-            
-            if not user:
-                print(f"User not found in database: {user_id}")  # Debug log
-                return jsonify({
-                    'success': False,
-                    'message': 'User not found. Please log in again.'
-                }), 401
-            
-            print(f"Found user: {user['name']}")  # Debug log
+            if claims:
+                # Signed claims; no need to look the user up
+                user = {'id': user_id, 'gender': claims['g'], 'driver_gender_preference': claims['dgp']}
+            else:
+                # Verify user exists
+                cursor.execute('SELECT id, name, gender, driver_gender_preference FROM users WHERE id = ?', (user_id,))
+                user = cursor.fetchone()
+
+                if not user:
+                    print(f"User not found in database: {user_id}")  # Debug log
+                    return jsonify({
+                        'success': False,
+                        'message': 'User not found. Please log in again.'
+                    }), 401
+
+                print(f"Found user: {user['name']}")  # Debug log
             
             # Validate required fields
             required_fields = ['service_type', 'pickup', 'destination', 'pickup_time', 'passengers']
@@ -605,17 +685,33 @@ def create_booking():
             print(f"- Pickup Time: {pickup_time}")
             print(f"- Passengers: {passengers}")
 
-            # Find available vehicles
-            query = '''
-                SELECT v.* FROM vehicles v
-                WHERE v.status = 'available'
-                AND v.car_type = ?
-            '''
+            # Prefer the nearest matching vehicles when the pickup point is known
+            nearest = []
+            pickup_point = get_point(data, 'pickup') or fare_engine.locate(pickup)
+            if pickup_point:
+                nearest = dispatch_index.nearest(
+                    pickup_point[0], pickup_point[1], service_type, k=5,
+                    rider_gender=user['gender'],
+                    driver_gender_preference=user['driver_gender_preference'],
+                    is_rental=0
+                )
+                print(f"Nearest vehicles to pickup: {nearest}")  # Debug log
+
+            # Any other available match from the availability buckets. The index
+            # is only a hint: with no candidates the SQL claim below still runs.
+            candidates = [vehicle_id for vehicle_id, distance in nearest]
+            if not candidates:
+                candidates = dispatch_index.available_ids(
+                    service_type, user['gender'], user['driver_gender_preference'], is_rental=0
+                )
+
+            # Vehicle filter; rental vehicles are booked through /rent
+            where = 'v.car_type = ? AND v.is_rental = 0'
             params = [service_type]
 
             # Add gender preference conditions if user has preferences
             if user['gender'] and user['driver_gender_preference']:
-                query += '''
+                where += '''
                     AND (
                         v.customer_gender_preference IS NULL 
                         OR v.customer_gender_preference = ? 
@@ -625,37 +721,44 @@ def create_booking():
                 params.append(user['gender'])
 
                 if user['driver_gender_preference'] != 'any':
-                    query += ' AND v.driver_gender = ?'
+                    where += ' AND v.driver_gender = ?'
                     params.append(user['driver_gender_preference'])
 
-            print(f"Vehicle search query: {query}")  # Debug log
+            print(f"Vehicle filter: {where}")  # Debug log
             print(f"Query parameters: {params}")  # Debug log
 
-            cursor.execute(query, params)
-            available_vehicles = cursor.fetchall()
-            print(f"Found {len(available_vehicles)} available vehicles")  # Debug log
-
-            if not available_vehicles:
-                return jsonify({
-                    'success': False,
-                    'message': 'No suitable vehicles available at the moment. Please try again later.'
-                }), 404
-
-            # Select first available vehicle
-            vehicle = available_vehicles[0]
-            vehicle_id = vehicle['id']
-            print(f"Selected vehicle: {vehicle['car_model']} ({vehicle['car_number']})")  # Debug log
-
             # Calculate price
             try:
-                price = calculate_price(service_type, pickup, destination)
+                price = calculate_price(service_type, pickup, destination, pickup_point, get_point(data, 'destination'))
                 print(f"Calculated price: {price}")  # Debug log
             except Exception as e:
                 print(f"Error calculating price: {str(e)}")  # Debug log
                 price = 50.00  # Default price if calculation fails
 
-            # Create booking
+            # Claim a vehicle and create the booking in one write transaction
             try:
+                cursor.execute('BEGIN IMMEDIATE')
+
+                vehicle = None
+                for candidate_id in candidates:
+                    # The index may be stale; the claim rechecks the whole filter
+                    vehicle = claim_vehicle(cursor, where + ' AND v.id = ?', params + [candidate_id], 'booked')
+                    if vehicle:
+                        break
+                if vehicle is None:
+                    # No candidates, or all taken by another worker; fall back to any matching vehicle
+                    vehicle = claim_vehicle(cursor, where, params, 'booked')
+
+                if vehicle is None:
+                    conn.rollback()
+                    return jsonify({
+                        'success': False,
+                        'message': 'No suitable vehicles available at the moment. Please try again later.'
+                    }), 404
+
+                vehicle_id = vehicle['id']
+                print(f"Claimed vehicle: {vehicle['car_model']} ({vehicle['car_number']})")  # Debug log
+
                 cursor.execute('''
                     INSERT INTO bookings (
                         user_id, vehicle_id, service_type, pickup, destination, 
@@ -669,13 +772,23 @@ def create_booking():
                 booking_id = cursor.lastrowid
                 print(f"Created booking with ID: {booking_id}")  # Debug log
 
-                # Update vehicle status
-                cursor.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('booked', vehicle_id))
-                print(f"Updated vehicle {vehicle_id} status to 'booked'")  # Debug log
-
                 conn.commit()
                 print("Database transaction committed successfully")  # Debug log
 
+                # The booking stands from here on; a failure below is logged,
+                # never answered with an error a client would retry
+                try:
+                    # The claimed row as committed, whatever the index held before
+                    dispatch_index.upsert_vehicle(
+                        vehicle_id, vehicle['car_type'], vehicle['status'], vehicle['driver_gender'],
+                        vehicle['customer_gender_preference'], vehicle['is_rental']
+                    )
+                    vehicle_catalog.vehicle_changed(vehicle['is_rental'])
+                    telemetry_monitor.start_ride(booking_id, user_id, vehicle_id)
+                    fare_engine.record_demand(pickup_point)
+                except Exception as e:
+                    print(f"Error updating caches after booking {booking_id}: {str(e)}")  # Debug log
+
                 return jsonify({
                     'success': True,
                     'message': 'Booking created successfully',
@@ -708,6 +821,8 @@ def create_booking():
             conn.close()
             print("Database connection closed")  # Debug log
 
+    except InvalidToken as e:
+        return jsonify({'success': False, 'message': str(e)}), 401
     except Exception as e:
         print(f"Unexpected error: {str(e)}")  # Debug log
         return jsonify({
@@ -717,36 +832,82 @@ def create_booking():
 
     print("=== Booking Process Completed ===\n")  # Debug log
 
-# Endpoint to get all bookings
+# Columns /bookings can return via ?fields=; the first group is covered by
+# idx_bookings_user_page, so a page of only those never reads the table
+BOOKING_SUMMARY_FIELDS = ['id', 'created_at', 'status', 'service_type', 'price', 'vehicle_id']
+BOOKING_FIELDS = BOOKING_SUMMARY_FIELDS + [
+    'user_id', 'pickup', 'destination', 'pickup_time', 'passengers', 'instructions', 'document_path'
+]
+BOOKING_VEHICLE_FIELDS = ['driver_name', 'car_model', 'car_number']
+BOOKINGS_PAGE_SIZE = 20
+MAX_BOOKINGS_PAGE_SIZE = 100
+
+def encode_booking_cursor(created_at, booking_id):
+    return base64.urlsafe_b64encode(f'{created_at}|{booking_id}'.encode()).decode().rstrip('=')
+
+def decode_booking_cursor(cursor):
+    text = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+    created_at, _, booking_id = text.rpartition('|')
+    return created_at, int(booking_id)
+
+# A rider's bookings, newest first, one keyset page at a time:
+#   /bookings?limit=20&fields=id,status,price&cursor=<next_cursor>
 @app.route('/bookings', methods=['GET'])
 def get_bookings():
     try:
-        user_id = request.cookies.get('user_id') or 1  # For testing
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT b.*, v.driver_name, v.car_model, v.car_number
-            FROM bookings b
-            LEFT JOIN vehicles v ON b.vehicle_id = v.id
-            WHERE b.user_id = ?
-            ORDER BY b.created_at DESC
-        ''', (user_id,))
-        
-        bookings = cursor.fetchall()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'bookings': [dict(row) for row in bookings]
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'message': str(e)
-        }), 500
+        claims = token_claims()
+        user_id = claims['sub'] if claims else session.get('user_id') or request.cookies.get('user_id') or 1  # For testing
+
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else BOOKING_FIELDS + BOOKING_VEHICLE_FIELDS
+        unknown = [f for f in fields if f not in BOOKING_FIELDS and f not in BOOKING_VEHICLE_FIELDS]
+        if unknown:
+            return jsonify({
+                'success': False,
+                'message': f'Unknown fields: {", ".join(unknown)}'
+            }), 400
+        limit = max(1, min(int(request.args.get('limit', BOOKINGS_PAGE_SIZE)), MAX_BOOKINGS_PAGE_SIZE))
+
+        # created_at and id always come last, for the next cursor
+        columns = [f'v.{f}' if f in BOOKING_VEHICLE_FIELDS else f'b.{f}' for f in fields]
+        query = f'SELECT {", ".join(columns + ["b.created_at", "b.id"])} FROM bookings b'
+        if any(f in BOOKING_VEHICLE_FIELDS for f in fields):
+            query += ' LEFT JOIN vehicles v ON b.vehicle_id = v.id'
+        query += ' WHERE b.user_id = ?'
+        params = [user_id]
+        if request.args.get('cursor'):
+            try:
+                created_at, booking_id = decode_booking_cursor(request.args['cursor'])
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
+            query += ' AND (b.created_at, b.id) < (?, ?)'
+            params += [created_at, booking_id]
+        query += ' ORDER BY b.created_at DESC, b.id DESC LIMIT ?'
+        # One extra row tells whether there is a next page
+        params.append(limit + 1)
+    except InvalidToken as e:
+        return jsonify({'success': False, 'message': str(e)}), 401
+    except ValueError:
+        return jsonify({'success': False, 'message': 'limit must be a number'}), 400
+
+    def generate():
+        # Rows are serialized as they are read; the connection goes back to
+        # the pool when the stream ends or the client goes away
+        conn = db_pool.acquire()
+        try:
+            yield '{"success":true,"bookings":['
+            last = next_cursor = None
+            for count, row in enumerate(conn.execute(query, params)):
+                if count == limit:
+                    next_cursor = encode_booking_cursor(*last)
+                    break
+                yield (',' if count else '') + json.dumps(dict(zip(fields, row)))
+                last = (row[-2], row[-1])
+            yield f'],"next_cursor":{json.dumps(next_cursor)}}}'
+        finally:
+            conn.close()
+
+    return Response(generate(), mimetype='application/json')
 
 # Admin login endpoint
 @app.route('/admin_login', methods=['POST'])
@@ -789,6 +950,7 @@ def add_vehicle():
     ))
     conn.commit()
     conn.close()
+    vehicle_catalog.invalidate(*CATALOG_TAGS)
     return jsonify({'message': 'Vehicle added successfully'})
 
 @app.route('/sos', methods=['POST'])
@@ -796,8 +958,12 @@ def trigger_sos():
     try:
         print("SOS trigger received")  # Debug log
         
-        # Get user_id from either session or request
-        user_id = session.get('user_id')
+        # Get user_id from the bearer token, session or request
+        try:
+            claims = token_claims()
+        except InvalidToken:
+            claims = None  # A stale token must not block an SOS
+        user_id = claims['sub'] if claims else session.get('user_id')
         if not user_id:
             data = request.get_json()
             user_id = data.get('userId')
@@ -862,29 +1028,24 @@ def trigger_sos():
         
         trigger_id = cursor.lastrowid
         
-        # Get trigger count in last 5 minutes
-        cursor.execute('''
-            SELECT COUNT(*) as count
-            FROM sos_triggers
-            WHERE user_id = ?
-            AND timestamp > datetime('now', '-5 minutes')
-        ''', (user_id,))
-        
-        trigger_count = cursor.fetchone()['count']
-        
         conn.commit()
         conn.close()
         
-        # If conditions are met or this is the third trigger, notify contacts
+        # Get trigger count in last 5 minutes
+        trigger_count = sos_counter.hit(user_id)
+        
+        # If conditions are met or this is the third trigger, notify contacts.
+        # Delivery happens in the background; the client polls the dispatch.
+        dispatch_id = None
         if should_alert or trigger_count >= 3:
-            for contact in emergency_contacts:
-                message = f"EMERGENCY ALERT: User {user_id} has triggered an SOS alert at location {current_location['latitude']}, {current_location['longitude']}"
-                send_sms(contact['phone'], message)
+            message = f"EMERGENCY ALERT: User {user_id} has triggered an SOS alert at location {current_location['latitude']}, {current_location['longitude']}"
+            dispatch_id = notification_dispatcher.enqueue(user_id, message, emergency_contacts, trigger_id=trigger_id)
         
         return jsonify({
             'success': True,
             'trigger_id': trigger_id,
             'trigger_count': trigger_count,
+            'dispatch_id': dispatch_id,
             'message': 'SOS alert processed successfully'
         })
         
@@ -898,87 +1059,29 @@ def trigger_sos():
 def check_emergency_conditions(user_id, current_location, current_speed):
     try:
         print(f"Checking emergency conditions for user {user_id}")  # Debug log
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get user's emergency conditions
-        cursor.execute('SELECT * FROM emergency_conditions WHERE user_id = ?', (user_id,))
-        conditions = cursor.fetchone()
-        
-        if not conditions:
+        rules = emergency_rules.get(user_id)
+        if rules is None:
             print("No emergency conditions found")  # Debug log
             return False, []
-            
-        should_alert = False
-        emergency_contacts = json.loads(conditions['emergency_contacts']) if conditions['emergency_contacts'] else []
-        
-        # Check location condition
-        if conditions['location_condition'] == 'away' and current_location:
-            try:
-                # Get user's home location
-                cursor.execute('SELECT home_location FROM users WHERE id = ?', (user_id,))
-                home_location = cursor.fetchone()['home_location']
-                
-                if home_location:
-                    home_loc = json.loads(home_location)
-                    distance = calculate_distance(
-                        (home_loc['latitude'], home_loc['longitude']),
-                        (current_location['latitude'], current_location['longitude'])
-                    )
-                    if distance > conditions['distance_threshold']:
-                        should_alert = True
-                        print(f"Location condition met: Distance {distance} > threshold {conditions['distance_threshold']}")  # Debug log
-            except Exception as e:
-                print(f"Error checking location condition: {str(e)}")  # Debug log
-        
-        # Check time condition
-        if conditions['time_condition']:
-            current_time = datetime.now().time()
-            start_time = datetime.strptime(conditions['time_start'], '%H:%M').time()
-            end_time = datetime.strptime(conditions['time_end'], '%H:%M').time()
-            
-            if conditions['time_condition'] == 'outside':
-                if current_time < start_time or current_time > end_time:
-                    should_alert = True
-                    print("Time condition met: Outside allowed hours")  # Debug log
-            elif conditions['time_condition'] == 'inside':
-                if start_time <= current_time <= end_time:
-                    should_alert = True
-                    print("Time condition met: Inside specified hours")  # Debug log
-        
-        # Check speed condition
-        if conditions['speed_condition'] and conditions['speed_threshold']:
-            if (conditions['speed_condition'] == 'above' and current_speed > conditions['speed_threshold']) or \
-               (conditions['speed_condition'] == 'below' and current_speed < conditions['speed_threshold']):
-                should_alert = True
-                print(f"Speed condition met: {current_speed} {conditions['speed_condition']} threshold {conditions['speed_threshold']}")  # Debug log
-        
-        return should_alert, emergency_contacts
+
+        latitude = current_location.get('latitude') if current_location else None
+        longitude = current_location.get('longitude') if current_location else None
+        should_alert = rules.evaluate(
+            float(latitude) if latitude is not None else None,
+            float(longitude) if longitude is not None else None,
+            float(current_speed or 0)
+        )
+        if should_alert:
+            print(f"Emergency condition met: {rules.predicate.describe()}")  # Debug log
+        return should_alert, rules.contacts
         
     except Exception as e:
         print(f"Error checking emergency conditions: {str(e)}")  # Debug log
         return False, []
-    finally:
-        if 'conn' in locals():
-            conn.close()
 
 def calculate_distance(loc1, loc2):
-    from math import sin, cos, sqrt, atan2, radians
-    
-    # Approximate radius of earth in km
-    R = 6371.0
-    
-    lat1, lon1 = radians(loc1[0]), radians(loc1[1])
-    lat2, lon2 = radians(loc2[0]), radians(loc2[1])
-    
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    
-    distance = R * c
-    return distance
+    # Kilometres between two (lat, lon) pairs; see geodistance for batches
+    return haversine_km(loc1[0], loc1[1], loc2[0], loc2[1])
 
 def send_sms(phone_number, message):
     try:
@@ -990,6 +1093,88 @@ def send_sms(phone_number, message):
         print(f"Error sending SMS: {str(e)}")  # Debug log
         return False
 
+# Emergency contacts are notified from a durable outbox by a background worker pool
+notification_dispatcher = NotificationDispatcher(db_pool, gateway=send_sms)
+
+@app.route('/api/sos/dispatch/<int:dispatch_id>', methods=['GET'])
+def sos_dispatch_status(dispatch_id):
+    try:
+        dispatch = notification_dispatcher.status(dispatch_id)
+        if dispatch is None:
+            return jsonify({
+                'success': False,
+                'message': 'Dispatch not found'
+            }), 404
+        return jsonify({
+            'success': True,
+            'dispatch': dispatch
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+def raise_telemetry_alert(ride, rules, latitude, longitude, speed):
+    # Recorded like a manual SOS, then the rider's contacts are notified
+    print(f"Automatic alert for ride {ride.ride_id}: {rules.monitor.describe()}")  # Debug log
+    conn = db_pool.acquire()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            INSERT INTO sos_triggers (user_id, latitude, longitude, speed, timestamp)
+            VALUES (?, ?, ?, ?, datetime('now'))
+        ''', (ride.user_id, latitude, longitude, speed))
+        trigger_id = cursor.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    sos_counter.hit(ride.user_id)
+    message = f"EMERGENCY ALERT: Ride {ride.ride_id} of user {ride.user_id} met an emergency condition at location {latitude}, {longitude}"
+    notification_dispatcher.enqueue(ride.user_id, message, rules.contacts, trigger_id=trigger_id)
+
+# Evaluates emergency conditions continuously on the pings of active rides
+telemetry_monitor = TelemetryMonitor(emergency_rules, on_alert=raise_telemetry_alert)
+
+# Rider app telemetry for an active ride
+@app.route('/api/rides/telemetry', methods=['POST'])
+def ride_telemetry():
+    data = request.get_json(silent=True) or {}
+    try:
+        claims = token_claims()
+    except InvalidToken as e:
+        return jsonify({'success': False, 'message': str(e)}), 401
+    user_id = claims['sub'] if claims else session.get('user_id') or data.get('userId')
+    if not user_id:
+        return jsonify({'success': False, 'message': 'Please log in'}), 401
+    try:
+        booking_id = int(data['booking_id'])
+        pings = data.get('pings') or [data]
+        parsed = [(
+            float(ping['latitude']),
+            float(ping['longitude']),
+            float(ping['speed']) if ping.get('speed') is not None else None,
+            float(ping.get('timestamp') or time.time())
+        ) for ping in pings[:MAX_PINGS_PER_BATCH]]
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'booking_id and pings with latitude and longitude are required'}), 400
+
+    if not telemetry_monitor.has_ride(booking_id):
+        # Ride booked through another worker, or forgotten after being idle
+        conn = get_db_connection()
+        booking = conn.execute(
+            'SELECT user_id, vehicle_id, status FROM bookings WHERE id = ?', (booking_id,)
+        ).fetchone()
+        conn.close()
+        if booking is None or str(booking['user_id']) != str(user_id):
+            return jsonify({'success': False, 'message': 'Booking not found'}), 404
+        if booking['status'] in ('completed', 'cancelled'):
+            return jsonify({'success': False, 'message': 'Ride is not active'}), 409
+        telemetry_monitor.start_ride(booking_id, booking['user_id'], booking['vehicle_id'])
+
+    accepted = sum(telemetry_monitor.submit(booking_id, *ping) for ping in parsed)
+    return jsonify({'success': True, 'accepted': accepted})
+
 @app.route('/sos_audio', methods=['POST'])
 def sos_audio():
     if 'audio' in request.files:
@@ -999,6 +1184,23 @@ def sos_audio():
         return jsonify({'message': 'Audio received'})
     return jsonify({'error': 'No audio received'}), 400
 
+def video_mimetype(upload):
+    # Only video types are echoed back as Content-Type when the file is streamed
+    mimetype = (upload.mimetype or '').lower()
+    return mimetype if re.fullmatch(r'video/[a-z0-9.+-]+', mimetype) else DEFAULT_VIDEO_MIMETYPE
+
+def upgrade_legacy_video(file_path):
+    # Re-encrypts a single-token Fernet file into the chunked format, once,
+    # so it can be streamed by range like any new upload. The whole file is
+    # decrypted in memory this one time only.
+    with open(file_path, 'rb') as f:
+        plaintext = cipher_suite.decrypt(f.read())
+    upgraded_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.upgrade'
+    video_cipher.encrypt_stream(io.BytesIO(plaintext), upgraded_path)
+    # Concurrent upgrades each write their own file; whichever lands last wins
+    os.replace(upgraded_path, file_path)
+    print(f"Upgraded legacy video {file_path} to chunked encryption")  # Debug log
+
 @app.route('/sos_video', methods=['POST'])
 def handle_sos_video():
     try:
@@ -1028,18 +1230,13 @@ def handle_sos_video():
         if not os.path.exists(vehicle_dir):
             os.makedirs(vehicle_dir)
         
-        # Read video data
-        video_data = video.read()
-        
-        # Encrypt the video data
-        encrypted_data = cipher_suite.encrypt(video_data)
-        
         # Save encrypted video with camera type in filename
         filename = f'sos_video_{camera_type}_{timestamp}.enc'
         filepath = os.path.join(vehicle_dir, filename)
         
-        with open(filepath, 'wb') as f:
-            f.write(encrypted_data)
+        # Encrypt the upload chunk by chunk straight to disk
+        video_size = video_cipher.encrypt_stream(video.stream, filepath)
+        print(f"Encrypted {video_size} bytes of SOS video to {filepath}")  # Debug log
         
         # Store file information in database
         conn = get_db_connection()
@@ -1053,15 +1250,17 @@ def handle_sos_video():
                 password_hash,
                 camera_type,
                 location,
+                mimetype,
                 created_at
-            ) VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'))
         ''', (
             user_id, 
             vehicle_id, 
             filepath, 
             hashlib.sha256(password.encode()).hexdigest(),
             camera_type,
-            location
+            location,
+            video_mimetype(video)
         ))
         
         conn.commit()
@@ -1102,18 +1301,13 @@ def handle_vehicle_video():
         if not os.path.exists(vehicle_dir):
             os.makedirs(vehicle_dir)
         
-        # Read video data
-        video_data = video.read()
-        
-        # Encrypt the video data
-        encrypted_data = cipher_suite.encrypt(video_data)
-        
         # Save encrypted video
         filename = f'vehicle_video_{camera_type}_{timestamp}.enc'
         filepath = os.path.join(vehicle_dir, filename)
         
-        with open(filepath, 'wb') as f:
-            f.write(encrypted_data)
+        # Encrypt the upload chunk by chunk straight to disk
+        video_size = video_cipher.encrypt_stream(video.stream, filepath)
+        print(f"Encrypted {video_size} bytes of vehicle video to {filepath}")  # Debug log
         
         # Store file information in database
         conn = get_db_connection()
@@ -1125,13 +1319,15 @@ def handle_vehicle_video():
                 file_path, 
                 password_hash,
                 camera_type,
+                mimetype,
                 created_at
-            ) VALUES (?, ?, ?, ?, datetime('now'))
+            ) VALUES (?, ?, ?, ?, ?, datetime('now'))
         ''', (
             vehicle_id, 
             filepath, 
             hashlib.sha256(password.encode()).hexdigest(),
-            camera_type
+            camera_type,
+            video_mimetype(video)
         ))
         
         conn.commit()
@@ -1150,6 +1346,9 @@ def handle_vehicle_video():
             'message': str(e)
         }), 500
 
+VIDEO_GRANT_SECONDS = 15 * 60  # How long a verified playback link stays valid
+DEFAULT_VIDEO_MIMETYPE = 'video/webm'  # What the recorder produces; assumed for older rows
+
 @app.route('/access_secure_video', methods=['POST'])
 def access_secure_video():
     try:
@@ -1166,7 +1365,7 @@ def access_secure_video():
         
         # Verify password and user access
         cursor.execute('''
-            SELECT password_hash, user_id 
+            SELECT id, password_hash, user_id 
             FROM secure_storage 
             WHERE file_path = ?
         ''', (file_path,))
@@ -1182,15 +1381,23 @@ def access_secure_video():
         if str(record['user_id']) != str(user_id):
             return jsonify({'error': 'Unauthorized access'}), 403
             
-        # Read and decrypt the file
-        with open(file_path, 'rb') as f:
-            encrypted_data = f.read()
-            
-        decrypted_data = cipher_suite.decrypt(encrypted_data)
+        # Grant playback for this file; the video itself is streamed by
+        # stream_secure_video so players can seek with Range requests.
+        # Responses no longer carry the decrypted video as video_data; callers
+        # fetch stream_url with the same session instead (see README).
+        now = time.time()
+        grants = {
+            file_id: expires_at
+            for file_id, expires_at in session.get('video_grants', {}).items()
+            if expires_at > now
+        }
+        grants[str(record['id'])] = now + VIDEO_GRANT_SECONDS
+        session['video_grants'] = grants
         
         return jsonify({
             'success': True,
-            'video_data': decrypted_data.decode('latin1')
+            'stream_url': url_for('stream_secure_video', file_id=record['id']),
+            'expires_in': VIDEO_GRANT_SECONDS
         })
         
     except Exception as e:
@@ -1200,6 +1407,54 @@ def access_secure_video():
             'message': str(e)
         }), 500
 
+@app.route('/secure_video/<int:file_id>', methods=['GET'])
+def stream_secure_video(file_id):
+    try:
+        expires_at = session.get('video_grants', {}).get(str(file_id))
+        if not expires_at or expires_at < time.time():
+            return jsonify({'error': 'Unauthorized access'}), 403
+        
+        conn = get_db_connection()
+        record = conn.execute('SELECT file_path, mimetype FROM secure_storage WHERE id = ?', (file_id,)).fetchone()
+        conn.close()
+        
+        if not record or not os.path.exists(record['file_path']):
+            return jsonify({'error': 'File not found'}), 404
+        file_path = record['file_path']
+        
+        if not is_chunked_file(file_path):
+            # Legacy single-token Fernet files cannot be decrypted partially
+            upgrade_legacy_video(file_path)
+        size = video_cipher.plaintext_size(file_path)
+        
+        headers = {'Accept-Ranges': 'bytes', 'Cache-Control': 'private, no-store'}
+        status = 200
+        start, stop = 0, size
+        if request.range is not None:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, stop = byte_range
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+            status = 206
+        headers['Content-Length'] = str(stop - start)
+        
+        return Response(
+            video_cipher.iter_range(file_path, start, stop),
+            status=status,
+            mimetype=record['mimetype'] or DEFAULT_VIDEO_MIMETYPE,
+            headers=headers,
+            direct_passthrough=True
+        )
+        
+    except Exception as e:
+        print(f"Error streaming video: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
 # Endpoint to upload a document for rental
 @app.route('/upload_document', methods=['POST'])
 def upload_document():
@@ -1251,6 +1506,10 @@ def register_vehicle():
         ''', (driver_name, car_model, car_number, car_type, aadhaar_number, driver_gender, customer_gender_preference))
 
         conn.commit()
+        dispatch_index.upsert_vehicle(
+            cursor.lastrowid, car_type, 'available', driver_gender, customer_gender_preference
+        )
+        vehicle_catalog.vehicle_changed(False)
         conn.close()
 
         return jsonify({
@@ -1262,30 +1521,105 @@ def register_vehicle():
         print(f"Vehicle registration error: {str(e)}")  # Debug log
         return jsonify({'success': False, 'message': 'Vehicle registration failed. Please try again.'}), 500
 
+def ingest_pings(pings):
+    timestamp = int(time.time())
+    parsed = [parse_ping(ping, timestamp) for ping in pings]
+    location_buffer.submit(parsed)
+    for vehicle_id, latitude, longitude, ping_time in parsed:
+        dispatch_index.update_position(vehicle_id, latitude, longitude, ping_time)
+        telemetry_monitor.submit_vehicle(vehicle_id, latitude, longitude, ping_time)
+    return len(parsed)
+
 # Update vehicle location
 @app.route('/update_location', methods=['POST'])
 def update_location():
-    data = request.json
-    vehicle_id = data.get('vehicle_id')
-    latitude = data.get('latitude')
-    longitude = data.get('longitude')
-    timestamp = int(time.time())
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute('''INSERT INTO vehicle_locations (vehicle_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)''',
-        (vehicle_id, latitude, longitude, timestamp))
-    conn.commit()
-    conn.close()
+    try:
+        ingest_pings([request.json])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify({'message': 'Location updated'})
 
+# Update many vehicle locations in one request
+@app.route('/update_locations', methods=['POST'])
+def update_locations():
+    data = request.get_json(silent=True) or {}
+    pings = data.get('pings')
+    if not isinstance(pings, list) or not pings:
+        return jsonify({'error': 'pings must be a non-empty list'}), 400
+    if len(pings) > MAX_PINGS_PER_BATCH:
+        return jsonify({'error': f'At most {MAX_PINGS_PER_BATCH} pings per request'}), 413
+    try:
+        accepted = ingest_pings(pings)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'message': 'Locations updated', 'accepted': accepted})
+
 # Get all vehicle locations (for admin)
 @app.route('/get_locations', methods=['GET'])
 def get_locations():
     conn = get_db_connection()
-    locations = conn.execute('''SELECT v.id as vehicle_id, v.driver_name, v.car_model, v.car_number, l.latitude, l.longitude, l.timestamp FROM vehicles v JOIN vehicle_locations l ON v.id = l.vehicle_id WHERE l.id IN (SELECT MAX(id) FROM vehicle_locations GROUP BY vehicle_id)''').fetchall()
+    locations = conn.execute('''
+        SELECT v.id as vehicle_id, v.driver_name, v.car_model, v.car_number, l.latitude, l.longitude, l.timestamp
+        FROM vehicle_latest_location l
+        JOIN vehicles v ON v.id = l.vehicle_id
+    ''').fetchall()
     conn.close()
     return jsonify([dict(row) for row in locations])
 
+# Nearest available vehicles to a point
+@app.route('/api/vehicles/nearest', methods=['GET'])
+def get_nearest_vehicles():
+    try:
+        latitude = float(request.args['lat'])
+        longitude = float(request.args['lng'])
+    except (KeyError, ValueError):
+        return jsonify({'success': False, 'message': 'lat and lng are required'}), 400
+    car_type = request.args.get('car_type', 'standard')
+    try:
+        k = max(1, min(int(request.args.get('k', 5)), 50))
+    except ValueError:
+        return jsonify({'success': False, 'message': 'k must be an integer'}), 400
+    nearest = dispatch_index.nearest(
+        latitude, longitude, car_type, k=k,
+        rider_gender=request.args.get('gender'),
+        driver_gender_preference=request.args.get('driver_gender_preference')
+    )
+    return jsonify({
+        'success': True,
+        'vehicles': [
+            {'vehicle_id': vehicle_id, 'distance_km': round(distance, 3)}
+            for vehicle_id, distance in nearest
+        ]
+    })
+
+# Available vehicle counts from the in-memory buckets; never reads SQLite
+@app.route('/api/availability', methods=['GET'])
+def get_availability():
+    car_type = request.args.get('car_type')
+    is_rental = request.args.get('is_rental')
+    is_rental = int(is_rental in ('1', 'true')) if is_rental is not None else None
+    buckets = [
+        {
+            'car_type': bucket_type,
+            'driver_gender': driver_gender,
+            'customer_gender_preference': customer_gender_preference,
+            'is_rental': bool(bucket_rental),
+            'available': count
+        }
+        for bucket_type, driver_gender, customer_gender_preference, bucket_rental, count in dispatch_index.availability()
+        if (car_type is None or bucket_type == car_type) and (is_rental is None or bucket_rental == is_rental)
+    ]
+    by_type = {}
+    for bucket in buckets:
+        by_type[bucket['car_type']] = by_type.get(bucket['car_type'], 0) + bucket['available']
+    result = {'success': True, 'by_type': by_type, 'buckets': buckets}
+    if car_type:
+        # What this rider could book right now
+        result['matching'] = dispatch_index.count_matching(
+            car_type, request.args.get('gender'), request.args.get('driver_gender_preference'), is_rental
+        )
+    return jsonify(result)
+
 @app.route('/premium_sos', methods=['POST'])
 def premium_sos():
     try:
@@ -1371,6 +1705,10 @@ def rent_vehicle():
                 'success': False,
                 'message': 'Invalid date format. Please use YYYY-MM-DD'
             }), 400
+        # strptime accepts '2024-1-5'; rentals store zero-padded dates so the
+        # overlap check can compare them as strings
+        start_date = start.strftime('%Y-%m-%d')
+        end_date = end.strftime('%Y-%m-%d')
         
         if start >= end:
             print("Rental error: End date must be after start date")  # Debug log
@@ -1396,6 +1734,7 @@ def rent_vehicle():
                 
             print(f"Vehicle found: {vehicle['car_model']}, Status: {vehicle['status']}, Is Rental: {vehicle['is_rental']}, Price: {vehicle['rental_price']}")  # Debug log
                 
+            # status only marks vehicles out of service; date clashes are checked below
             if vehicle['status'] != 'available':
                 print(f"Rental error: Vehicle not available - Status: {vehicle['status']}")  # Debug log
                 return jsonify({
@@ -1423,18 +1762,44 @@ def rent_vehicle():
             
             print(f"Calculated rental - Duration: {duration} days, Total Price: {total_price}")  # Debug log
             
+            # Fast rejection from the in-memory calendar
+            rental_calendar.refresh(conn)
+            if not rental_calendar.is_free(vehicle['id'], start_date, end_date):
+                print(f"Rental error: Vehicle {vehicle_id} already reserved for these dates")  # Debug log
+                return jsonify({
+                    'success': False,
+                    'message': 'Vehicle is already reserved for these dates'
+                }), 409
+            
+            # Re-check the dates and create the rental in one write transaction,
+            # so concurrent requests (from any worker) cannot overlap
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute(f'''
+                SELECT id FROM rentals
+                WHERE vehicle_id = ? AND start_date < ? AND end_date > ?
+                AND status IN ({', '.join('?' for _ in ACTIVE_RENTAL_STATUSES)})
+                LIMIT 1
+            ''', (vehicle['id'], end_date, start_date, *ACTIVE_RENTAL_STATUSES))
+            if cursor.fetchone():
+                conn.rollback()
+                print(f"Rental error: Vehicle {vehicle_id} was reserved concurrently")  # Debug log
+                return jsonify({
+                    'success': False,
+                    'message': 'Vehicle is already reserved for these dates'
+                }), 409
+            
             # Create rental
             cursor.execute('''
                 INSERT INTO rentals (user_id, vehicle_id, start_date, end_date, status, total_price, requirements)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (session['user_id'], vehicle_id, start_date, end_date, 'pending', total_price, requirements))
+            ''', (session['user_id'], vehicle['id'], start_date, end_date, 'pending', total_price, requirements))
             
             rental_id = cursor.lastrowid
             
-            # Update vehicle status
-            cursor.execute('UPDATE vehicles SET status = ? WHERE id = ?', ('rented', vehicle_id))
-            
             conn.commit()
+            rental_calendar.add(vehicle['id'], start_date, end_date, rental_id)
+            # Vehicle rows are unchanged; only date-window listings move
+            vehicle_catalog.invalidate('rental_dates')
             print(f"Rental created successfully - ID: {rental_id}")  # Debug log
             
             return jsonify({
@@ -1467,34 +1832,63 @@ def rent_vehicle():
 def get_available_vehicles():
     try:
         vehicle_type = request.args.get('type', 'booking')
+        start_date = request.args.get('start')
+        end_date = request.args.get('end')
         print(f"Fetching available vehicles for type: {vehicle_type}")  # Debug log
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if vehicle_type == 'rental':
-            cursor.execute('''
-                SELECT * FROM vehicles 
-                WHERE status = 'available' 
-                AND is_rental = 1 
-                AND rental_price IS NOT NULL
-            ''')
+        if start_date or end_date:
+            # Date-range mode only applies to rental vehicles
+            try:
+                start = datetime.strptime(start_date or '', '%Y-%m-%d')
+                end = datetime.strptime(end_date or '', '%Y-%m-%d')
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'message': 'Invalid date format. Please use YYYY-MM-DD'
+                }), 400
+            if start >= end:
+                return jsonify({
+                    'success': False,
+                    'message': 'End date must be after start date'
+                }), 400
+            vehicle_type = 'rental'
+
+        def load():
+            conn = get_db_connection()
+            cursor = conn.cursor()
+
+            if vehicle_type == 'rental':
+                cursor.execute('''
+                    SELECT * FROM vehicles 
+                    WHERE status = 'available' 
+                    AND is_rental = 1 
+                    AND rental_price IS NOT NULL
+                ''')
+            else:
+                cursor.execute('''
+                    SELECT * FROM vehicles 
+                    WHERE status = 'available' 
+                    AND is_rental = 0
+                ''')
+
+            vehicles = [dict(row) for row in cursor.fetchall()]
+
+            if start_date:
+                # One bisect per vehicle against the calendar, no rental rows read
+                rental_calendar.refresh(conn)
+                free_ids = set(rental_calendar.free_vehicles([v['id'] for v in vehicles], start, end))
+                vehicles = [v for v in vehicles if v['id'] in free_ids]
+
+            conn.close()
+            return {'success': True, 'vehicles': vehicles}, len(vehicles)
+
+        if start_date:
+            key, tags = ('available', 'rental', start_date, end_date), ('rental', 'rental_dates')
         else:
-            cursor.execute('''
-                SELECT * FROM vehicles 
-                WHERE status = 'available' 
-                AND is_rental = 0
-            ''')
-        
-        vehicles = [dict(row) for row in cursor.fetchall()]
-        print(f"Found {len(vehicles)} available vehicles")  # Debug log
-        
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'vehicles': vehicles
-        })
+            key, tags = ('available', vehicle_type), ('rental',) if vehicle_type == 'rental' else ('booking',)
+        entry = vehicle_catalog.get(key, tags, load)
+        print(f"Found {entry.count} available vehicles")  # Debug log
+        return catalog_response(entry)
     except Exception as e:
         print(f"Error getting vehicles: {str(e)}")  # Debug log
         return jsonify({
@@ -1502,6 +1896,34 @@ def get_available_vehicles():
             'message': str(e)
         }), 400
 
+# Reservations and free date windows for one rental vehicle
+@app.route('/api/rentals/calendar/<int:vehicle_id>', methods=['GET'])
+def get_rental_calendar(vehicle_id):
+    start_date = request.args.get('start', datetime.now().strftime('%Y-%m-%d'))
+    end_date = request.args.get('end')
+    try:
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d') if end_date else start + timedelta(days=30)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'message': 'Invalid date format. Please use YYYY-MM-DD'
+        }), 400
+    
+    conn = get_db_connection()
+    rental_calendar.refresh(conn)
+    conn.close()
+    
+    return jsonify({
+        'success': True,
+        'vehicle_id': vehicle_id,
+        'reservations': rental_calendar.reservations(vehicle_id),
+        'free_windows': [
+            {'start_date': window_start, 'end_date': window_end}
+            for window_start, window_end in rental_calendar.free_windows(vehicle_id, start, end)
+        ]
+    })
+
 @app.route('/api/contact', methods=['POST'])
 def handle_contact():
     try:
@@ -1572,6 +1994,17 @@ def save_emergency_conditions():
         conn = get_db_connection()
         cursor = conn.cursor()
         
+        # Optional composite rule; compiled here so a broken rule is rejected on save
+        rule_definition = data.get('rule')
+        if rule_definition:
+            cursor.execute('SELECT home_location FROM users WHERE id = ?', (user_id,))
+            user = cursor.fetchone()
+            try:
+                compile_rule(rule_definition, parse_home(user['home_location'] if user else None))
+            except ValueError as e:
+                return jsonify({'success': False, 'message': f'Invalid rule: {str(e)}'}), 400
+            rule_definition = json.dumps(rule_definition)
+        
         # First, clear existing conditions
         cursor.execute('DELETE FROM emergency_conditions WHERE user_id = ?', (user_id,))
         
@@ -1587,8 +2020,9 @@ def save_emergency_conditions():
                 time_condition,
                 speed_threshold,
                 speed_condition,
-                emergency_contacts
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                emergency_contacts,
+                rule_definition
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
             user_id,
             data['location']['threshold'],
@@ -1599,10 +2033,12 @@ def save_emergency_conditions():
             data['time']['condition'],
             data['speed']['threshold'],
             data['speed']['condition'],
-            json.dumps(data['emergencyContacts'])
+            json.dumps(data['emergencyContacts']),
+            rule_definition
         ))
         
         conn.commit()
+        emergency_rules.invalidate(user_id)
         return jsonify({'success': True})
         
     except Exception as e:
@@ -1612,6 +2048,11 @@ def save_emergency_conditions():
         if 'conn' in locals():
             conn.close()
 
+# Connection pool metrics on their own, for polling during load tests
+@app.route('/api/test/db_pool', methods=['GET'])
+def test_db_pool():
+    return jsonify({'success': True, 'pool': db_pool.stats()})
+
 @app.route('/api/test/status', methods=['GET'])
 def test_status():
     try:
@@ -1651,7 +2092,19 @@ def test_status():
                 'user_count': user_count,
                 'vehicle_count': vehicle_count,
                 'booking_count': booking_count
-            }
+            },
+            'pool': db_pool.stats(),
+            'location_ingest': location_buffer.stats(),
+            'retention': retention_worker.stats(),
+            'notifications': notification_dispatcher.stats(),
+            'emergency_rules': emergency_rules.stats(),
+            'telemetry': telemetry_monitor.stats(),
+            'fares': fare_engine.stats(),
+            'password_hashing': password_hasher.stats(),
+            'rate_limits': rate_limiter.stats(),
+            'otps': otp_store.stats(),
+            'tokens': token_signer.stats(),
+            'vehicle_catalog': vehicle_catalog.stats()
         })
     except Exception as e:
         return jsonify({
@@ -1662,6 +2115,8 @@ def test_status():
 if __name__ == '__main__':
     print("Starting application...")  # Debug log
     init_db()
-    migrate_db()
+    retention_worker.start()
+    # Picks up notifications left pending by a previous run
+    notification_dispatcher.start()
     print("Database initialized, starting server...")  # Debug log
     app.run(host='0.0.0.0', port=8000, debug=True) 
\ No newline at end of file
@@ -0,0 +1,121 @@
+import argparse
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+# Load test for vehicle allocation: N concurrent bookers race for a fleet of
+# vehicles through /api/bookings/create until it runs out, then the bookings
+# table is checked for vehicles handed out more than once.
+#
+#   python benchmarks/booking_contention.py --bookers 32 --vehicles 500
+#   python benchmarks/booking_contention.py --legacy   # old read-then-write pattern
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_book(database, user_id):
+    # The pre-reservation pattern: read the first available vehicle, then flip it
+    conn = sqlite3.connect(database, timeout=30)
+    try:
+        row = conn.execute(
+            "SELECT id FROM vehicles WHERE status = 'available' AND car_type = 'standard'"
+        ).fetchone()
+        if row is None:
+            return 404
+        conn.execute('''
+            INSERT INTO bookings (user_id, vehicle_id, service_type, pickup, destination,
+                                  pickup_time, passengers, price, status)
+            VALUES (?, ?, 'standard', 'a', 'b', 'now', 1, 75, 'pending')
+        ''', (user_id, row[0]))
+        conn.execute("UPDATE vehicles SET status = 'booked' WHERE id = ?", (row[0],))
+        conn.commit()
+        return 201
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--bookers', type=int, default=16)
+    parser.add_argument('--vehicles', type=int, default=200)
+    parser.add_argument('--legacy', action='store_true')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rideease-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as rideease
+        rideease.init_db()
+        conn = rideease.db_pool.acquire()
+        conn.execute("UPDATE vehicles SET status = 'maintenance'")
+        conn.executemany('''
+            INSERT INTO vehicles (driver_name, driver_gender, car_model, car_number, car_type, status)
+            VALUES (?, 'male', 'Bench Car', ?, 'standard', 'available')
+        ''', [(f'Driver {i}', f'BENCH{i:06d}') for i in range(args.vehicles)])
+        conn.commit()
+        conn.close()
+
+    results = {'created': 0, 'exhausted': 0, 'errors': 0}
+    lock = threading.Lock()
+    start_gate = threading.Barrier(args.bookers)
+
+    def booker():
+        client = rideease.app.test_client()
+        start_gate.wait()
+        while True:
+            if args.legacy:
+                status = legacy_book(rideease.DB_NAME, 1)
+            else:
+                status = client.post('/api/bookings/create', json={
+                    'user_id': 1, 'service_type': 'standard', 'pickup': 'a', 'destination': 'b',
+                    'pickup_time': 'now', 'passengers': 1
+                }).status_code
+            with lock:
+                if status == 201:
+                    results['created'] += 1
+                elif status == 404:
+                    results['exhausted'] += 1
+                    return
+                else:
+                    results['errors'] += 1
+                    if results['errors'] > args.vehicles:
+                        return
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=booker) for _ in range(args.bookers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(rideease.DB_NAME)
+    duplicated = conn.execute('''
+        SELECT COUNT(*), COALESCE(SUM(n - 1), 0) FROM (
+            SELECT vehicle_id, COUNT(*) AS n FROM bookings GROUP BY vehicle_id HAVING n > 1
+        )
+    ''').fetchone()
+    conn.close()
+
+    mode = 'legacy read-then-write' if args.legacy else 'atomic claim'
+    print(f'mode:               {mode}')
+    print(f'bookers:            {args.bookers}')
+    print(f'vehicles:           {args.vehicles}')
+    print(f'bookings created:   {results["created"]}')
+    print(f'errors:             {results["errors"]}')
+    print(f'double-booked cars: {duplicated[0]} ({duplicated[1]} extra bookings, '
+          f'{100.0 * duplicated[1] / max(results["created"], 1):.1f}% of bookings)')
+    print(f'elapsed:            {elapsed:.3f} s')
+    print(f'throughput:         {results["created"] / elapsed:.0f} bookings/s')
+
+
+if __name__ == '__main__':
+    main()
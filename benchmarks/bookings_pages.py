@@ -0,0 +1,79 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+# Per-page cost of /bookings for a light rider and a heavy one. Both get
+# bookings inserted directly, then pages are walked with next_cursor; with
+# keyset pagination the heavy rider's pages should cost the same as the
+# light rider's, deep pages included.
+#
+#   python benchmarks/bookings_pages.py --heavy 10000 --light 10
+#   python benchmarks/bookings_pages.py --fields id,created_at,status,price
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--heavy', type=int, default=10000)
+    parser.add_argument('--light', type=int, default=10)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--fields', default=None)
+    parser.add_argument('--pages', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rideease-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as rideease
+        rideease.init_db()
+    conn = rideease.db_pool.acquire()
+    riders = {'light': (9001, args.light), 'heavy': (9002, args.heavy)}
+    for user_id, count in riders.values():
+        conn.executemany('''
+            INSERT INTO bookings (user_id, vehicle_id, service_type, pickup, destination,
+                                  pickup_time, passengers, price, status, created_at)
+            VALUES (?, 1, 'standard', 'Pickup', 'Destination', 'now', 1, 75, 'completed',
+                    datetime('2024-01-01', ? || ' minutes'))
+        ''', [(user_id, i) for i in range(count)])
+    conn.commit()
+    conn.close()
+
+    client = rideease.app.test_client()
+    print(f'page size {args.limit}, fields {args.fields or "all"}')
+    for name, (user_id, count) in riders.items():
+        client.set_cookie('user_id', str(user_id))
+        latencies = []
+        seen = 0
+        cursor = None
+        while len(latencies) < args.pages:
+            query = {'limit': args.limit}
+            if args.fields:
+                query['fields'] = args.fields
+            if cursor:
+                query['cursor'] = cursor
+            started = time.perf_counter()
+            body = client.get('/bookings', query_string=query).get_json()
+            latencies.append(time.perf_counter() - started)
+            seen += len(body['bookings'])
+            cursor = body['next_cursor']
+            if cursor is None:
+                assert seen == count, f'walked {seen} of {count} bookings'
+                seen = 0  # Start over from the newest page
+        latencies.sort()
+        print(f'{name:5} ({count:6} bookings): p50 {percentile(latencies, 0.5) * 1000:6.2f} ms   '
+              f'p99 {percentile(latencies, 0.99) * 1000:6.2f} ms over {len(latencies)} pages')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# Compares the scalar haversine (calculate_distance) with the batch functions
+# in geodistance for one-to-many distances, plus a many-to-many matrix.
+#
+#   python benchmarks/haversine_batch.py --sizes 1000 100000 1000000
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import geodistance  # noqa: E402
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 100000, 1000000])
+    parser.add_argument('--matrix', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    origin = (12.97, 77.59)
+    print(f'numpy: {"yes" if geodistance.HAVE_NUMPY else "no (pure Python fallback)"}')
+    print(f'{"points":>10} {"scalar":>12} {"batch":>12} {"speedup":>8} {"max error km":>14}')
+    for size in args.sizes:
+        lats = [origin[0] + rng.uniform(-1, 1) for _ in range(size)]
+        lons = [origin[1] + rng.uniform(-1, 1) for _ in range(size)]
+        scalar_time, scalar = timed(lambda: [
+            geodistance.haversine_km(origin[0], origin[1], lat, lon) for lat, lon in zip(lats, lons)
+        ])
+        batch_time, batch = timed(lambda: geodistance.distances_from(origin[0], origin[1], lats, lons))
+        error = max(abs(a - b) for a, b in zip(scalar, batch))
+        print(f'{size:>10} {scalar_time * 1000:>10.1f}ms {batch_time * 1000:>10.1f}ms '
+              f'{scalar_time / batch_time:>7.1f}x {error:>14.2e}')
+
+    n = args.matrix
+    lats = [origin[0] + rng.uniform(-1, 1) for _ in range(n)]
+    lons = [origin[1] + rng.uniform(-1, 1) for _ in range(n)]
+    scalar_time, _ = timed(lambda: [
+        [geodistance.haversine_km(a, b, c, d) for c, d in zip(lats, lons)] for a, b in zip(lats, lons)
+    ])
+    batch_time, _ = timed(lambda: geodistance.distance_matrix(lats, lons, lats, lons))
+    print(f'{n}x{n} matrix: scalar {scalar_time * 1000:.1f}ms, batch {batch_time * 1000:.1f}ms, '
+          f'{scalar_time / batch_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Login latency under concurrency with scrypt hashing on the bounded pool.
+# --users accounts are registered first (so every hash is scrypt), then
+# --concurrency clients log in as fast as they can for --seconds, backing
+# off for Retry-After when the hashing queue is full.
+#
+#   python benchmarks/login_latency.py --concurrency 32 --seconds 10
+#   SCRYPT_N=32768 PASSWORD_HASH_WORKERS=4 python benchmarks/login_latency.py
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--users', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rideease-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as rideease
+        rideease.init_db()
+        client = rideease.app.test_client()
+        for i in range(args.users):
+            client.post('/api/auth/register', json={
+                'name': f'Bench {i}', 'email': f'bench{i}@example.com', 'phone': f'555{i:07d}',
+                'password': 'Password123', 'gender': 'other'
+            })
+
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def login_loop(worker):
+        client = rideease.app.test_client()
+        i = worker
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = client.post('/api/auth/login', json={
+                'email': f'bench{i % args.users}@example.com', 'password': 'Password123'
+            })
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+            if response.status_code == 503:
+                # Well-behaved clients back off as told
+                time.sleep(float(response.headers.get('Retry-After', 1)))
+            i += args.concurrency
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        threads = [threading.Thread(target=login_loop, args=(n,)) for n in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    latencies.sort()
+    stats = rideease.password_hasher.stats()
+    print(f'scrypt params:  n={stats["params"]["n"]} r={stats["params"]["r"]} p={stats["params"]["p"]}')
+    print(f'hash workers:   {stats["workers"]}')
+    print(f'concurrency:    {args.concurrency}')
+    print(f'responses:      {dict(sorted(statuses.items()))}')
+    print(f'logins/s:       {len(latencies) / args.seconds:.1f}')
+    if latencies:
+        print(f'p50 latency:    {percentile(latencies, 0.50) * 1000:.1f} ms')
+        print(f'p99 latency:    {percentile(latencies, 0.99) * 1000:.1f} ms')
+    print(f'avg queue wait: {stats["avg_wait_ms"]} ms')
+    print(f'rejected (503): {stats["rejected"]}')
+
+
+if __name__ == '__main__':
+    main()
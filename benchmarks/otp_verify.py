@@ -0,0 +1,105 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+# OTP verify latency and otps table growth, cached store vs the old design.
+# Every user gets --codes resends followed by one verify, first with the old
+# query-and-mark-everything flow, then with OtpStore. The retention purge is
+# then run as of --days later to show what is left of the audit trail.
+#
+#   python benchmarks/otp_verify.py --users 2000 --codes 10
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def legacy_issue(conn, user_id):
+    code = '%06d' % (user_id % 1000000)
+    conn.execute('INSERT INTO otps (user_id, otp, expires_at) VALUES (?, ?, ?)',
+                 (user_id, code, time.time() + 300))
+    conn.commit()
+    return code
+
+
+def legacy_verify(conn, user_id, otp):
+    # The pre-cache verify_otp: latest row, then mark every row for the user
+    row = conn.execute('''
+        SELECT otp, expires_at, used
+        FROM otps
+        WHERE user_id = ?
+        ORDER BY created_at DESC
+        LIMIT 1
+    ''', (user_id,)).fetchone()
+    if not row or row['used'] or time.time() > row['expires_at'] or otp != row['otp']:
+        return 0
+    cursor = conn.execute('UPDATE otps SET used = 1 WHERE user_id = ?', (user_id,))
+    conn.commit()
+    return cursor.rowcount
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def run(conn, users, codes, issue, verify):
+    latencies = []
+    rows_updated = 0
+    for user_id in users:
+        for _ in range(codes):
+            code = issue(conn, user_id)
+        started = time.perf_counter()
+        rows_updated += verify(conn, user_id, code)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return latencies, rows_updated
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--codes', type=int, default=10)
+    parser.add_argument('--days', type=int, default=31)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rideease-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as rideease
+        from otp_store import OtpStore
+        rideease.init_db()
+    conn = rideease.db_pool.acquire()
+    store = OtpStore()
+
+    def count(first, last):
+        return conn.execute('SELECT COUNT(*) FROM otps WHERE user_id BETWEEN ? AND ?', (first, last)).fetchone()[0]
+
+    legacy_users = range(1000000, 1000000 + args.users)
+    cached_users = range(2000000, 2000000 + args.users)
+    results = {
+        'legacy': run(conn, legacy_users, args.codes, legacy_issue, legacy_verify),
+        'cached': run(conn, cached_users, args.codes, store.issue,
+                      lambda conn, user_id, code: 1 if store.verify(conn, user_id, code) is None else 0),
+    }
+    rows = {'legacy': count(legacy_users[0], legacy_users[-1]), 'cached': count(cached_users[0], cached_users[-1])}
+
+    worker = rideease.retention_worker
+    while worker.purge_otps_batch(time.time() + args.days * 86400):
+        pass
+
+    print(f'users: {args.users}, codes issued per user: {args.codes}')
+    for name, (latencies, rows_updated) in results.items():
+        print(f'{name:7} verify p50 {percentile(latencies, 0.50) * 1e6:8.1f} us   '
+              f'p99 {percentile(latencies, 0.99) * 1e6:8.1f} us   '
+              f'rows updated per verify {rows_updated / args.users:5.1f}   otps rows {rows[name]}')
+    print(f'after retention ({args.days} days on): {count(0, 10 ** 9)} rows, {worker.otps_purged} purged')
+    print(f'store: {store.stats()}')
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
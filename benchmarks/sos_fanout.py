@@ -0,0 +1,105 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+# Measures /sos response time and end-to-end delivery with a stand-in SMS
+# gateway that takes --latency seconds per message and fails --failure-rate
+# of the attempts, so the retry path is exercised too.
+#
+#   python benchmarks/sos_fanout.py --contacts 5 --latency 0.3 --failure-rate 0.2
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StandInGateway:
+    def __init__(self, latency, failure_rate):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def __call__(self, phone_number, message):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError('stand-in gateway timeout')
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, default=5)
+    parser.add_argument('--triggers', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--failure-rate', type=float, default=0.2)
+    parser.add_argument('--timeout', type=float, default=60.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='rideease-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+
+    gateway = StandInGateway(args.latency, args.failure_rate)
+    with contextlib.redirect_stdout(io.StringIO()):
+        import app as rideease
+        rideease.init_db()
+        rideease.notification_dispatcher.gateway = gateway
+        rideease.notification_dispatcher.base_backoff = 0.1
+        contacts = [{'name': f'Contact {i}', 'phone': f'555{i:07d}'} for i in range(args.contacts)]
+        conn = rideease.db_pool.acquire()
+        # No alert conditions, so contacts are notified from the third trigger on
+        conn.execute('INSERT INTO emergency_conditions (user_id, emergency_contacts) VALUES (1, ?)', (json.dumps(contacts),))
+        conn.commit()
+        conn.close()
+
+    client = rideease.app.test_client()
+    latencies = []
+    dispatch_ids = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(args.triggers):
+            started = time.perf_counter()
+            response = client.post('/sos', json={
+                'userId': 1, 'location': {'latitude': 12.97, 'longitude': 77.59}, 'speed': 0
+            })
+            latencies.append(time.perf_counter() - started)
+            dispatch_id = response.get_json().get('dispatch_id')
+            if dispatch_id:
+                dispatch_ids.append(dispatch_id)
+
+        deadline = time.time() + args.timeout
+        started = time.perf_counter()
+        while time.time() < deadline:
+            statuses = [
+                delivery['status']
+                for dispatch_id in dispatch_ids
+                for delivery in rideease.notification_dispatcher.status(dispatch_id)['deliveries']
+            ]
+            if all(status in ('sent', 'failed') for status in statuses):
+                break
+            time.sleep(0.05)
+        drained = time.perf_counter() - started
+
+    latencies.sort()
+    print(f'triggers:             {args.triggers} ({len(dispatch_ids)} dispatched)')
+    print(f'contacts per trigger: {args.contacts}')
+    print(f'gateway latency:      {args.latency:.3f} s, failure rate {args.failure_rate:.0%}')
+    print(f'/sos p50:             {latencies[len(latencies) // 2] * 1000:.1f} ms')
+    print(f'/sos max:             {latencies[-1] * 1000:.1f} ms')
+    print(f'synchronous estimate: {args.contacts * args.latency * 1000:.1f} ms per trigger')
+    print(f'sent:                 {statuses.count("sent")}')
+    print(f'failed:               {statuses.count("failed")}')
+    print(f'still pending:        {len(statuses) - statuses.count("sent") - statuses.count("failed")}')
+    print(f'gateway calls:        {gateway.calls}')
+    print(f'drain time:           {drained:.3f} s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+# Indexes backing the hot queries in app.py. When this list changes, add a
+# migration in migrations.py that calls create_indexes again.
+INDEXES = [
+    ('idx_emergency_conditions_user', 'emergency_conditions', '(user_id)'),
+    ('idx_sos_triggers_user_time', 'sos_triggers', '(user_id, timestamp)'),
+    ('idx_sos_triggers_time', 'sos_triggers', '(timestamp)'),
+    # Keyset pages of a rider's history; the trailing columns cover the summary fields
+    ('idx_bookings_user_page', 'bookings', '(user_id, created_at DESC, id DESC, status, service_type, price, vehicle_id)'),
+    ('idx_otps_user_created', 'otps', '(user_id, created_at DESC)'),
+    ('idx_secure_storage_file_path', 'secure_storage', '(file_path)'),
+    ('idx_vehicles_status_type', 'vehicles', '(status, car_type)'),
+    ('idx_vehicles_status_rental', 'vehicles', '(status, is_rental)'),
+    ('idx_vehicle_locations_vehicle', 'vehicle_locations', '(vehicle_id, id)'),
+    # Retention picks its batches by age without scanning the hot table
+    ('idx_vehicle_locations_time', 'vehicle_locations', '(timestamp)'),
+    ('idx_rentals_vehicle_start', 'rentals', '(vehicle_id, start_date, end_date)'),
+    ('idx_notification_outbox_due', 'notification_outbox', '(status, next_attempt_at)'),
+    ('idx_notification_outbox_dispatch', 'notification_outbox', '(dispatch_id)'),
+]
+
+
+def create_indexes(conn, indexes=INDEXES):
+    # Indexes on tables a later migration creates are skipped here; that
+    # migration calls create_indexes again once its table exists.
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for name, table, columns in indexes:
+        if table not in tables:
+            continue
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} {columns}')
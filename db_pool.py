@@ -0,0 +1,170 @@
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# Per-connection tuning, applied once when a connection is opened
+SQLITE_PRAGMAS = [
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA mmap_size = 268435456',  # 256 MB
+    'PRAGMA cache_size = -16000',  # ~16 MB page cache
+    'PRAGMA busy_timeout = 5000',  # 5 seconds
+]
+
+
+class PooledConnection(sqlite3.Connection):
+    # close() hands the connection back to its pool instead of closing it.
+    # While a connection is bound to a request (see bind_to_app) close() is a
+    # no-op and the app context teardown releases it.
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            super().close()
+        elif not getattr(self, '_request_bound', False):
+            pool.release(self)
+
+    def really_close(self):
+        self._pool = None
+        super().close()
+
+
+class ConnectionPool:
+    def __init__(self, database, max_size=10, timeout=10.0, pragmas=None):
+        self.database = database
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._size = 0
+
+        # Metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            timeout=self.timeout,
+            factory=PooledConnection,
+            check_same_thread=False
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        started = time.perf_counter()
+        waited = False
+        with self._available:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn = None
+                    break
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise TimeoutError('Timed out waiting for a database connection')
+                self._available.wait(remaining)
+
+            wait_time = time.perf_counter() - started
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_time_total += wait_time
+                self._wait_time_max = max(self._wait_time_max, wait_time)
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._available:
+                    self._size -= 1
+                    self._available.notify()
+                raise
+        conn._pool = self
+        conn._request_bound = False
+        return conn
+
+    def release(self, conn):
+        if getattr(conn, '_pool', None) is not self:
+            return  # Already released
+        conn._pool = None
+        conn._request_bound = False
+        try:
+            # Never hand an open transaction to the next borrower
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.really_close()
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            return
+        with self._available:
+            self._idle.append(conn)
+            self._available.notify()
+
+    def close_all(self):
+        with self._available:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._size -= len(idle)
+        for conn in idle:
+            conn.really_close()
+
+    def stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            return {
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': idle,
+                'in_use': self._size - idle,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'timeouts': self._timeouts,
+                'wait_time_total_ms': round(self._wait_time_total * 1000, 3),
+                'wait_time_avg_ms': round(self._wait_time_total * 1000 / self._waits, 3) if self._waits else 0.0,
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 3)
+            }
+
+
+def bind_to_app(app, pool):
+    # Returns a get_db_connection() that reuses one connection per app context
+    # (per thread or greenlet, since Flask contexts are context-local) and
+    # releases it on teardown, including after early returns.
+    # get_db_connection.release() hands it back early; a later call borrows
+    # a fresh one.
+    from flask import g, has_app_context
+
+    def get_db_connection():
+        if not has_app_context():
+            return pool.acquire()
+        conn = g.get('_db_conn')
+        if conn is None:
+            conn = pool.acquire()
+            conn._request_bound = True
+            g._db_conn = conn
+        return conn
+
+    @app.teardown_appcontext
+    def release_db_connection(exception=None):
+        conn = g.pop('_db_conn', None)
+        if conn is not None:
+            pool.release(conn)
+
+    get_db_connection.release = release_db_connection
+    return get_db_connection
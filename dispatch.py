@@ -0,0 +1,278 @@
+import heapq
+import math
+import threading
+import time
+
+from geodistance import KM_PER_DEGREE, distances_from
+
+# Grid cell edge in degrees (~2.2 km of latitude)
+CELL_DEGREES = 0.02
+
+
+def matches_preferences(vehicle, rider_gender=None, driver_gender_preference=None):
+    # Mirrors the gender filter create_booking applies in SQL
+    if not (rider_gender and driver_gender_preference):
+        return True
+    if vehicle['customer_gender_preference'] not in (None, rider_gender, 'any'):
+        return False
+    if driver_gender_preference != 'any' and vehicle['driver_gender'] != driver_gender_preference:
+        return False
+    return True
+
+
+class DispatchIndex:
+    # In-memory grid of the latest position of every vehicle. Only vehicles
+    # that are available and have a known position sit in the grid; the grid
+    # is split per car_type so a nearest query never touches other types.
+    def __init__(self, cell_degrees=CELL_DEGREES, loader=None):
+        self.cell_degrees = cell_degrees
+        self.loader = loader
+        self.loaded = loader is None
+
+        self._lock = threading.RLock()
+        self._vehicles = {}  # vehicle_id -> attributes and position
+        self._grids = {}  # car_type -> {(cell_x, cell_y): set(vehicle_id)}
+        self._type_counts = {}  # car_type -> vehicles currently in that grid
+        # Available vehicles with or without a position, by the attributes
+        # booking filters on: (car_type, driver_gender, customer_gender_preference, is_rental)
+        self._buckets = {}
+
+    def _cell(self, lat, lon):
+        return (int(math.floor(lon / self.cell_degrees)), int(math.floor(lat / self.cell_degrees)))
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        with self._lock:
+            if not self.loaded:
+                # Mark loaded first: the loader feeds back through upsert/update
+                self.loaded = True
+                try:
+                    self.loader(self)
+                except Exception:
+                    self.loaded = False
+                    raise
+
+    def _grid_add(self, vehicle_id, vehicle):
+        if vehicle['status'] != 'available' or vehicle['cell'] is None:
+            return
+        grid = self._grids.setdefault(vehicle['car_type'], {})
+        grid.setdefault(vehicle['cell'], set()).add(vehicle_id)
+        self._type_counts[vehicle['car_type']] = self._type_counts.get(vehicle['car_type'], 0) + 1
+
+    def _grid_remove(self, vehicle_id, vehicle):
+        grid = self._grids.get(vehicle['car_type'])
+        if not grid or vehicle['cell'] is None:
+            return
+        members = grid.get(vehicle['cell'])
+        if not members or vehicle_id not in members:
+            return
+        members.discard(vehicle_id)
+        if not members:
+            del grid[vehicle['cell']]
+        self._type_counts[vehicle['car_type']] -= 1
+
+    def _bucket_key(self, vehicle):
+        return (vehicle['car_type'], vehicle['driver_gender'], vehicle['customer_gender_preference'],
+                int(vehicle['is_rental'] or 0))
+
+    def _bucket_add(self, vehicle_id, vehicle):
+        if vehicle['status'] == 'available':
+            self._buckets.setdefault(self._bucket_key(vehicle), set()).add(vehicle_id)
+
+    def _bucket_remove(self, vehicle_id, vehicle):
+        key = self._bucket_key(vehicle)
+        members = self._buckets.get(key)
+        if members is not None:
+            members.discard(vehicle_id)
+            if not members:
+                del self._buckets[key]
+
+    def upsert_vehicle(self, vehicle_id, car_type, status, driver_gender=None,
+                       customer_gender_preference=None, is_rental=0):
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None:
+                vehicle = {'lat': None, 'lon': None, 'cell': None, 'updated_at': None}
+                self._vehicles[vehicle_id] = vehicle
+            else:
+                self._grid_remove(vehicle_id, vehicle)
+                self._bucket_remove(vehicle_id, vehicle)
+            vehicle.update({
+                'car_type': car_type,
+                'status': status,
+                'driver_gender': driver_gender,
+                'customer_gender_preference': customer_gender_preference,
+                'is_rental': is_rental
+            })
+            self._grid_add(vehicle_id, vehicle)
+            self._bucket_add(vehicle_id, vehicle)
+
+    def set_status(self, vehicle_id, status):
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None:
+                return
+            self._grid_remove(vehicle_id, vehicle)
+            self._bucket_remove(vehicle_id, vehicle)
+            vehicle['status'] = status
+            self._grid_add(vehicle_id, vehicle)
+            self._bucket_add(vehicle_id, vehicle)
+
+    def update_position(self, vehicle_id, lat, lon, timestamp=None):
+        self._ensure_loaded()
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None:
+                return False  # Unknown vehicle; picked up on next load
+            cell = self._cell(lat, lon)
+            if cell != vehicle['cell']:
+                self._grid_remove(vehicle_id, vehicle)
+                vehicle['cell'] = cell
+                vehicle['lat'], vehicle['lon'] = lat, lon
+                self._grid_add(vehicle_id, vehicle)
+            else:
+                vehicle['lat'], vehicle['lon'] = lat, lon
+            vehicle['updated_at'] = timestamp or time.time()
+            return True
+
+    def position(self, vehicle_id):
+        self._ensure_loaded()
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None or vehicle['cell'] is None:
+                return None
+            return vehicle['lat'], vehicle['lon']
+
+    def nearest(self, lat, lon, car_type, k=1, max_km=50.0,
+                rider_gender=None, driver_gender_preference=None, exclude=(), is_rental=None):
+        # Returns up to k (vehicle_id, distance_km) pairs, closest first, for
+        # available vehicles of car_type that pass the rider's gender filter
+        # (and, when is_rental is given, are or are not rentals).
+        if k < 1:
+            return []
+        self._ensure_loaded()
+        with self._lock:
+            grid = self._grids.get(car_type)
+            if not grid:
+                return []
+
+            def measure(vehicle_ids):
+                # Distances for a whole batch of candidates in one call
+                candidates = [
+                    vehicle_id for vehicle_id in vehicle_ids
+                    if vehicle_id not in found and vehicle_id not in exclude and matches_preferences(
+                        self._vehicles[vehicle_id], rider_gender, driver_gender_preference)
+                    and (is_rental is None or int(self._vehicles[vehicle_id]['is_rental'] or 0) == int(is_rental))
+                ]
+                if candidates:
+                    vehicles = [self._vehicles[vehicle_id] for vehicle_id in candidates]
+                    found.update(zip(candidates, distances_from(
+                        lat, lon, [v['lat'] for v in vehicles], [v['lon'] for v in vehicles])))
+
+            found = {}
+            cx, cy = self._cell(lat, lon)
+            # Kilometres covered by one ring step; longitude cells shrink towards the poles
+            cos_lat = max(math.cos(math.radians(min(abs(lat) + max_km / KM_PER_DEGREE, 89.9))), 0.01)
+            ring_km = self.cell_degrees * KM_PER_DEGREE * cos_lat
+            max_ring = int(max_km / ring_km) + 1
+            type_count = self._type_counts.get(car_type, 0)
+            cells_scanned = 0
+
+            for ring in range(max_ring + 1):
+                if ring == 0:
+                    cells = [(cx, cy)]
+                else:
+                    cells = [(cx + dx, cy - ring) for dx in range(-ring, ring + 1)]
+                    cells += [(cx + dx, cy + ring) for dx in range(-ring, ring + 1)]
+                    cells += [(cx - ring, cy + dy) for dy in range(-ring + 1, ring)]
+                    cells += [(cx + ring, cy + dy) for dy in range(-ring + 1, ring)]
+                cells_scanned += len(cells)
+
+                if cells_scanned > type_count:
+                    # Sparse fleet: scanning the type directly is cheaper than more rings
+                    measure([vehicle_id for members in grid.values() for vehicle_id in members])
+                    break
+
+                measure([vehicle_id for cell in cells for vehicle_id in grid.get(cell, ())])
+
+                # Anything outside this ring is at least ring * ring_km away
+                if len(found) >= k and heapq.nsmallest(k, found.values())[-1] <= ring * ring_km:
+                    break
+
+            ranked = sorted(found.items(), key=lambda item: item[1])
+            return [(vehicle_id, float(distance)) for vehicle_id, distance in ranked[:k] if distance <= max_km]
+
+    def count_available(self, lat, lon, car_type, radius_cells=2):
+        # Available vehicles of car_type in the square of cells around a point
+        self._ensure_loaded()
+        with self._lock:
+            grid = self._grids.get(car_type)
+            if not grid:
+                return 0
+            cx, cy = self._cell(lat, lon)
+            return sum(
+                len(grid.get((cx + dx, cy + dy), ()))
+                for dx in range(-radius_cells, radius_cells + 1)
+                for dy in range(-radius_cells, radius_cells + 1)
+            )
+
+    def _matching_buckets(self, car_type, rider_gender, driver_gender_preference, is_rental):
+        for key, members in self._buckets.items():
+            if key[0] != car_type or (is_rental is not None and key[3] != int(is_rental)):
+                continue
+            attributes = {'driver_gender': key[1], 'customer_gender_preference': key[2]}
+            if matches_preferences(attributes, rider_gender, driver_gender_preference):
+                yield members
+
+    def available_ids(self, car_type, rider_gender=None, driver_gender_preference=None, is_rental=None, limit=3):
+        # Up to limit available vehicles passing the booking filter, without
+        # looking at positions; the buckets per car_type are a handful of
+        # gender combinations, so this does not grow with the fleet
+        self._ensure_loaded()
+        with self._lock:
+            found = []
+            for members in self._matching_buckets(car_type, rider_gender, driver_gender_preference, is_rental):
+                for vehicle_id in members:
+                    found.append(vehicle_id)
+                    if len(found) >= limit:
+                        return found
+            return found
+
+    def count_matching(self, car_type, rider_gender=None, driver_gender_preference=None, is_rental=None):
+        self._ensure_loaded()
+        with self._lock:
+            return sum(len(members) for members in
+                       self._matching_buckets(car_type, rider_gender, driver_gender_preference, is_rental))
+
+    def availability(self):
+        # [(car_type, driver_gender, customer_gender_preference, is_rental, count)]
+        self._ensure_loaded()
+        with self._lock:
+            return [key + (len(members),) for key, members in sorted(
+                self._buckets.items(), key=lambda item: tuple('' if part is None else str(part) for part in item[0]))]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'vehicles': len(self._vehicles),
+                'positioned': sum(1 for v in self._vehicles.values() if v['cell'] is not None),
+                'available': sum(len(members) for members in self._buckets.values()),
+                'available_by_type': dict(self._type_counts)
+            }
+
+
+def load_from_db(conn, index):
+    # Populates index from vehicles plus the latest known ping per vehicle
+    for row in conn.execute('''
+        SELECT id, car_type, status, driver_gender, customer_gender_preference, is_rental
+        FROM vehicles
+    '''):
+        index.upsert_vehicle(
+            row['id'], row['car_type'], row['status'], row['driver_gender'],
+            row['customer_gender_preference'], row['is_rental']
+        )
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if 'vehicle_latest_location' in tables:
+        for row in conn.execute('SELECT vehicle_id, latitude, longitude, timestamp FROM vehicle_latest_location'):
+            index.update_position(row['vehicle_id'], row['latitude'], row['longitude'], row['timestamp'])
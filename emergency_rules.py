@@ -0,0 +1,314 @@
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from geodistance import EARTH_RADIUS_KM
+
+# Each user's emergency conditions are compiled once into a tree of predicate
+# objects (times parsed, home point pre-converted, contacts decoded) and kept
+# in an LRU cache, so evaluating them on an SOS is pure arithmetic.
+#
+# A composite rule is stored as JSON in emergency_conditions.rule_definition:
+#   {"any": [rule, ...]}  {"all": [rule, ...]}
+#   {"speed": {"condition": "above" | "below", "threshold": 80}}
+#   {"distance": {"condition": "away", "threshold": 5}}          (km from home)
+#   {"time": {"condition": "inside" | "outside", "start": "22:00", "end": "06:00"}}
+# Without one, the three fixed checks are combined with OR, as before.
+#
+# Background ride monitoring (telemetry.py) does not alert on that OR: a time
+# window alone is not an emergency. Its predicate needs a real anomaly (a
+# speed or distance rule) to hold as well; see monitor_rule.
+
+CACHE_MAX_USERS = 10000
+# Other worker processes do not see invalidate(); they reload after this long
+CACHE_TTL_SECONDS = 300.0
+
+
+def _minute_of_day(value):
+    parsed = datetime.strptime(value, '%H:%M')
+    return parsed.hour * 60 + parsed.minute
+
+
+def current_minute(now=None):
+    now = now or datetime.now()
+    return now.hour * 60 + now.minute
+
+
+class SpeedRule:
+    __slots__ = ('above', 'threshold')
+
+    def __init__(self, condition, threshold):
+        if condition not in ('above', 'below'):
+            raise ValueError(f'Unknown speed condition: {condition}')
+        self.above = condition == 'above'
+        self.threshold = float(threshold)
+
+    def evaluate(self, lat, lon, speed, minute):
+        return speed > self.threshold if self.above else speed < self.threshold
+
+    def describe(self):
+        return f"speed {'above' if self.above else 'below'} {self.threshold:g}"
+
+
+class DistanceRule:
+    # Haversine against a fixed home point: the home trig terms and the
+    # threshold expressed as a haversine value are computed once, so the check
+    # needs no atan2/sqrt
+    __slots__ = ('home_lat', 'home_lon', 'cos_home_lat', 'threshold', 'threshold_hav')
+
+    def __init__(self, home_lat, home_lon, threshold_km):
+        self.home_lat = math.radians(float(home_lat))
+        self.home_lon = math.radians(float(home_lon))
+        self.cos_home_lat = math.cos(self.home_lat)
+        self.threshold = float(threshold_km)
+        half_angle = min(self.threshold / (2 * EARTH_RADIUS_KM), math.pi / 2)
+        self.threshold_hav = math.sin(half_angle) ** 2
+
+    def evaluate(self, lat, lon, speed, minute):
+        if lat is None or lon is None:
+            return False
+        lat = math.radians(lat)
+        a = math.sin((lat - self.home_lat) / 2) ** 2 + \
+            self.cos_home_lat * math.cos(lat) * math.sin((math.radians(lon) - self.home_lon) / 2) ** 2
+        return a > self.threshold_hav
+
+    def describe(self):
+        return f'more than {self.threshold:g} km from home'
+
+
+class TimeRule:
+    __slots__ = ('inside', 'start', 'end')
+
+    def __init__(self, condition, start, end):
+        if condition not in ('inside', 'outside'):
+            raise ValueError(f'Unknown time condition: {condition}')
+        self.inside = condition == 'inside'
+        self.start = _minute_of_day(start)
+        self.end = _minute_of_day(end)
+
+    def evaluate(self, lat, lon, speed, minute):
+        if self.start <= self.end:
+            within = self.start <= minute <= self.end
+        else:
+            # The window wraps midnight, e.g. 22:00-06:00
+            within = minute >= self.start or minute <= self.end
+        return within if self.inside else not within
+
+    def describe(self):
+        return f"time {'inside' if self.inside else 'outside'} window"
+
+
+class AllRule:
+    __slots__ = ('rules',)
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+
+    def evaluate(self, lat, lon, speed, minute):
+        for rule in self.rules:
+            if not rule.evaluate(lat, lon, speed, minute):
+                return False
+        return bool(self.rules)
+
+    def describe(self):
+        return '(' + ' and '.join(rule.describe() for rule in self.rules) + ')'
+
+
+class AnyRule:
+    __slots__ = ('rules',)
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+
+    def evaluate(self, lat, lon, speed, minute):
+        for rule in self.rules:
+            if rule.evaluate(lat, lon, speed, minute):
+                return True
+        return False
+
+    def describe(self):
+        return '(' + ' or '.join(rule.describe() for rule in self.rules) + ')'
+
+
+def compile_rule(definition, home):
+    # definition: parsed rule JSON; home: (lat, lon) or None
+    if not isinstance(definition, dict) or len(definition) != 1:
+        raise ValueError('Each rule needs exactly one of any, all, speed, distance, time')
+    kind, spec = next(iter(definition.items()))
+    if kind in ('any', 'all'):
+        if not isinstance(spec, list) or not spec:
+            raise ValueError(f'"{kind}" needs a non-empty list of rules')
+        rules = [compile_rule(child, home) for child in spec]
+        return AnyRule(rules) if kind == 'any' else AllRule(rules)
+    try:
+        if kind == 'speed':
+            return SpeedRule(spec['condition'], spec['threshold'])
+        if kind == 'distance':
+            if home is None:
+                raise ValueError('A distance rule needs a home location')
+            return DistanceRule(home[0], home[1], spec['threshold'])
+        if kind == 'time':
+            return TimeRule(spec['condition'], spec['start'], spec['end'])
+    except (KeyError, TypeError) as e:
+        raise ValueError(f'Invalid {kind} rule: {str(e)}')
+    raise ValueError(f'Unknown rule type: {kind}')
+
+
+def _legacy_rules(conditions, home):
+    # (distance, time, speed) rules from the fixed columns; None where unset
+    distance = time_rule = speed = None
+    if conditions['location_condition'] == 'away' and home is not None and conditions['distance_threshold'] is not None:
+        distance = DistanceRule(home[0], home[1], conditions['distance_threshold'])
+    if conditions['time_condition'] in ('inside', 'outside'):
+        try:
+            time_rule = TimeRule(conditions['time_condition'], conditions['time_start'], conditions['time_end'])
+        except (TypeError, ValueError) as e:
+            print(f"Skipping time condition: {str(e)}")  # Debug log
+    if conditions['speed_condition'] in ('above', 'below') and conditions['speed_threshold']:
+        speed = SpeedRule(conditions['speed_condition'], conditions['speed_threshold'])
+    return distance, time_rule, speed
+
+
+def compile_legacy(conditions, home):
+    # The three fixed checks check_emergency_conditions used to run, OR-ed
+    return AnyRule(rule for rule in _legacy_rules(conditions, home) if rule is not None)
+
+
+def compile_legacy_monitor(conditions, home):
+    # Background alerting on the fixed checks: inside the configured time
+    # window (when there is one) and speed or distance out of bounds
+    distance, time_rule, speed = _legacy_rules(conditions, home)
+    anomalies = [rule for rule in (distance, speed) if rule is not None]
+    if not anomalies:
+        return None
+    return AllRule(([time_rule] if time_rule else []) + [AnyRule(anomalies)])
+
+
+def _anomaly_rules(rule):
+    if isinstance(rule, (AllRule, AnyRule)):
+        for child in rule.rules:
+            yield from _anomaly_rules(child)
+    elif isinstance(rule, (SpeedRule, DistanceRule)):
+        yield rule
+
+
+def monitor_rule(predicate):
+    # A composite rule for background alerting: it must hold and so must at
+    # least one of its speed or distance rules. None if it has neither.
+    anomalies = list(_anomaly_rules(predicate))
+    if not anomalies:
+        return None
+    return AllRule([predicate, AnyRule(anomalies)])
+
+
+class CompiledRules:
+    __slots__ = ('user_id', 'predicate', 'contacts', 'monitor')
+
+    def __init__(self, user_id, predicate, contacts, monitor=None):
+        self.user_id = user_id
+        self.predicate = predicate
+        self.contacts = contacts
+        self.monitor = monitor
+
+    def evaluate(self, lat, lon, speed, minute=None):
+        # Conditions checked when the rider presses SOS
+        if minute is None:
+            minute = current_minute()
+        return self.predicate.evaluate(lat, lon, speed, minute)
+
+    def evaluate_monitor(self, lat, lon, speed, minute=None):
+        # Conditions that raise an alert from ride telemetry on their own
+        if self.monitor is None:
+            return False
+        if minute is None:
+            minute = current_minute()
+        return self.monitor.evaluate(lat, lon, speed, minute)
+
+
+def parse_home(home_location):
+    if not home_location:
+        return None
+    home = json.loads(home_location)
+    return float(home['latitude']), float(home['longitude'])
+
+
+def load_rules(conn, user_id):
+    # Compiles one user's rules from the database, or returns None
+    conditions = conn.execute('SELECT * FROM emergency_conditions WHERE user_id = ?', (user_id,)).fetchone()
+    if conditions is None:
+        return None
+    user = conn.execute('SELECT home_location FROM users WHERE id = ?', (user_id,)).fetchone()
+    try:
+        home = parse_home(user['home_location'] if user else None)
+    except (ValueError, KeyError, TypeError) as e:
+        print(f"Ignoring invalid home location for user {user_id}: {str(e)}")  # Debug log
+        home = None
+
+    contacts = json.loads(conditions['emergency_contacts']) if conditions['emergency_contacts'] else []
+    if conditions['rule_definition']:
+        predicate = compile_rule(json.loads(conditions['rule_definition']), home)
+        monitor = monitor_rule(predicate)
+    else:
+        predicate = compile_legacy(conditions, home)
+        monitor = compile_legacy_monitor(conditions, home)
+    return CompiledRules(user_id, predicate, contacts, monitor)
+
+
+class RuleCache:
+    def __init__(self, pool, max_users=CACHE_MAX_USERS, ttl=CACHE_TTL_SECONDS):
+        self.pool = pool
+        self.max_users = max_users
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (loaded_at, CompiledRules or None)
+        # Bumped by invalidate() so a load racing with a save is not cached
+        self._generation = 0
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        # Request payloads carry ids as strings or ints; key on one form
+        user_id = int(user_id)
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(user_id)
+            if cached is not None and now - cached[0] < self.ttl:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            generation = self._generation
+
+        conn = self.pool.acquire()
+        try:
+            entry = load_rules(conn, user_id)
+        finally:
+            conn.close()
+
+        with self._lock:
+            if generation != self._generation:
+                return entry
+            self._entries[user_id] = (now, entry)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, user_id):
+        user_id = int(user_id)
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_users': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,173 @@
+import math
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from geodistance import haversine_km
+from ttl_cache import TTLCache
+
+# Fare = (base + per_km * route_km) * time-of-day multiplier * surge.
+# Routes are memoized per pickup/destination pair for an hour; whole quotes
+# for a short while, since surge moves with the fleet.
+
+BASE_FARES = {'standard': 50, 'premium': 100, 'shared': 30}
+PER_KM_FARES = {'standard': 12, 'premium': 20, 'shared': 8}
+# Used when neither end of the trip can be located
+UNKNOWN_DISTANCE_MULTIPLIER = 1.5
+# Straight-line distance -> road distance when no road graph is available
+DETOUR_FACTOR = 1.3
+
+# (first hour, last hour exclusive, multiplier); hours not listed are 1.0
+TIME_OF_DAY_MULTIPLIERS = [
+    (0, 6, 1.25),
+    (8, 10, 1.2),
+    (17, 20, 1.2),
+    (22, 24, 1.25),
+]
+
+# Surge zone: square of dispatch grid cells around the pickup
+SURGE_ZONE_CELLS = 2
+DEMAND_WINDOW_SECONDS = 10 * 60
+SURGE_SENSITIVITY = 0.25
+MAX_SURGE = 2.5
+
+ROUTE_CACHE_SIZE = 20000
+ROUTE_TTL_SECONDS = 3600.0
+QUOTE_CACHE_SIZE = 20000
+QUOTE_TTL_SECONDS = 30.0
+# Pairs are cached at ~11 m resolution
+POINT_PRECISION = 4
+
+COORDINATES = re.compile(r'^\s*(-?\d{1,3}(?:\.\d+)?)\s*,\s*(-?\d{1,3}(?:\.\d+)?)\s*$')
+
+
+def parse_coordinates(text):
+    # 'lat, lng' typed or pasted into a pickup/destination field
+    match = COORDINATES.match(text or '')
+    if not match:
+        return None
+    lat, lon = float(match.group(1)), float(match.group(2))
+    if -90 <= lat <= 90 and -180 <= lon <= 180:
+        return lat, lon
+    return None
+
+
+def time_of_day_multiplier(hour):
+    for first, last, multiplier in TIME_OF_DAY_MULTIPLIERS:
+        if first <= hour < last:
+            return multiplier
+    return 1.0
+
+
+class FareEngine:
+    def __init__(self, dispatch_index, geocoder=None, router=None):
+        # geocoder(text) -> (lat, lon) or None; router(a, b) -> road km or None
+        self.dispatch_index = dispatch_index
+        self.geocoder = geocoder
+        self.router = router
+        self.routes = TTLCache(ROUTE_CACHE_SIZE, ROUTE_TTL_SECONDS)
+        self.quotes = TTLCache(QUOTE_CACHE_SIZE, QUOTE_TTL_SECONDS)
+        self._demand_lock = threading.Lock()
+        self._demand = {}  # zone -> deque of booking times
+        self._next_demand_prune = 0.0
+
+    def locate(self, text, point=None):
+        if point:
+            return point
+        point = parse_coordinates(text)
+        if point is None and self.geocoder and text:
+            point = self.geocoder(text)
+        return point
+
+    def _zone(self, point):
+        cell = self.dispatch_index.cell_degrees * (2 * SURGE_ZONE_CELLS + 1)
+        return (math.floor(point[0] / cell), math.floor(point[1] / cell))
+
+    def route_km(self, pickup, destination):
+        key = (round(pickup[0], POINT_PRECISION), round(pickup[1], POINT_PRECISION),
+               round(destination[0], POINT_PRECISION), round(destination[1], POINT_PRECISION))
+
+        def compute():
+            if self.router:
+                distance = self.router(pickup, destination)
+                if distance is not None:
+                    return distance, 'road'
+            return haversine_km(pickup[0], pickup[1], destination[0], destination[1]) * DETOUR_FACTOR, 'estimate'
+
+        return self.routes.get_or_compute(key, compute)
+
+    def record_demand(self, point, now=None):
+        # Called for each booking so surge follows demand in the zone
+        if not point:
+            return
+        now = now or time.time()
+        with self._demand_lock:
+            bookings = self._demand.setdefault(self._zone(point), deque(maxlen=1000))
+            bookings.append(now)
+            if now >= self._next_demand_prune:
+                # Zones nobody booked in for a window only hold stale times
+                cutoff = now - DEMAND_WINDOW_SECONDS
+                for zone in [zone for zone, times in self._demand.items() if times[-1] <= cutoff]:
+                    del self._demand[zone]
+                self._next_demand_prune = now + DEMAND_WINDOW_SECONDS
+
+    def demand(self, point, now=None):
+        now = now or time.time()
+        cutoff = now - DEMAND_WINDOW_SECONDS
+        with self._demand_lock:
+            bookings = self._demand.get(self._zone(point))
+            if not bookings:
+                return 0
+            while bookings and bookings[0] <= cutoff:
+                bookings.popleft()
+            return len(bookings)
+
+    def surge(self, service_type, point, now=None):
+        supply = self.dispatch_index.count_available(point[0], point[1], service_type, SURGE_ZONE_CELLS)
+        ratio = (self.demand(point, now) + 1) / (supply + 1)
+        return round(min(MAX_SURGE, max(1.0, 1.0 + SURGE_SENSITIVITY * (ratio - 1.0))), 1)
+
+    def quote(self, service_type, pickup, destination, pickup_point=None, destination_point=None, now=None):
+        now = now or time.time()
+        hour = datetime.fromtimestamp(now).hour
+        pickup_point = self.locate(pickup, pickup_point)
+        destination_point = self.locate(destination, destination_point)
+        base = BASE_FARES.get(service_type, BASE_FARES['standard'])
+
+        if not (pickup_point and destination_point):
+            # Nothing to measure; the old flat fare
+            return {
+                'price': base * UNKNOWN_DISTANCE_MULTIPLIER,
+                'distance_km': None,
+                'route': 'unknown',
+                'time_multiplier': 1.0,
+                'surge_multiplier': 1.0
+            }
+
+        key = (service_type, hour,
+               round(pickup_point[0], POINT_PRECISION), round(pickup_point[1], POINT_PRECISION),
+               round(destination_point[0], POINT_PRECISION), round(destination_point[1], POINT_PRECISION))
+
+        def compute():
+            distance, route = self.route_km(pickup_point, destination_point)
+            per_km = PER_KM_FARES.get(service_type, PER_KM_FARES['standard'])
+            time_multiplier = time_of_day_multiplier(hour)
+            surge = self.surge(service_type, pickup_point, now)
+            return {
+                'price': round((base + per_km * distance) * time_multiplier * surge, 2),
+                'distance_km': round(distance, 2),
+                'route': route,
+                'time_multiplier': time_multiplier,
+                'surge_multiplier': surge
+            }
+
+        return dict(self.quotes.get_or_compute(key, compute))
+
+    def stats(self):
+        return {
+            'routes': self.routes.stats(),
+            'quotes': self.quotes.stats(),
+            'demand_zones': len(self._demand)
+        }
@@ -0,0 +1,159 @@
+import csv
+import heapq
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+
+from ttl_cache import TTLCache
+
+# Offline geocoding of pickup/destination text from a local CSV of places
+# (name, latitude, longitude[, weight]). Names are normalised and indexed in a
+# sorted array of keys: every place is indexed under its full name and under
+# each later word, so "mg road" and "road" both find "MG Road". A prefix is a
+# contiguous run of keys found with two bisects; a max-segment-tree over the
+# keys' weights then yields the heaviest matches without scanning the run.
+
+MAX_SUGGESTIONS = 10
+MIN_PREFIX_RESOLVE = 3
+RESOLVE_CACHE_SIZE = 50000
+RESOLVE_TTL_SECONDS = 3600.0
+
+_NON_WORD = re.compile(r'[^a-z0-9]+')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '').encode('ascii', 'ignore').decode().lower()
+    return _NON_WORD.sub(' ', text).strip()
+
+
+class Geocoder:
+    def __init__(self, places):
+        # places: iterable of (name, latitude, longitude, weight)
+        self.names = []
+        self.lat = array('d')
+        self.lon = array('d')
+        self.weight = array('d')
+        exact = {}
+        keys = []
+        for name, latitude, longitude, weight in places:
+            normalized = normalize(name)
+            if not normalized:
+                continue
+            place = len(self.names)
+            self.names.append(name)
+            self.lat.append(float(latitude))
+            self.lon.append(float(longitude))
+            self.weight.append(float(weight or 0))
+            # Heaviest place wins an exact-name tie
+            if normalized not in exact or self.weight[exact[normalized]] < self.weight[place]:
+                exact[normalized] = place
+            words = normalized.split(' ')
+            for i in range(len(words)):
+                keys.append((' '.join(words[i:]), place))
+        keys.sort()
+        self._exact = exact
+        self._keys = [key for key, _ in keys]
+        self._places = array('i', (place for _, place in keys))
+        self._build_tree()
+        self._cache = TTLCache(RESOLVE_CACHE_SIZE, RESOLVE_TTL_SECONDS)
+        self._suggestions = TTLCache(RESOLVE_CACHE_SIZE, RESOLVE_TTL_SECONDS)
+
+    def _better(self, a, b):
+        # Key index with the heavier place; the alphabetically first on a tie
+        return a if self.weight[self._places[a]] >= self.weight[self._places[b]] else b
+
+    def _build_tree(self):
+        # Iterative segment tree: leaves at [size, 2 * size), each inner node
+        # holds the heaviest key index below it
+        size = len(self._keys)
+        tree = array('i', [0] * size) + array('i', range(size))
+        for node in range(size - 1, 0, -1):
+            tree[node] = self._better(tree[2 * node], tree[2 * node + 1])
+        self._tree = tree
+
+    def _heaviest(self, lo, hi):
+        # Heaviest key index in [lo, hi)
+        size = len(self._keys)
+        best = lo
+        lo += size
+        hi += size
+        while lo < hi:
+            if lo & 1:
+                best = self._better(best, self._tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                best = self._better(best, self._tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return best
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.DictReader(f)
+            return cls((row['name'], row['latitude'], row['longitude'], row.get('weight')) for row in reader)
+
+    def _place(self, place):
+        return {
+            'name': self.names[place],
+            'latitude': self.lat[place],
+            'longitude': self.lon[place]
+        }
+
+    def lookup(self, text):
+        # Exact name match, ignoring case, accents and punctuation
+        place = self._exact.get(normalize(text))
+        return None if place is None else self._place(place)
+
+    def _top_places(self, prefix, limit):
+        # Heaviest distinct places with a key starting with prefix
+        lo = bisect_left(self._keys, prefix)
+        hi = bisect_right(self._keys, prefix + '\uffff', lo)
+        if lo >= hi:
+            return []
+        places = []
+        best = self._heaviest(lo, hi)
+        heap = [(-self.weight[self._places[best]], best, lo, hi)]
+        while heap and len(places) < limit:
+            _, best, lo, hi = heapq.heappop(heap)
+            place = self._places[best]
+            if place not in places:
+                places.append(place)
+            for left, right in ((lo, best), (best + 1, hi)):
+                if left < right:
+                    split = self._heaviest(left, right)
+                    heapq.heappush(heap, (-self.weight[self._places[split]], split, left, right))
+        return places
+
+    def autocomplete(self, text, limit=MAX_SUGGESTIONS):
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        places = self._suggestions.get_or_compute((prefix, limit), lambda: self._top_places(prefix, limit))
+        return [self._place(place) for place in places]
+
+    def resolve(self, text):
+        # Best (lat, lon) for free text, or None; used as the fare/dispatch geocoder hook
+        key = normalize(text)
+        if not key:
+            return None
+
+        def compute():
+            place = self._exact.get(key)
+            if place is None and len(key) >= MIN_PREFIX_RESOLVE:
+                matches = self._top_places(key, 1)
+                if matches:
+                    place = matches[0]
+            return None if place is None else (self.lat[place], self.lon[place])
+
+        return self._cache.get_or_compute(key, compute)
+
+    def stats(self):
+        return {
+            'places': len(self.names),
+            'keys': len(self._keys),
+            'cache': self._cache.stats(),
+            'suggestions': self._suggestions.stats()
+        }
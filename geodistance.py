@@ -0,0 +1,68 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; the batch functions fall back to plain loops
+    np = None
+
+# Great-circle distances in kilometres. haversine_km is the scalar formula
+# calculate_distance has always used; the batch functions compute the same
+# thing over whole coordinate arrays with NumPy when it is installed.
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+HAVE_NUMPY = np is not None
+# Below this many points NumPy's per-call overhead outweighs the loop
+NUMPY_MIN_POINTS = 32
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def _haversine_arrays(lat1, lon1, lat2, lon2):
+    # Inputs in radians, broadcastable NumPy arrays
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def distances_from(lat, lon, lats, lons):
+    # One-to-many: distance from (lat, lon) to every (lats[i], lons[i]).
+    # Returns a NumPy array for large inputs when NumPy is available, else a list.
+    if np is None or len(lats) < NUMPY_MIN_POINTS:
+        lat_r, cos_lat = math.radians(lat), math.cos(math.radians(lat))
+        lon_r = math.radians(lon)
+        sin, cos, radians, asin, sqrt = math.sin, math.cos, math.radians, math.asin, math.sqrt
+        result = []
+        for other_lat, other_lon in zip(lats, lons):
+            other_lat = radians(other_lat)
+            a = sin((other_lat - lat_r) / 2) ** 2 + cos_lat * cos(other_lat) * sin((radians(other_lon) - lon_r) / 2) ** 2
+            result.append(2 * EARTH_RADIUS_KM * asin(sqrt(min(a, 1.0))))
+        return result
+    return _haversine_arrays(
+        math.radians(lat), math.radians(lon),
+        np.radians(np.asarray(lats, dtype=np.float64)), np.radians(np.asarray(lons, dtype=np.float64))
+    )
+
+
+def distance_matrix(lats1, lons1, lats2, lons2):
+    # Many-to-many: result[i][j] is the distance from point i of the first set
+    # to point j of the second
+    if np is None:
+        return [distances_from(lat, lon, lats2, lons2) for lat, lon in zip(lats1, lons1)]
+    lat1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, None]
+    lon1 = np.radians(np.asarray(lons1, dtype=np.float64))[:, None]
+    lat2 = np.radians(np.asarray(lats2, dtype=np.float64))[None, :]
+    lon2 = np.radians(np.asarray(lons2, dtype=np.float64))[None, :]
+    return _haversine_arrays(lat1, lon1, lat2, lon2)
+
+
+def within_km(lat, lon, lats, lons, radius_km):
+    # Geofence test: which points lie within radius_km of (lat, lon)
+    distances = distances_from(lat, lon, lats, lons)
+    if np is not None and isinstance(distances, np.ndarray):
+        return distances <= radius_km
+    return [distance <= radius_km for distance in distances]
@@ -0,0 +1,173 @@
+import atexit
+import threading
+import time
+
+INSERT_HISTORY_SQL = '''
+    INSERT INTO vehicle_locations (vehicle_id, latitude, longitude, timestamp)
+    VALUES (?, ?, ?, ?)
+'''
+
+# How far ahead of the server clock a device timestamp may be
+MAX_CLOCK_SKEW_SECONDS = 60
+
+# Keep only the newest ping per vehicle; late or out-of-order pings never
+# overwrite a fresher position. A stored timestamp beyond the allowed skew
+# (written before timestamps were checked) is always replaced.
+UPSERT_LATEST_SQL = f'''
+    INSERT INTO vehicle_latest_location (vehicle_id, latitude, longitude, timestamp)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(vehicle_id) DO UPDATE SET
+        latitude = excluded.latitude,
+        longitude = excluded.longitude,
+        timestamp = excluded.timestamp
+    WHERE excluded.timestamp >= vehicle_latest_location.timestamp
+    OR vehicle_latest_location.timestamp > CAST(strftime('%s', 'now') AS INTEGER) + {MAX_CLOCK_SKEW_SECONDS}
+'''
+
+# Pings held in memory before the oldest are dropped (~100 bytes each)
+MAX_PENDING_PINGS = 200000
+
+
+def parse_ping(ping, default_timestamp=None):
+    # Returns (vehicle_id, latitude, longitude, timestamp) or raises ValueError.
+    # Pings without a timestamp get server time; device timestamps are epoch
+    # seconds and may not run ahead of the server clock.
+    try:
+        vehicle_id = int(ping['vehicle_id'])
+        latitude = float(ping['latitude'])
+        longitude = float(ping['longitude'])
+    except (KeyError, TypeError, ValueError):
+        raise ValueError('Each ping needs vehicle_id, latitude and longitude')
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError('Latitude or longitude out of range')
+    now = default_timestamp or int(time.time())
+    timestamp = ping.get('timestamp')
+    if timestamp is None:
+        return vehicle_id, latitude, longitude, now
+    try:
+        timestamp = int(timestamp)
+    except (TypeError, ValueError):
+        raise ValueError('timestamp must be epoch seconds')
+    if timestamp > now + MAX_CLOCK_SKEW_SECONDS:
+        raise ValueError('timestamp is in the future; send epoch seconds')
+    return vehicle_id, latitude, longitude, timestamp
+
+
+class LocationIngestBuffer:
+    # Collects pings in memory and group-commits them from a background thread
+    # every flush_interval seconds, or sooner once max_batch pings are waiting.
+    # At most max_pending pings are held; while the database is unreachable the
+    # oldest are dropped first, since newer pings supersede them.
+    def __init__(self, pool, flush_interval=0.25, max_batch=2000, max_pending=MAX_PENDING_PINGS):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+
+        # Metrics
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_ms = 0.0
+        self.errors = 0
+        self.dropped = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='location-ingest', daemon=True)
+            self._thread.start()
+        atexit.register(self.stop)
+
+    def submit(self, pings):
+        if self._thread is None:
+            self.start()
+        with self._lock:
+            self._pending.extend(pings)
+            self._trim()
+            pending = len(self._pending)
+        if pending >= self.max_batch:
+            self._wakeup.set()
+        return pending
+
+    def _trim(self):
+        # Caller holds self._lock
+        excess = len(self._pending) - self.max_pending
+        if excess > 0:
+            del self._pending[:excess]
+            self.dropped += excess
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self.errors += 1
+                print(f"Location ingest flush error: {str(e)}")  # Debug log
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+
+            started = time.perf_counter()
+            # Pings arrive roughly in time order, so the last one per vehicle is the latest
+            latest = {}
+            for ping in batch:
+                current = latest.get(ping[0])
+                if current is None or ping[3] >= current[3]:
+                    latest[ping[0]] = ping
+
+            conn = None
+            try:
+                conn = self.pool.acquire()
+                conn.execute('BEGIN IMMEDIATE')
+                conn.executemany(INSERT_HISTORY_SQL, batch)
+                conn.executemany(UPSERT_LATEST_SQL, list(latest.values()))
+                conn.commit()
+            except Exception:
+                if conn is not None:
+                    conn.rollback()
+                with self._lock:
+                    # Put the batch back so the next flush retries it
+                    self._pending[:0] = batch
+                    self._trim()
+                raise
+            finally:
+                if conn is not None:
+                    conn.close()
+
+            self.flushes += 1
+            self.rows_written += len(batch)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            return len(batch)
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            'pending': pending,
+            'flushes': self.flushes,
+            'rows_written': self.rows_written,
+            'last_flush_ms': round(self.last_flush_ms, 3),
+            'errors': self.errors,
+            'dropped': self.dropped
+        }
@@ -0,0 +1,440 @@
+import hashlib
+import sqlite3
+import threading
+import time
+
+from db_indexes import create_indexes
+
+# Ordered schema migrations. Each one runs once, in its own transaction, and
+# is recorded in schema_version. Migrations must be idempotent so databases
+# created before schema_version existed can adopt them safely. Never edit a
+# released migration; append a new one instead.
+
+
+def _add_column(conn, table, column, definition):
+    columns = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    if column not in columns:
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+
+
+def _schedule_backfill(conn, name):
+    conn.execute('INSERT OR IGNORE INTO schema_backfills (name) VALUES (?)', (name,))
+
+
+def m001_base_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            email TEXT UNIQUE NOT NULL,
+            phone TEXT NOT NULL,
+            password TEXT NOT NULL,
+            gender TEXT NOT NULL,
+            driver_gender_preference TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS vehicles (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            driver_id TEXT,
+            driver_name TEXT,
+            driver_gender TEXT NOT NULL,
+            car_model TEXT,
+            car_number TEXT UNIQUE,
+            car_type TEXT,
+            aadhaar_number TEXT,
+            status TEXT DEFAULT 'available',
+            rental_price REAL,
+            is_rental BOOLEAN DEFAULT 0,
+            customer_gender_preference TEXT
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS bookings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            vehicle_id INTEGER,
+            service_type TEXT NOT NULL,
+            pickup TEXT NOT NULL,
+            destination TEXT NOT NULL,
+            pickup_time TEXT NOT NULL,
+            passengers INTEGER NOT NULL,
+            instructions TEXT,
+            status TEXT DEFAULT 'pending',
+            price REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rentals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            vehicle_id INTEGER,
+            start_date DATE NOT NULL,
+            end_date DATE NOT NULL,
+            status TEXT DEFAULT 'pending',
+            total_price REAL NOT NULL,
+            requirements TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id),
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id)
+        )
+    ''')
+
+
+def m002_safety_tables(conn):
+    # Tables the app queried but never created (previously only in schema.sql)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS emergency_conditions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            distance_threshold INTEGER,
+            location_condition TEXT,
+            specific_location TEXT,
+            time_start TEXT,
+            time_end TEXT,
+            time_condition TEXT,
+            speed_threshold INTEGER,
+            speed_condition TEXT,
+            emergency_contacts TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sos_triggers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            speed REAL DEFAULT 0,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS secure_storage (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            vehicle_id INTEGER,
+            file_path TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            camera_type TEXT NOT NULL,
+            location TEXT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS otps (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            otp TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            used INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''')
+
+
+def m003_bookings_document_path(conn):
+    _add_column(conn, 'bookings', 'document_path', 'TEXT')
+
+
+def m004_users_home_location(conn):
+    # JSON {"latitude": ..., "longitude": ...}, read by check_emergency_conditions
+    _add_column(conn, 'users', 'home_location', 'TEXT')
+
+
+def m005_location_tables(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS vehicle_locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            vehicle_id INTEGER NOT NULL,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS vehicle_latest_location (
+            vehicle_id INTEGER PRIMARY KEY,
+            latitude REAL NOT NULL,
+            longitude REAL NOT NULL,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY(vehicle_id) REFERENCES vehicles(id)
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS history_partitions (
+            table_name TEXT PRIMARY KEY,
+            source TEXT NOT NULL,
+            day TEXT NOT NULL,
+            row_count INTEGER DEFAULT 0
+        )
+    ''')
+    _schedule_backfill(conn, 'vehicle_latest_location')
+
+
+def m006_index_set(conn):
+    create_indexes(conn)
+
+
+def m007_sample_data(conn):
+    if conn.execute('SELECT 1 FROM users LIMIT 1').fetchone() is None:
+        print("Adding sample user...")  # Debug log
+        conn.execute('''
+            INSERT INTO users (name, email, phone, password, gender, driver_gender_preference)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            'Test User',
+            'test@example.com',
+            '1234567890',
+            hashlib.sha256('password123'.encode()).hexdigest(),
+            'male',
+            'any'
+        ))
+
+    if conn.execute('SELECT 1 FROM vehicles LIMIT 1').fetchone() is None:
+        print("Adding sample vehicles...")  # Debug log
+        # Add vehicles for booking
+        conn.execute('''
+            INSERT INTO vehicles (
+                driver_name, driver_gender, car_model, car_number,
+                car_type, status, customer_gender_preference, is_rental, rental_price
+            ) VALUES
+                ('John Doe', 'male', 'Toyota Camry', 'ABC123', 'standard', 'available', 'any', 0, NULL),
+                ('Jane Smith', 'female', 'Honda Civic', 'XYZ789', 'standard', 'available', 'any', 0, NULL),
+                ('Mike Johnson', 'male', 'Mercedes E-Class', 'DEF456', 'premium', 'available', 'any', 0, NULL),
+                ('Sarah Wilson', 'female', 'Toyota Corolla', 'GHI789', 'shared', 'available', 'any', 0, NULL)
+        ''')
+
+        # Add vehicles for rental
+        conn.execute('''
+            INSERT INTO vehicles (
+                driver_name, driver_gender, car_model, car_number,
+                car_type, status, customer_gender_preference, is_rental, rental_price
+            ) VALUES
+                ('David Brown', 'male', 'BMW 5 Series', 'JKL123', 'premium', 'available', 'any', 1, 100.00),
+                ('Emma Davis', 'female', 'Audi A4', 'MNO456', 'premium', 'available', 'any', 1, 90.00),
+                ('James Wilson', 'male', 'Toyota Camry', 'PQR789', 'standard', 'available', 'any', 1, 50.00),
+                ('Lisa Anderson', 'female', 'Honda Civic', 'STU123', 'standard', 'available', 'any', 1, 45.00)
+        ''')
+
+
+def m008_rental_calendar(conn):
+    create_indexes(conn)
+    # Rentals are now tracked by date range, so the old 'rented' flag would
+    # block a vehicle forever
+    conn.execute("UPDATE vehicles SET status = 'available' WHERE status = 'rented' AND is_rental = 1")
+
+
+def m009_notification_outbox(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sos_dispatches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            trigger_id INTEGER,
+            message TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+    ''')
+    # One row per contact; status is pending -> sending -> sent | failed
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS notification_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dispatch_id INTEGER NOT NULL,
+            channel TEXT NOT NULL,
+            recipient TEXT NOT NULL,
+            contact_name TEXT,
+            message TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            FOREIGN KEY(dispatch_id) REFERENCES sos_dispatches(id)
+        )
+    ''')
+    create_indexes(conn)
+
+
+def m010_emergency_rule_definition(conn):
+    # Optional composite rule as JSON, see emergency_rules.py
+    _add_column(conn, 'emergency_conditions', 'rule_definition', 'TEXT')
+
+
+def m011_sos_trigger_time_index(conn):
+    # Startup rebuild of the SOS window counter and SOS retention read by time
+    create_indexes(conn)
+
+
+def m012_bookings_page_index(conn):
+    # Replaced by the keyset pagination index, which covers the same prefix
+    conn.execute('DROP INDEX IF EXISTS idx_bookings_user_created')
+    create_indexes(conn)
+
+
+def m013_secure_storage_mimetype(conn):
+    # Served back as the Content-Type of /secure_video; NULL rows predate it and are webm
+    _add_column(conn, 'secure_storage', 'mimetype', 'TEXT')
+
+
+def m014_location_time_index(conn):
+    # Retention batches by ping age
+    create_indexes(conn)
+
+
+MIGRATIONS = [
+    (1, 'base_tables', m001_base_tables),
+    (2, 'safety_tables', m002_safety_tables),
+    (3, 'bookings_document_path', m003_bookings_document_path),
+    (4, 'users_home_location', m004_users_home_location),
+    (5, 'location_tables', m005_location_tables),
+    (6, 'index_set', m006_index_set),
+    (7, 'sample_data', m007_sample_data),
+    (8, 'rental_calendar', m008_rental_calendar),
+    (9, 'notification_outbox', m009_notification_outbox),
+    (10, 'emergency_rule_definition', m010_emergency_rule_definition),
+    (11, 'sos_trigger_time_index', m011_sos_trigger_time_index),
+    (12, 'bookings_page_index', m012_bookings_page_index),
+    (13, 'secure_storage_mimetype', m013_secure_storage_mimetype),
+    (14, 'location_time_index', m014_location_time_index),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def _current_version(conn):
+    try:
+        return conn.execute('SELECT MAX(version) FROM schema_version').fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0  # No schema_version table yet
+
+
+def migrate(conn):
+    # Brings the database up to LATEST_VERSION and returns the number of
+    # migrations applied. An up-to-date database costs one indexed read.
+    if _current_version(conn) >= LATEST_VERSION:
+        return 0
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_backfills (
+            name TEXT PRIMARY KEY,
+            last_key INTEGER DEFAULT 0,
+            done INTEGER DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = 0
+    for version, name, migration in MIGRATIONS:
+        # BEGIN IMMEDIATE serialises concurrent workers booting against one file
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if _current_version(conn) >= version:
+                conn.rollback()
+                continue
+            print(f"Applying migration {version}: {name}")  # Debug log
+            migration(conn)
+            conn.execute('INSERT INTO schema_version (version, name) VALUES (?, ?)', (version, name))
+            conn.commit()
+            applied += 1
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
+
+
+# Online backfills. Each step handles one batch in its own short transaction
+# and returns the key to resume from, or None once finished.
+
+def backfill_vehicle_latest_location(conn, last_key, batch_size):
+    vehicle_ids = [row[0] for row in conn.execute('''
+        SELECT DISTINCT vehicle_id FROM vehicle_locations
+        WHERE vehicle_id > ?
+        ORDER BY vehicle_id
+        LIMIT ?
+    ''', (last_key, batch_size))]
+    if not vehicle_ids:
+        return None
+    # OR IGNORE: rows written by live ingest are newer than history
+    conn.executemany('''
+        INSERT OR IGNORE INTO vehicle_latest_location (vehicle_id, latitude, longitude, timestamp)
+        SELECT vehicle_id, latitude, longitude, timestamp
+        FROM vehicle_locations
+        WHERE id = (SELECT MAX(id) FROM vehicle_locations WHERE vehicle_id = ?)
+    ''', [(vehicle_id,) for vehicle_id in vehicle_ids])
+    return vehicle_ids[-1]
+
+
+BACKFILLS = {
+    'vehicle_latest_location': backfill_vehicle_latest_location,
+}
+
+
+def run_backfills(pool, batch_size=500, pause=0.05):
+    conn = pool.acquire()
+    try:
+        pending = [
+            (row[0], row[1])
+            for row in conn.execute('SELECT name, last_key FROM schema_backfills WHERE done = 0')
+        ]
+    finally:
+        conn.close()
+
+    for name, last_key in pending:
+        step = BACKFILLS.get(name)
+        if step is None:
+            print(f"Unknown backfill: {name}")  # Debug log
+            continue
+        print(f"Running backfill {name} from key {last_key}")  # Debug log
+        while True:
+            conn = pool.acquire()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                next_key = step(conn, last_key, batch_size)
+                conn.execute('''
+                    UPDATE schema_backfills
+                    SET last_key = ?, done = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE name = ?
+                ''', (last_key if next_key is None else next_key, 1 if next_key is None else 0, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            if next_key is None:
+                print(f"Backfill {name} complete")  # Debug log
+                break
+            last_key = next_key
+            time.sleep(pause)
+
+
+def _run_backfills_logged(pool):
+    try:
+        run_backfills(pool)
+    except Exception as e:
+        print(f"Backfill error: {str(e)}")  # Debug log
+
+
+def start_backfills(pool):
+    thread = threading.Thread(target=_run_backfills_logged, args=(pool,), name='schema-backfills', daemon=True)
+    thread.start()
+    return thread
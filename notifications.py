@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Emergency notifications go through a durable outbox: the request thread
+# only inserts rows, and a background poller hands due rows to a worker pool
+# that calls the gateway, retrying failures with exponential backoff. The
+# poller wakes at least every poll_interval, which is when retries come due.
+
+MAX_ATTEMPTS = 5
+BASE_BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 300.0
+# A row stuck in 'sending' longer than this (worker died) is retried
+SENDING_LEASE_SECONDS = 60.0
+POLL_INTERVAL_SECONDS = 1.0
+
+
+class NotificationDispatcher:
+    def __init__(self, pool, gateway, workers=8, max_attempts=MAX_ATTEMPTS,
+                 base_backoff=BASE_BACKOFF_SECONDS, poll_interval=POLL_INTERVAL_SECONDS):
+        # gateway(phone, message) returns True once the provider accepted the message
+        self.pool = pool
+        self.gateway = gateway
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.poll_interval = poll_interval
+
+        self._executor = None
+        self._thread = None
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._in_flight = threading.Semaphore(workers * 2)
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notify')
+            self._thread = threading.Thread(target=self._poll_loop, name='notification-poller', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def enqueue(self, user_id, message, contacts, trigger_id=None):
+        # Records one dispatch with an outbox row per contact and returns its id
+        now = time.time()
+        conn = self.pool.acquire()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                INSERT INTO sos_dispatches (user_id, trigger_id, message, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (user_id, trigger_id, message, now))
+            dispatch_id = cursor.lastrowid
+            cursor.executemany('''
+                INSERT INTO notification_outbox (
+                    dispatch_id, channel, recipient, contact_name, message,
+                    status, attempts, next_attempt_at, created_at, updated_at
+                ) VALUES (?, 'sms', ?, ?, ?, 'pending', 0, ?, ?, ?)
+            ''', [
+                (dispatch_id, contact.get('phone'), contact.get('name'), message, now, now, now)
+                for contact in contacts if contact.get('phone')
+            ])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        self.start()
+        self._wakeup.set()
+        return dispatch_id
+
+    def status(self, dispatch_id):
+        conn = self.pool.acquire()
+        try:
+            dispatch = conn.execute(
+                'SELECT id, user_id, trigger_id, created_at FROM sos_dispatches WHERE id = ?', (dispatch_id,)
+            ).fetchone()
+            if dispatch is None:
+                return None
+            deliveries = conn.execute('''
+                SELECT id, recipient, contact_name, status, attempts, last_error, updated_at
+                FROM notification_outbox
+                WHERE dispatch_id = ?
+                ORDER BY id
+            ''', (dispatch_id,)).fetchall()
+        finally:
+            conn.close()
+        return {
+            'dispatch_id': dispatch['id'],
+            'user_id': dispatch['user_id'],
+            'trigger_id': dispatch['trigger_id'],
+            'created_at': dispatch['created_at'],
+            'deliveries': [dict(row) for row in deliveries]
+        }
+
+    def _poll_loop(self):
+        while not self._stopped.is_set():
+            try:
+                while self._dispatch_due():
+                    pass
+            except Exception as e:
+                print(f"Notification poller error: {str(e)}")  # Debug log
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _claim_due(self, limit):
+        # Claims due rows in one statement, so several app workers can share the outbox
+        now = time.time()
+        conn = self.pool.acquire()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                UPDATE notification_outbox SET status = 'pending'
+                WHERE status = 'sending' AND updated_at < ?
+            ''', (now - SENDING_LEASE_SECONDS,))
+            rows = conn.execute('''
+                UPDATE notification_outbox
+                SET status = 'sending', attempts = attempts + 1, updated_at = ?
+                WHERE id IN (
+                    SELECT id FROM notification_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at
+                    LIMIT ?
+                )
+                RETURNING id, recipient, message, attempts
+            ''', (now, now, limit)).fetchall()
+            conn.commit()
+            return rows
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _dispatch_due(self):
+        rows = self._claim_due(self.workers)
+        for row in rows:
+            self._in_flight.acquire()
+            self._executor.submit(self._deliver, row['id'], row['recipient'], row['message'], row['attempts'])
+        return len(rows) == self.workers
+
+    def _deliver(self, outbox_id, recipient, message, attempts):
+        try:
+            try:
+                delivered = self.gateway(recipient, message)
+                error = None if delivered else 'Gateway rejected message'
+            except Exception as e:
+                delivered, error = False, str(e)
+            self._record_result(outbox_id, attempts, delivered, error)
+        except Exception as e:
+            print(f"Error recording delivery {outbox_id}: {str(e)}")  # Debug log
+        finally:
+            self._in_flight.release()
+
+    def _record_result(self, outbox_id, attempts, delivered, error):
+        now = time.time()
+        if delivered:
+            status, next_attempt_at = 'sent', None
+            self.sent += 1
+        elif attempts >= self.max_attempts:
+            status, next_attempt_at = 'failed', None
+            self.failed += 1
+        else:
+            # Exponential backoff with jitter so retries from a burst spread out
+            delay = min(self.base_backoff * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS)
+            status, next_attempt_at = 'pending', now + delay * random.uniform(0.8, 1.2)
+            self.retried += 1
+
+        conn = self.pool.acquire()
+        try:
+            conn.execute('''
+                UPDATE notification_outbox
+                SET status = ?, next_attempt_at = COALESCE(?, next_attempt_at), last_error = ?, updated_at = ?
+                WHERE id = ?
+            ''', (status, next_attempt_at, error, now, outbox_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried
+        }
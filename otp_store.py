@@ -0,0 +1,152 @@
+import hmac
+import secrets
+import threading
+import time
+
+from ttl_cache import TTLCache
+
+# One-time login codes. The live code per user sits in a TTL cache, so
+# verify_otp checks it without reading otps and the entry disappears when
+# it expires. The otps table is the audit trail, written through on issue
+# and consume:
+#   - issuing a code marks the user's earlier unused codes used, so at most
+#     one code per user is ever valid
+#   - consuming is UPDATE ... WHERE id = ? AND used = 0 on that one row; the
+#     worker whose update hits the row wins, so a code is accepted once even
+#     with several workers or concurrent requests
+# A worker that did not issue the code (or restarted since) falls back to
+# the latest row and caches it; a wrong guess against a cached code
+# rechecks the latest row in case another worker issued a newer one. Old
+# rows are purged by the retention worker.
+
+OTP_TTL_SECONDS = 300
+OTP_DIGITS = 6
+# Wrong guesses before the code is burned and a new one must be requested
+MAX_VERIFY_ATTEMPTS = 5
+MAX_CACHED_CODES = 100000
+
+
+class _Code:
+    __slots__ = ('audit_id', 'code', 'expires_at', 'attempts')
+
+    def __init__(self, audit_id, code, expires_at):
+        self.audit_id = audit_id
+        self.code = code
+        self.expires_at = expires_at
+        self.attempts = 0
+
+
+class OtpStore:
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=MAX_VERIFY_ATTEMPTS, max_codes=MAX_CACHED_CODES):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self._codes = TTLCache(max_codes, ttl)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+        self.burned = 0
+        self.db_fallbacks = 0
+
+    def issue(self, conn, user_id):
+        # Generates, audits and caches a new code for user_id; returns it
+        user_id = int(user_id)
+        code = str(secrets.randbelow(10 ** OTP_DIGITS)).zfill(OTP_DIGITS)
+        expires_at = time.time() + self.ttl
+        conn.execute('UPDATE otps SET used = 1 WHERE user_id = ? AND used = 0', (user_id,))
+        audit_id = conn.execute(
+            'INSERT INTO otps (user_id, otp, expires_at) VALUES (?, ?, ?) RETURNING id',
+            (user_id, code, expires_at)
+        ).fetchone()[0]
+        conn.commit()
+        self._codes.set(user_id, _Code(audit_id, code, expires_at))
+        with self._lock:
+            self.issued += 1
+        return code
+
+    def _load(self, conn, user_id, now):
+        # Latest audited code, for codes issued by another worker; (entry, error)
+        row = conn.execute('''
+            SELECT id, otp, expires_at, used
+            FROM otps
+            WHERE user_id = ?
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1
+        ''', (user_id,)).fetchone()
+        with self._lock:
+            self.db_fallbacks += 1
+        if not row:
+            return None, 'No OTP found'
+        if row['used']:
+            return None, 'OTP already used'
+        if now > row['expires_at']:
+            return None, 'OTP expired'
+        return _Code(row['id'], row['otp'], row['expires_at']), None
+
+    def _consume(self, conn, entry):
+        # True if this call flipped the audit row to used
+        cursor = conn.execute('UPDATE otps SET used = 1 WHERE id = ? AND used = 0', (entry.audit_id,))
+        conn.commit()
+        return cursor.rowcount == 1
+
+    def _reject(self, error):
+        with self._lock:
+            self.rejected += 1
+        return error
+
+    def verify(self, conn, user_id, code):
+        # Returns None when the code is accepted (and now used), else the error message
+        user_id = int(user_id)
+        code = str(code).encode()
+        now = time.time()
+        entry = self._codes.get(user_id)
+        if entry is None:
+            entry, error = self._load(conn, user_id, now)
+            if error:
+                return self._reject(error)
+            self._codes.set(user_id, entry, entry.expires_at - now)
+        elif not hmac.compare_digest(code, entry.code.encode()):
+            # Another worker may have issued a newer code since this one was cached
+            fresh, error = self._load(conn, user_id, now)
+            if error:
+                self._codes.pop(user_id)
+                return self._reject(error)
+            if fresh.audit_id != entry.audit_id:
+                entry = fresh
+                self._codes.set(user_id, entry, entry.expires_at - now)
+
+        if now > entry.expires_at:
+            self._codes.pop(user_id)
+            return self._reject('OTP expired')
+
+        if not hmac.compare_digest(code, entry.code.encode()):
+            with self._lock:
+                entry.attempts += 1
+                burn = entry.attempts >= self.max_attempts
+                if burn:
+                    self.burned += 1
+            if burn:
+                self._codes.pop(user_id)
+                self._consume(conn, entry)
+                return self._reject('Too many invalid attempts. Please request a new OTP.')
+            return self._reject('Invalid OTP')
+
+        self._codes.pop(user_id)
+        if not self._consume(conn, entry):
+            return self._reject('OTP already used')
+        with self._lock:
+            self.verified += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cached_codes': len(self._codes),
+                'issued': self.issued,
+                'verified': self.verified,
+                'rejected': self.rejected,
+                'burned': self.burned,
+                'db_fallbacks': self.db_fallbacks
+            }
@@ -0,0 +1,138 @@
+import base64
+import hashlib
+import hmac
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+# Password hashing with scrypt on a bounded thread pool. hashlib.scrypt
+# releases the GIL, so a few threads keep the cores busy while request
+# threads wait; the pool caps how much memory (128 * r * n bytes per hash)
+# and CPU a login storm can take, and anything past the queue limit is
+# turned away instead of piling up.
+#
+# Stored format: scrypt$<n>$<r>$<p>$<salt b64>$<hash b64>. Bare 64-char hex
+# strings are legacy unsalted sha256 hashes; they still verify, and
+# verify() hands back a scrypt hash to replace them with.
+
+SCRYPT_N = int(os.environ.get('SCRYPT_N', 2 ** 14))
+SCRYPT_R = int(os.environ.get('SCRYPT_R', 8))
+SCRYPT_P = int(os.environ.get('SCRYPT_P', 1))
+HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 2))
+# Hashes allowed to wait for a worker before new requests are rejected; this
+# bounds queueing delay to about HASH_QUEUE_LIMIT / HASH_WORKERS hash times
+HASH_QUEUE_LIMIT = int(os.environ.get('PASSWORD_HASH_QUEUE', 4 * HASH_WORKERS))
+HASH_TIMEOUT_SECONDS = 10.0
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+_LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class HasherBusy(Exception):
+    # Raised when the hashing queue is full or a hash outwaits
+    # HASH_TIMEOUT_SECONDS; callers should answer 503
+    pass
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+class PasswordHasher:
+    def __init__(self, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, workers=HASH_WORKERS, queue_limit=HASH_QUEUE_LIMIT):
+        self.n, self.r, self.p = n, r, p
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_limit)
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.rehashed = 0
+        self.wait_seconds = 0.0
+
+    def _scrypt(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * n, dklen=KEY_BYTES)
+
+    def _run(self, fn, *args):
+        # Runs fn on the pool and waits for it, or raises HasherBusy. A hash
+        # that times out keeps its slot until it finishes.
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy('Password hashing is at capacity')
+        queued_at = time.perf_counter()
+        with self._lock:
+            self.pending += 1
+
+        def task():
+            with self._lock:
+                self.pending -= 1
+                self.running += 1
+                self.wait_seconds += time.perf_counter() - queued_at
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self.running -= 1
+                    self.completed += 1
+                self._slots.release()
+
+        future = self._executor.submit(task)
+        try:
+            return future.result(timeout=HASH_TIMEOUT_SECONDS)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise HasherBusy('Password hashing timed out')
+
+    def hash(self, password):
+        salt = os.urandom(SALT_BYTES)
+        key = self._run(self._scrypt, password, salt, self.n, self.r, self.p)
+        return f'scrypt${self.n}${self.r}${self.p}${_b64(salt)}${_b64(key)}'
+
+    def needs_rehash(self, stored):
+        # Legacy hashes and scrypt hashes made with other cost parameters
+        parts = stored.split('$')
+        return not (len(parts) == 6 and parts[0] == 'scrypt' and parts[1:4] == [str(self.n), str(self.r), str(self.p)])
+
+    def verify(self, password, stored):
+        # Returns (matches, replacement hash or None)
+        if not stored:
+            return False, None
+        if _LEGACY_SHA256.match(stored):
+            matches = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored)
+        else:
+            parts = stored.split('$')
+            if len(parts) != 6 or parts[0] != 'scrypt':
+                return False, None
+            n, r, p = int(parts[1]), int(parts[2]), int(parts[3])
+            salt, expected = base64.b64decode(parts[4]), base64.b64decode(parts[5])
+            matches = hmac.compare_digest(self._run(self._scrypt, password, salt, n, r, p), expected)
+        if matches and self.needs_rehash(stored):
+            with self._lock:
+                self.rehashed += 1
+            return True, self.hash(password)
+        return matches, None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_depth': self.pending,
+                'running': self.running,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+                'rehashed': self.rehashed,
+                'avg_wait_ms': round(1000 * self.wait_seconds / self.completed, 2) if self.completed else 0.0,
+                'params': {'n': self.n, 'r': self.r, 'p': self.p}
+            }
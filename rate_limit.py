@@ -0,0 +1,119 @@
+import heapq
+import math
+import threading
+import time
+
+from shared_state import SharedSlotTable
+
+# Token buckets for the login and OTP endpoints, checked before the request
+# touches SQLite or the password hasher. A bucket holds up to `capacity`
+# tokens and regains one every `interval` seconds; each attempt takes one.
+# State per bucket is just (tokens, updated_at), and a bucket that has
+# refilled completely is indistinguishable from a missing one, so entries
+# expire at that moment and the store only holds keys under pressure.
+
+# rule -> (capacity, seconds per token)
+LIMITS = {
+    'login_ip': (20, 3.0),
+    'login_email': (10, 30.0),
+    'otp_verify_ip': (30, 2.0),
+    'otp_verify_user': (5, 60.0),
+    'otp_resend_ip': (10, 30.0),
+    'otp_resend_user': (3, 120.0),
+}
+
+MAX_BUCKETS = 200000
+SHARED_SLOTS = 131072
+
+
+class BucketStore:
+    # Per-process store with the same update() contract as SharedSlotTable:
+    # key -> (expires_at, record)
+    def __init__(self, max_buckets=MAX_BUCKETS):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def update(self, key, now, fn):
+        # fn(record or None) -> (new_record, expires_at, result); returns result
+        with self._lock:
+            entry = self._buckets.get(key)
+            record = entry[1] if entry and entry[0] > now else None
+            new_record, expires_at, result = fn(record)
+            self._buckets[key] = (expires_at, tuple(new_record))
+            if len(self._buckets) > self.max_buckets:
+                self._sweep(now)
+            return result
+
+    def _sweep(self, now):
+        # Drops refilled buckets; if that is not enough, the ones closest to refilling
+        for key in [key for key, entry in self._buckets.items() if entry[0] <= now]:
+            del self._buckets[key]
+        excess = len(self._buckets) - self.max_buckets * 9 // 10
+        if excess > 0:
+            for key, _ in heapq.nsmallest(excess, self._buckets.items(), key=lambda item: item[1][0]):
+                del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RateLimiter:
+    def __init__(self, store, limits=LIMITS):
+        self.store = store
+        self.limits = limits
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.allowed = 0
+        self.rejected = {}
+
+    def hit(self, rule, key, now=None):
+        # Takes a token from rule's bucket for key; returns 0 if allowed,
+        # otherwise the seconds until a token is available
+        capacity, interval = self.limits[rule]
+        now = now or time.time()
+
+        def take(current):
+            if current is None:
+                tokens = float(capacity)
+            else:
+                tokens = min(float(capacity), current[0] + (now - current[1]) / interval)
+            retry_after = 0.0
+            if tokens >= 1.0:
+                tokens -= 1.0
+            else:
+                retry_after = (1.0 - tokens) * interval
+            return (tokens, now), now + (capacity - tokens) * interval, retry_after
+
+        return self.store.update(f'{rule}:{key}', now, take)
+
+    def check(self, *checks):
+        # checks: (rule, key) pairs, None keys skipped. Stops at the first
+        # empty bucket and returns its retry-after; 0 when all allowed
+        now = time.time()
+        for rule, key in checks:
+            if key is None or key == '':
+                continue
+            retry_after = self.hit(rule, key, now)
+            if retry_after:
+                with self._lock:
+                    self.rejected[rule] = self.rejected.get(rule, 0) + 1
+                return math.ceil(retry_after)
+        with self._lock:
+            self.allowed += 1
+        return 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'allowed': self.allowed, 'rejected': dict(self.rejected)}
+        if isinstance(self.store, BucketStore):
+            stats['buckets'] = len(self.store)
+        return stats
+
+
+def make_limiter(shared_name=None):
+    if shared_name:
+        # Record: tokens, updated_at
+        return RateLimiter(SharedSlotTable(f'{shared_name}-ratelimit', SHARED_SLOTS, 'dd'))
+    return RateLimiter(BucketStore())
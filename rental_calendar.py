@@ -0,0 +1,107 @@
+import bisect
+import threading
+from datetime import date, datetime
+
+# Rentals in these states hold the vehicle for their dates
+ACTIVE_RENTAL_STATUSES = ('pending', 'confirmed', 'active')
+
+
+def to_day(value):
+    # 'YYYY-MM-DD', date or datetime -> proleptic ordinal day
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d')
+    if isinstance(value, datetime):
+        value = value.date()
+    return value.toordinal()
+
+
+def from_day(day):
+    return date.fromordinal(day).isoformat()
+
+
+class RentalCalendar:
+    # Per-vehicle reservations as half-open day intervals [start, end), kept in
+    # two parallel sorted lists. Reservations of one vehicle never overlap, so
+    # sorting by start also sorts by end and every overlap test is one bisect.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._starts = {}  # vehicle_id -> [start_day, ...]
+        self._ends = {}  # vehicle_id -> [end_day, ...]
+        self._ids = {}  # vehicle_id -> [rental_id, ...]
+        self.last_rental_id = 0
+
+    def _overlaps(self, vehicle_id, start, end):
+        starts = self._starts.get(vehicle_id)
+        if not starts:
+            return False
+        # Last reservation starting before our end is the only one that can reach into us
+        i = bisect.bisect_left(starts, end)
+        return i > 0 and self._ends[vehicle_id][i - 1] > start
+
+    def is_free(self, vehicle_id, start, end):
+        with self._lock:
+            return not self._overlaps(vehicle_id, to_day(start), to_day(end))
+
+    def add(self, vehicle_id, start, end, rental_id):
+        start, end = to_day(start), to_day(end)
+        with self._lock:
+            if self._overlaps(vehicle_id, start, end):
+                return False
+            starts = self._starts.setdefault(vehicle_id, [])
+            i = bisect.bisect_left(starts, start)
+            starts.insert(i, start)
+            self._ends.setdefault(vehicle_id, []).insert(i, end)
+            self._ids.setdefault(vehicle_id, []).insert(i, rental_id)
+            return True
+
+    def free_vehicles(self, vehicle_ids, start, end):
+        start, end = to_day(start), to_day(end)
+        with self._lock:
+            return [vehicle_id for vehicle_id in vehicle_ids if not self._overlaps(vehicle_id, start, end)]
+
+    def free_windows(self, vehicle_id, start, end):
+        # Gaps between reservations inside [start, end), as ISO date pairs
+        start, end = to_day(start), to_day(end)
+        with self._lock:
+            starts = self._starts.get(vehicle_id, [])
+            ends = self._ends.get(vehicle_id, [])
+            # First reservation that ends after our start
+            i = bisect.bisect_right(ends, start)
+            windows = []
+            cursor = start
+            while i < len(starts) and starts[i] < end:
+                if starts[i] > cursor:
+                    windows.append((from_day(cursor), from_day(starts[i])))
+                cursor = max(cursor, ends[i])
+                i += 1
+            if cursor < end:
+                windows.append((from_day(cursor), from_day(end)))
+            return windows
+
+    def reservations(self, vehicle_id):
+        with self._lock:
+            return [
+                {'rental_id': rental_id, 'start_date': from_day(s), 'end_date': from_day(e)}
+                for s, e, rental_id in zip(self._starts.get(vehicle_id, []), self._ends.get(vehicle_id, []), self._ids.get(vehicle_id, []))
+            ]
+
+    def refresh(self, conn):
+        # Picks up rentals created since the last refresh, including ones
+        # written by other workers. Rentals that already ended are skipped.
+        newest = conn.execute('SELECT MAX(id) FROM rentals').fetchone()[0] or 0
+        if newest <= self.last_rental_id:
+            return 0
+        placeholders = ', '.join('?' for _ in ACTIVE_RENTAL_STATUSES)
+        rows = conn.execute(f'''
+            SELECT id, vehicle_id, start_date, end_date
+            FROM rentals
+            WHERE id > ? AND id <= ? AND status IN ({placeholders}) AND end_date >= ?
+        ''', (self.last_rental_id, newest, *ACTIVE_RENTAL_STATUSES, date.today().isoformat())).fetchall()
+        for row in rows:
+            try:
+                self.add(row['vehicle_id'], row['start_date'], row['end_date'], row['id'])
+            except ValueError:
+                print(f"Skipping rental {row['id']} with invalid dates")  # Debug log
+        with self._lock:
+            self.last_rental_id = max(self.last_rental_id, newest)
+        return len(rows)
@@ -0,0 +1,282 @@
+import math
+import threading
+import time
+from datetime import datetime, timezone
+
+from geodistance import KM_PER_DEGREE
+
+# Raw pings newer than this stay in vehicle_locations untouched
+LOCATION_HOT_DAYS = 2
+# Hot location rows beyond this are archived early, oldest first
+LOCATION_HOT_MAX_ROWS = 2000000
+# Douglas-Peucker tolerance for archived tracks, in metres
+TRACK_TOLERANCE_METERS = 15.0
+
+SOS_HOT_DAYS = 30
+
+# OTP audit rows are deleted this long after the code expired
+OTP_AUDIT_DAYS = 30
+
+BATCH_SIZE = 5000
+RUN_INTERVAL_SECONDS = 60
+# Pause between batches so request-path writers get the lock in between
+BATCH_PAUSE_SECONDS = 0.05
+
+
+def _perpendicular_meters(point, start, end):
+    # Distance from point to the segment start-end on a local flat projection
+    scale_y = KM_PER_DEGREE * 1000
+    scale_x = scale_y * math.cos(math.radians(start[0]))
+    px, py = (point[1] - start[1]) * scale_x, (point[0] - start[0]) * scale_y
+    ex, ey = (end[1] - start[1]) * scale_x, (end[0] - start[0]) * scale_y
+    length_sq = ex * ex + ey * ey
+    if length_sq == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * ex + py * ey) / length_sq))
+    return math.hypot(px - t * ex, py - t * ey)
+
+
+def douglas_peucker(points, tolerance_meters):
+    # points are (lat, lon, ...) tuples in track order; returns the kept subset
+    if len(points) < 3:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_distance, index = 0.0, None
+        for i in range(first + 1, last):
+            distance = _perpendicular_meters(points[i], points[first], points[last])
+            if distance > max_distance:
+                max_distance, index = distance, i
+        if index is not None and max_distance > tolerance_meters:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [point for point, kept in zip(points, keep) if kept]
+
+
+def _table_exists(conn, name):
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+    ).fetchone() is not None
+
+
+def _ensure_partition(conn, source, day):
+    # Day partitions share the source table's columns and are listed in history_partitions
+    table = f'{source}_archive_{day}'
+    if not _table_exists(conn, table):
+        conn.execute(f'CREATE TABLE {table} AS SELECT * FROM {source} WHERE 0')
+        conn.execute(
+            'INSERT OR IGNORE INTO history_partitions (table_name, source, day, row_count) VALUES (?, ?, ?, 0)',
+            (table, source, day)
+        )
+    return table
+
+
+class RetentionWorker:
+    def __init__(self, pool, batch_size=BATCH_SIZE, interval=RUN_INTERVAL_SECONDS):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.interval = interval
+        self._thread = None
+        self._stopped = threading.Event()
+
+        # Metrics
+        self.runs = 0
+        self.locations_archived = 0
+        self.locations_kept = 0
+        self.sos_archived = 0
+        self.otps_purged = 0
+        self.last_run_ms = 0.0
+        self.errors = 0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name='history-retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.errors += 1
+                print(f"Retention error: {str(e)}")  # Debug log
+            self._stopped.wait(self.interval)
+
+    def run_once(self, now=None):
+        # Archives everything currently past retention, one short transaction per batch
+        started = time.perf_counter()
+        now = now or time.time()
+        location_cutoff = self._location_cutoff(now)
+        while not self._stopped.is_set():
+            moved = (self.archive_locations_batch(*location_cutoff) + self.archive_sos_batch(now)
+                     + self.purge_otps_batch(now))
+            if not moved:
+                break
+            time.sleep(BATCH_PAUSE_SECONDS)
+        self.runs += 1
+        self.last_run_ms = (time.perf_counter() - started) * 1000
+
+    def _location_cutoff(self, now):
+        # Returns (timestamp_cutoff, id_cutoff). Ids only grow, so every row at or
+        # below max(id) - LOCATION_HOT_MAX_ROWS is outside the size cap.
+        conn = self.pool.acquire()
+        try:
+            max_id = None
+            if _table_exists(conn, 'vehicle_locations'):
+                max_id = conn.execute('SELECT MAX(id) FROM vehicle_locations').fetchone()[0]
+            return int(now - LOCATION_HOT_DAYS * 86400), (max_id or 0) - LOCATION_HOT_MAX_ROWS
+        finally:
+            conn.close()
+
+    def archive_locations_batch(self, cutoff, id_cutoff=0):
+        conn = self.pool.acquire()
+        try:
+            if not _table_exists(conn, 'vehicle_locations'):
+                return 0
+            # The batch is picked before the write lock is taken, through the
+            # timestamp index and the id range, so a run with nothing to
+            # archive never blocks ingest. Pings are never updated, so rows
+            # read here are still current once the lock is held.
+            rows = conn.execute('''
+                SELECT id, vehicle_id, latitude, longitude, timestamp
+                FROM vehicle_locations
+                WHERE timestamp < ?
+                ORDER BY timestamp
+                LIMIT ?
+            ''', (cutoff, self.batch_size)).fetchall()
+            if len(rows) < self.batch_size and id_cutoff > 0:
+                rows += conn.execute('''
+                    SELECT id, vehicle_id, latitude, longitude, timestamp
+                    FROM vehicle_locations
+                    WHERE id <= ?
+                    ORDER BY id
+                    LIMIT ?
+                ''', (id_cutoff, self.batch_size - len(rows))).fetchall()
+            if not rows:
+                return 0
+
+            conn.execute('BEGIN IMMEDIATE')
+            # Another worker may have archived some of these meanwhile; only
+            # the rows this transaction deletes are archived by it
+            rows = list({row['id']: row for row in rows}.values())
+            rows = [
+                row for row in rows
+                if conn.execute('DELETE FROM vehicle_locations WHERE id = ?', (row['id'],)).rowcount
+            ]
+            if not rows:
+                conn.rollback()
+                return 0
+
+            # Downsample each vehicle's track within each day
+            tracks = {}
+            for row in rows:
+                day = datetime.fromtimestamp(row['timestamp'], timezone.utc).strftime('%Y%m%d')
+                tracks.setdefault((day, row['vehicle_id']), []).append(
+                    (row['latitude'], row['longitude'], row['id'], row['timestamp'])
+                )
+            kept = 0
+            for (day, vehicle_id), track in tracks.items():
+                track.sort(key=lambda point: point[3])
+                table = _ensure_partition(conn, 'vehicle_locations', day)
+                points = douglas_peucker(track, TRACK_TOLERANCE_METERS)
+                conn.executemany(
+                    f'INSERT INTO {table} (id, vehicle_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [(point[2], vehicle_id, point[0], point[1], point[3]) for point in points]
+                )
+                conn.execute(
+                    'UPDATE history_partitions SET row_count = row_count + ? WHERE table_name = ?',
+                    (len(points), table)
+                )
+                kept += len(points)
+            conn.commit()
+            self.locations_archived += len(rows)
+            self.locations_kept += kept
+            return len(rows)
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def archive_sos_batch(self, now):
+        conn = self.pool.acquire()
+        try:
+            if not _table_exists(conn, 'sos_triggers'):
+                return 0
+            cutoff = datetime.fromtimestamp(now - SOS_HOT_DAYS * 86400, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            # Oldest first through the time index, before taking the write lock
+            rows = conn.execute('''
+                SELECT id, strftime('%Y%m%d', timestamp) AS day
+                FROM sos_triggers
+                WHERE timestamp < ?
+                ORDER BY timestamp
+                LIMIT ?
+            ''', (cutoff, self.batch_size)).fetchall()
+            if not rows:
+                return 0
+
+            # SOS history is evidence, so it is moved whole rather than downsampled.
+            # Rows another worker moved meanwhile copy and delete nothing.
+            conn.execute('BEGIN IMMEDIATE')
+            by_day = {}
+            for row in rows:
+                by_day.setdefault(row['day'] or '00000000', []).append(row['id'])
+            moved = 0
+            for day, ids in by_day.items():
+                table = _ensure_partition(conn, 'sos_triggers', day)
+                copied = conn.executemany(
+                    f'INSERT INTO {table} SELECT * FROM sos_triggers WHERE id = ?', [(i,) for i in ids]
+                ).rowcount
+                conn.execute(
+                    'UPDATE history_partitions SET row_count = row_count + ? WHERE table_name = ?',
+                    (copied, table)
+                )
+                moved += copied
+            conn.executemany('DELETE FROM sos_triggers WHERE id = ?', [(row['id'],) for row in rows])
+            conn.commit()
+            self.sos_archived += moved
+            return moved
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def purge_otps_batch(self, now):
+        # Codes expire in minutes, so ids and expiry grow together and the
+        # oldest ids are the expired ones
+        conn = self.pool.acquire()
+        try:
+            if not _table_exists(conn, 'otps'):
+                return 0
+            cursor = conn.execute('''
+                DELETE FROM otps WHERE id IN (
+                    SELECT id FROM otps WHERE expires_at < ? ORDER BY id LIMIT ?
+                )
+            ''', (now - OTP_AUDIT_DAYS * 86400, self.batch_size))
+            conn.commit()
+            self.otps_purged += cursor.rowcount
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'locations_archived': self.locations_archived,
+            'locations_kept': self.locations_kept,
+            'sos_archived': self.sos_archived,
+            'otps_purged': self.otps_purged,
+            'last_run_ms': round(self.last_run_ms, 3),
+            'errors': self.errors
+        }
@@ -0,0 +1,286 @@
+import heapq
+import math
+import mmap
+import os
+import random
+import struct
+import sys
+import xml.etree.ElementTree as ET
+from array import array
+from bisect import bisect_left, bisect_right
+
+from geodistance import haversine_km
+
+# Offline road routing. An OpenStreetMap XML extract is compiled once into a
+# flat binary file:
+#   - node coordinates, ordered by grid cell so snapping a point is a bisect
+#   - forward and reverse adjacency in CSR form (offsets/targets/weights)
+#   - travel times from and to a handful of landmarks (ALT)
+# Workers open the file with mmap, so every process shares one copy through
+# the page cache. Queries run A* with landmark lower bounds, which settles a
+# small fraction of the nodes plain Dijkstra would.
+#
+#   python road_graph.py build city.osm road_graph.bin [landmarks]
+
+MAGIC = b'RRG1'
+HEADER_FORMAT = '<4sIIIId'  # magic, version, nodes, edges, landmarks, cell degrees
+VERSION = 1
+CELL_DEGREES = 0.01
+DEFAULT_LANDMARKS = 8
+INFINITY = 3.0e38
+# Points further than this from any road node do not snap
+MAX_SNAP_KM = 1.0
+
+# km/h by highway type, used when a way has no usable maxspeed
+SPEEDS_KMH = {
+    'motorway': 90, 'motorway_link': 60,
+    'trunk': 70, 'trunk_link': 50,
+    'primary': 50, 'primary_link': 40,
+    'secondary': 40, 'secondary_link': 35,
+    'tertiary': 35, 'tertiary_link': 30,
+    'unclassified': 30, 'residential': 25,
+    'living_street': 10, 'service': 15, 'road': 25,
+}
+
+
+def _cell_key(lat, lon, cell_degrees):
+    return (math.floor(lat / cell_degrees) + 32768) * 65536 + (math.floor(lon / cell_degrees) + 32768)
+
+
+def _speed(tags):
+    maxspeed = tags.get('maxspeed', '')
+    digits = ''.join(ch for ch in maxspeed.split(';')[0] if ch.isdigit())
+    if digits:
+        speed = float(digits)
+        return speed * 1.609 if 'mph' in maxspeed else speed
+    return SPEEDS_KMH[tags['highway']]
+
+
+def parse_osm(path):
+    # Returns ({osm_node_id: (lat, lon)}, [(u, v, length_m, seconds), ...])
+    coordinates = {}
+    edges = []
+    for _, element in ET.iterparse(path, events=('end',)):
+        if element.tag == 'node':
+            coordinates[int(element.get('id'))] = (float(element.get('lat')), float(element.get('lon')))
+            element.clear()
+        elif element.tag == 'way':
+            tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+            if tags.get('highway') in SPEEDS_KMH and tags.get('access') not in ('no', 'private'):
+                refs = [int(nd.get('ref')) for nd in element.iter('nd')]
+                oneway = tags.get('oneway', 'no')
+                forward = oneway != '-1'
+                backward = oneway in ('no', 'false', '0') and tags.get('junction') != 'roundabout'
+                if oneway == '-1':
+                    backward = True
+                speed = _speed(tags)
+                for u, v in zip(refs, refs[1:]):
+                    if u not in coordinates or v not in coordinates:
+                        continue
+                    length = haversine_km(*coordinates[u], *coordinates[v]) * 1000.0
+                    seconds = length / (speed / 3.6)
+                    if forward:
+                        edges.append((u, v, length, seconds))
+                    if backward:
+                        edges.append((v, u, length, seconds))
+            element.clear()
+    return coordinates, edges
+
+
+def _csr(node_count, edges):
+    # edges: [(source, target, seconds, length)] -> offsets, targets, seconds, lengths
+    edges.sort()
+    offsets = array('i', [0] * (node_count + 1))
+    for source, _, _, _ in edges:
+        offsets[source + 1] += 1
+    for i in range(node_count):
+        offsets[i + 1] += offsets[i]
+    return (offsets, array('i', (e[1] for e in edges)),
+            array('f', (e[2] for e in edges)), array('f', (e[3] for e in edges)))
+
+
+def _dijkstra_all(offsets, targets, weights, source, node_count):
+    distances = [INFINITY] * node_count
+    distances[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        distance, node = heapq.heappop(heap)
+        if distance > distances[node]:
+            continue
+        for i in range(offsets[node], offsets[node + 1]):
+            candidate = distance + weights[i]
+            target = targets[i]
+            if candidate < distances[target]:
+                distances[target] = candidate
+                heapq.heappush(heap, (candidate, target))
+    return distances
+
+
+def _sections(node_count, edge_count, landmark_count):
+    # (name, typecode, length) in file order
+    return [
+        ('lat', 'd', node_count), ('lon', 'd', node_count), ('cell', 'q', node_count),
+        ('fwd_offsets', 'i', node_count + 1), ('fwd_targets', 'i', edge_count),
+        ('fwd_seconds', 'f', edge_count), ('fwd_lengths', 'f', edge_count),
+        ('rev_offsets', 'i', node_count + 1), ('rev_targets', 'i', edge_count),
+        ('rev_seconds', 'f', edge_count),
+        ('landmark_from', 'f', landmark_count * node_count),
+        ('landmark_to', 'f', landmark_count * node_count),
+    ]
+
+
+def build(osm_path, out_path, landmark_count=DEFAULT_LANDMARKS, cell_degrees=CELL_DEGREES):
+    coordinates, osm_edges = parse_osm(osm_path)
+    used = sorted({u for u, _, _, _ in osm_edges} | {v for _, v, _, _ in osm_edges},
+                  key=lambda node: _cell_key(*coordinates[node], cell_degrees))
+    index = {node: i for i, node in enumerate(used)}
+    node_count = len(used)
+    if node_count == 0:
+        raise ValueError(f'No routable roads in {osm_path}')
+
+    forward = _csr(node_count, [(index[u], index[v], seconds, length) for u, v, length, seconds in osm_edges])
+    reverse = _csr(node_count, [(index[v], index[u], seconds, length) for u, v, length, seconds in osm_edges])
+
+    # Landmarks by farthest-point selection: each new one is the node furthest
+    # (in travel time) from those already chosen
+    landmark_from, landmark_to = array('f'), array('f')
+    landmark_count = min(landmark_count, node_count)
+    closest = [INFINITY] * node_count
+    landmark = random.Random(0).randrange(node_count)
+    for _ in range(landmark_count):
+        from_landmark = _dijkstra_all(forward[0], forward[1], forward[2], landmark, node_count)
+        landmark_from.extend(from_landmark)
+        landmark_to.extend(_dijkstra_all(reverse[0], reverse[1], reverse[2], landmark, node_count))
+        for i, distance in enumerate(from_landmark):
+            if distance < closest[i]:
+                closest[i] = distance
+        reachable = [(distance, i) for i, distance in enumerate(closest) if distance < INFINITY]
+        landmark = max(reachable)[1]
+
+    data = {
+        'lat': array('d', (coordinates[node][0] for node in used)),
+        'lon': array('d', (coordinates[node][1] for node in used)),
+        'cell': array('q', (_cell_key(*coordinates[node], cell_degrees) for node in used)),
+        'fwd_offsets': forward[0], 'fwd_targets': forward[1], 'fwd_seconds': forward[2], 'fwd_lengths': forward[3],
+        'rev_offsets': reverse[0], 'rev_targets': reverse[1], 'rev_seconds': reverse[2],
+        'landmark_from': landmark_from, 'landmark_to': landmark_to,
+    }
+    with open(out_path + '.part', 'wb') as f:
+        f.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, node_count, len(osm_edges), landmark_count, cell_degrees))
+        for name, _, _ in _sections(node_count, len(osm_edges), landmark_count):
+            f.write(b'\0' * (-f.tell() % 8))
+            f.write(data[name].tobytes())
+    os.replace(out_path + '.part', out_path)
+    return node_count, len(osm_edges)
+
+
+class RoadGraph:
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.node_count, self.edge_count, self.landmark_count, self.cell_degrees = \
+            struct.unpack_from(HEADER_FORMAT, self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a road graph this version can read')
+
+        view = memoryview(self._map)
+        offset = struct.calcsize(HEADER_FORMAT)
+        for name, typecode, length in _sections(self.node_count, self.edge_count, self.landmark_count):
+            offset += -offset % 8
+            size = length * array(typecode).itemsize
+            setattr(self, name, view[offset:offset + size].cast(typecode))
+            offset += size
+
+    def nearest_node(self, lat, lon):
+        # Closest node in the 3x3 cells around the point, or None
+        base = _cell_key(lat, lon, self.cell_degrees)
+        best, best_km = None, MAX_SNAP_KM
+        for dy in (-65536, 0, 65536):
+            for dx in (-1, 0, 1):
+                key = base + dy + dx
+                for node in range(bisect_left(self.cell, key), bisect_right(self.cell, key)):
+                    distance = haversine_km(lat, lon, self.lat[node], self.lon[node])
+                    if distance < best_km:
+                        best, best_km = node, distance
+        return best
+
+    def _heuristic(self, target):
+        # ALT lower bound on the travel time from any node to target
+        n = self.node_count
+        landmark_from, landmark_to = self.landmark_from, self.landmark_to
+        terms = [
+            (k * n, landmark_from[k * n + target], landmark_to[k * n + target])
+            for k in range(self.landmark_count)
+            if landmark_from[k * n + target] < INFINITY and landmark_to[k * n + target] < INFINITY
+        ]
+
+        def estimate(node):
+            best = 0.0
+            for base, from_target, to_target in terms:
+                from_node = landmark_from[base + node]
+                to_node = landmark_to[base + node]
+                if from_node < INFINITY and from_target - from_node > best:
+                    best = from_target - from_node
+                if to_node < INFINITY and to_node - to_target > best:
+                    best = to_node - to_target
+            return best
+
+        return estimate
+
+    def shortest_path(self, source, target):
+        # Returns (seconds, metres, settled nodes) or None if unreachable
+        if source == target:
+            return 0.0, 0.0, 0
+        estimate = self._heuristic(target)
+        offsets, targets, seconds, lengths = self.fwd_offsets, self.fwd_targets, self.fwd_seconds, self.fwd_lengths
+        best = {source: 0.0}
+        metres = {source: 0.0}
+        heap = [(estimate(source), 0.0, source)]
+        settled = 0
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if cost > best[node]:
+                continue
+            settled += 1
+            if node == target:
+                return cost, metres[node], settled
+            for i in range(offsets[node], offsets[node + 1]):
+                neighbour = targets[i]
+                candidate = cost + seconds[i]
+                if candidate < best.get(neighbour, INFINITY):
+                    best[neighbour] = candidate
+                    metres[neighbour] = metres[node] + lengths[i]
+                    heapq.heappush(heap, (candidate + estimate(neighbour), candidate, neighbour))
+        return None
+
+    def route(self, origin, destination):
+        # origin/destination: (lat, lon). Returns distance and duration, or None
+        source = self.nearest_node(*origin)
+        target = self.nearest_node(*destination)
+        if source is None or target is None:
+            return None
+        result = self.shortest_path(source, target)
+        if result is None:
+            return None
+        seconds, metres, settled = result
+        return {'distance_km': metres / 1000.0, 'duration_s': seconds, 'settled': settled}
+
+    def route_km(self, origin, destination):
+        # Router hook for FareEngine
+        result = self.route(origin, destination)
+        return result['distance_km'] if result else None
+
+    def stats(self):
+        return {
+            'nodes': self.node_count,
+            'edges': self.edge_count,
+            'landmarks': self.landmark_count
+        }
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'build':
+        print('usage: python road_graph.py build <extract.osm> <graph.bin> [landmarks]')
+        sys.exit(2)
+    nodes, edges = build(sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else DEFAULT_LANDMARKS)
+    print(f'Wrote {sys.argv[3]}: {nodes} nodes, {edges} edges')
@@ -13,6 +13,7 @@ CREATE TABLE IF NOT EXISTS emergency_conditions (
     speed_threshold INTEGER,
     speed_condition TEXT,
     emergency_contacts TEXT,
+    rule_definition TEXT,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users (id)
 );
@@ -37,6 +38,7 @@ CREATE TABLE IF NOT EXISTS secure_storage (
     password_hash TEXT NOT NULL,
     camera_type TEXT NOT NULL,
     location TEXT,
+    mimetype TEXT,
     created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (user_id) REFERENCES users (id),
     FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
@@ -85,4 +87,79 @@ CREATE TABLE IF NOT EXISTS drivers (
     updated_at TIMESTAMP,
     verified_at TIMESTAMP,
     rejection_reason TEXT
-); 
\ No newline at end of file
+); 
+-- Vehicle location history
+CREATE TABLE IF NOT EXISTS vehicle_locations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    vehicle_id INTEGER NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    timestamp INTEGER NOT NULL,
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+);
+
+-- Latest known position per vehicle
+CREATE TABLE IF NOT EXISTS vehicle_latest_location (
+    vehicle_id INTEGER PRIMARY KEY,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    timestamp INTEGER NOT NULL,
+    FOREIGN KEY (vehicle_id) REFERENCES vehicles (id)
+);
+
+-- Day partitions holding archived history
+CREATE TABLE IF NOT EXISTS history_partitions (
+    table_name TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    day TEXT NOT NULL,
+    row_count INTEGER DEFAULT 0
+);
+
+-- One-time passwords
+CREATE TABLE IF NOT EXISTS otps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    otp TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    used INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+-- Emergency notification dispatches and their per-contact outbox
+CREATE TABLE IF NOT EXISTS sos_dispatches (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    trigger_id INTEGER,
+    message TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+
+CREATE TABLE IF NOT EXISTS notification_outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    dispatch_id INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    contact_name TEXT,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    FOREIGN KEY (dispatch_id) REFERENCES sos_dispatches (id)
+);
+
+-- Index set (see db_indexes.py, which applies it at startup)
+CREATE INDEX IF NOT EXISTS idx_emergency_conditions_user ON emergency_conditions (user_id);
+CREATE INDEX IF NOT EXISTS idx_sos_triggers_user_time ON sos_triggers (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_sos_triggers_time ON sos_triggers (timestamp);
+CREATE INDEX IF NOT EXISTS idx_bookings_user_page ON bookings (user_id, created_at DESC, id DESC, status, service_type, price, vehicle_id);
+CREATE INDEX IF NOT EXISTS idx_otps_user_created ON otps (user_id, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_secure_storage_file_path ON secure_storage (file_path);
+CREATE INDEX IF NOT EXISTS idx_vehicle_locations_vehicle ON vehicle_locations (vehicle_id, id);
+CREATE INDEX IF NOT EXISTS idx_vehicle_locations_time ON vehicle_locations (timestamp);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_due ON notification_outbox (status, next_attempt_at);
+CREATE INDEX IF NOT EXISTS idx_notification_outbox_dispatch ON notification_outbox (dispatch_id);
\ No newline at end of file
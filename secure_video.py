@@ -0,0 +1,158 @@
+import os
+import struct
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+# On-disk layout of a chunked .enc file:
+#
+#   header: magic(4) | version(1) | reserved(3) | chunk_size(4) | nonce_prefix(8)
+#   frames: AES-GCM(chunk_i) | tag(16), one per plaintext chunk
+#
+# Every frame but the last holds exactly chunk_size plaintext bytes, so frame i
+# starts at HEADER_SIZE + i * (chunk_size + TAG_SIZE). The nonce is
+# nonce_prefix | i and the associated data binds the header, the frame index
+# and a final-frame flag, so frames cannot be reordered, swapped between files
+# or truncated away without failing authentication.
+MAGIC = b'RVE1'
+VERSION = 1
+HEADER_FORMAT = '>4sB3xI8s'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+
+class VideoDecryptionError(Exception):
+    pass
+
+
+def _read_full(stream, size):
+    # Stream reads may return short; keep reading until size bytes or EOF
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = stream.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+class ChunkedCipher:
+    def __init__(self, key, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.aead = AESGCM(key)
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_fernet_key(cls, fernet_key, chunk_size=DEFAULT_CHUNK_SIZE):
+        # Derive a dedicated AES-256 key so the Fernet key is never reused directly
+        key = HKDF(
+            algorithm=hashes.SHA256(),
+            length=32,
+            salt=None,
+            info=b'rideease-secure-video-v1'
+        ).derive(fernet_key)
+        return cls(key, chunk_size)
+
+    @staticmethod
+    def _frame_aad(header, index, final):
+        return header + struct.pack('>IB', index, 1 if final else 0)
+
+    @staticmethod
+    def _frame_nonce(nonce_prefix, index):
+        return nonce_prefix + struct.pack('>I', index)
+
+    def encrypt_stream(self, stream, dest_path):
+        # Encrypts stream into dest_path one chunk at a time and returns the
+        # number of plaintext bytes written. Peak memory is about two chunks.
+        nonce_prefix = os.urandom(8)
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, self.chunk_size, nonce_prefix)
+        tmp_path = dest_path + '.part'
+        total = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(header)
+                index = 0
+                chunk = _read_full(stream, self.chunk_size)
+                while True:
+                    # Look one chunk ahead so the last frame can be flagged final
+                    next_chunk = _read_full(stream, self.chunk_size) if len(chunk) == self.chunk_size else b''
+                    final = not next_chunk
+                    nonce = self._frame_nonce(nonce_prefix, index)
+                    f.write(self.aead.encrypt(nonce, chunk, self._frame_aad(header, index, final)))
+                    total += len(chunk)
+                    if final:
+                        break
+                    chunk = next_chunk
+                    index += 1
+            os.replace(tmp_path, dest_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return total
+
+    def _layout(self, f):
+        # Returns (header, chunk_size, nonce_prefix, frame_count, plaintext_size)
+        header = f.read(HEADER_SIZE)
+        chunk_size, nonce_prefix = self._parse_header(header)
+        body_size = os.fstat(f.fileno()).st_size - HEADER_SIZE
+        frame_size = chunk_size + TAG_SIZE
+        frame_count = max(1, -(-body_size // frame_size))
+        last_frame_size = body_size - (frame_count - 1) * frame_size
+        if last_frame_size < TAG_SIZE:
+            raise VideoDecryptionError('Truncated video frame')
+        return header, chunk_size, nonce_prefix, frame_count, body_size - frame_count * TAG_SIZE
+
+    def plaintext_size(self, path):
+        with open(path, 'rb') as f:
+            return self._layout(f)[4]
+
+    def iter_range(self, path, start, stop):
+        # Yields plaintext bytes [start, stop), decrypting only the frames
+        # that overlap the range.
+        with open(path, 'rb') as f:
+            header, chunk_size, nonce_prefix, frame_count, size = self._layout(f)
+            stop = min(stop, size)
+            if start >= stop:
+                return
+            frame_size = chunk_size + TAG_SIZE
+            first = start // chunk_size
+            last = (stop - 1) // chunk_size
+            f.seek(HEADER_SIZE + first * frame_size)
+            for index in range(first, last + 1):
+                frame = f.read(frame_size)
+                chunk = self._decrypt_frame(header, nonce_prefix, index, frame, index == frame_count - 1)
+                offset = index * chunk_size
+                yield chunk[max(start - offset, 0):stop - offset]
+
+    def iter_decrypt(self, path):
+        return self.iter_range(path, 0, self.plaintext_size(path))
+
+    def decrypt_file(self, path):
+        return b''.join(self.iter_decrypt(path))
+
+    def _parse_header(self, header):
+        if len(header) != HEADER_SIZE:
+            raise VideoDecryptionError('Truncated video header')
+        magic, version, chunk_size, nonce_prefix = struct.unpack(HEADER_FORMAT, header)
+        if magic != MAGIC or version != VERSION:
+            raise VideoDecryptionError('Unsupported video format')
+        return chunk_size, nonce_prefix
+
+    def _decrypt_frame(self, header, nonce_prefix, index, frame, final):
+        try:
+            return self.aead.decrypt(
+                self._frame_nonce(nonce_prefix, index),
+                frame,
+                self._frame_aad(header, index, final)
+            )
+        except Exception:
+            raise VideoDecryptionError(f'Video frame {index} failed authentication')
+
+
+def is_chunked_file(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,124 @@
+import hashlib
+import os
+import struct
+import tempfile
+import threading
+from multiprocessing import resource_tracker, shared_memory
+
+# Fixed-size hash table of small records in a named shared-memory block, so
+# every worker process on the host sees the same counters. Each slot is
+#   key (8 bytes, 0 = empty) | expires_at (double) | caller's record
+# and is looked up with linear probing. Expired slots are reused; when every
+# probed slot is live, the one closest to expiry is overwritten, so the table
+# never grows; callers that must not lose entries pass evict=False and get
+# SlotTableFull instead. Writers serialise on an flock'ed file next to the
+# block.
+#
+# Only used when SHARED_STATE_NAME is set; single-process deployments keep
+# plain dicts.
+
+MAX_PROBES = 16
+
+
+def key_hash(key):
+    # Stable across processes, unlike hash(); never 0
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+class SlotTableFull(Exception):
+    # Raised by update(evict=False) when the key's probe window is all live
+    pass
+
+
+class SharedSlotTable:
+    def __init__(self, name, slots, record_format):
+        self.name = name
+        self.slots = slots
+        self._struct = struct.Struct('<Qd' + record_format)
+        self.record_size = self._struct.size
+        size = self.record_size * slots
+
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+            self.created = True
+        except FileExistsError:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.created = False
+        # The block outlives any one worker; without this the first worker to
+        # exit would unlink it under the others
+        try:
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+        except Exception:
+            pass
+        if self._shm.size < size:
+            raise ValueError(f'Shared block {name} is smaller than {size} bytes; it was created with another layout')
+
+        # Threads of one process share the file description, so flock alone
+        # does not exclude them
+        self._thread_lock = threading.Lock()
+        self._lock_file = open(os.path.join(tempfile.gettempdir(), f'{name}.lock'), 'a+b')
+
+    def __enter__(self):
+        import fcntl
+        self._thread_lock.acquire()
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        import fcntl
+        fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+        self._thread_lock.release()
+
+    def _find(self, hashed, now):
+        # Index of the key's slot, or of the slot to claim for it, and whether it is the key's
+        buf = self._shm.buf
+        start = hashed % self.slots
+        victim, victim_expiry = None, None
+        for probe in range(min(MAX_PROBES, self.slots)):
+            index = (start + probe) % self.slots
+            slot_key, expires_at = struct.unpack_from('<Qd', buf, index * self.record_size)
+            if slot_key == hashed:
+                return index, expires_at > now
+            if slot_key == 0 or expires_at <= now:
+                if victim_expiry is None or victim_expiry > 0:
+                    victim, victim_expiry = index, 0
+            elif victim_expiry is None or expires_at < victim_expiry:
+                victim, victim_expiry = index, expires_at
+        return victim, False
+
+    def update(self, key, now, fn, evict=True):
+        # fn(record or None) -> (new_record, expires_at, result); returns result
+        hashed = key_hash(key)
+        with self:
+            index, live = self._find(hashed, now)
+            offset = index * self.record_size
+            if not (live or evict):
+                slot_key, expires_at = struct.unpack_from('<Qd', self._shm.buf, offset)
+                if slot_key and expires_at > now:
+                    raise SlotTableFull(f'No free slot in {self.name}')
+            record = self._struct.unpack_from(self._shm.buf, offset)[2:] if live else None
+            new_record, expires_at, result = fn(record)
+            self._struct.pack_into(self._shm.buf, offset, hashed, expires_at, *new_record)
+        return result
+
+    def get(self, key, now):
+        hashed = key_hash(key)
+        with self:
+            index, live = self._find(hashed, now)
+            if not live:
+                return None
+            return self._struct.unpack_from(self._shm.buf, index * self.record_size)[2:]
+
+    def close(self):
+        self._shm.close()
+        self._lock_file.close()
+
+    def unlink(self):
+        # SharedMemory.unlink() unregisters from the resource tracker, which
+        # __init__ already did
+        try:
+            resource_tracker.register(self._shm._name, 'shared_memory')
+        except Exception:
+            pass
+        self._shm.unlink()
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import deque
+
+from shared_state import SharedSlotTable
+
+# Recent SOS triggers per user, for the "third trigger in five minutes"
+# escalation in trigger_sos. Each user keeps a ring of their last RING_SIZE
+# trigger times, so recording a trigger and counting the window touches at
+# most RING_SIZE entries no matter how much history sos_triggers holds.
+# Counts above RING_SIZE are reported as RING_SIZE.
+
+WINDOW_SECONDS = 5 * 60
+RING_SIZE = 16
+SHARED_SLOTS = 65536
+# The per-process counter forgets idle users once it tracks this many
+MAX_TRACKED_USERS = 100000
+
+
+class SlidingWindowCounter:
+    # Per-process counter: user_id -> deque of trigger times
+    def __init__(self, window=WINDOW_SECONDS, ring_size=RING_SIZE):
+        self.window = window
+        self.ring_size = ring_size
+        self._lock = threading.Lock()
+        self._rings = {}
+        self.created = True
+
+    def _prune(self, ring, now):
+        cutoff = now - self.window
+        while ring and ring[0] <= cutoff:
+            ring.popleft()
+
+    def hit(self, user_id, now=None):
+        # Records one trigger and returns the count inside the window
+        user_id = int(user_id)
+        now = now or time.time()
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if ring is None:
+                ring = self._rings[user_id] = deque(maxlen=self.ring_size)
+                if len(self._rings) > MAX_TRACKED_USERS:
+                    self._sweep(now)
+            self._prune(ring, now)
+            ring.append(now)
+            return len(ring)
+
+    def count(self, user_id, now=None):
+        user_id = int(user_id)
+        now = now or time.time()
+        with self._lock:
+            ring = self._rings.get(user_id)
+            if not ring:
+                return 0
+            self._prune(ring, now)
+            return len(ring)
+
+    def _sweep(self, now):
+        # Drops users with no trigger inside the window
+        cutoff = now - self.window
+        for user_id in [user_id for user_id, ring in self._rings.items() if not ring or ring[-1] <= cutoff]:
+            del self._rings[user_id]
+
+
+class SharedSlidingWindowCounter:
+    # Same ring per user, stored in a shared-memory slot table so every worker
+    # process escalates on the same count. Record: head index + ring of times.
+    def __init__(self, name, window=WINDOW_SECONDS, ring_size=RING_SIZE, slots=SHARED_SLOTS):
+        self.window = window
+        self.ring_size = ring_size
+        self._table = SharedSlotTable(name, slots, 'I4x' + 'd' * ring_size)
+        self.created = self._table.created
+
+    def _count(self, times, now):
+        cutoff = now - self.window
+        return sum(1 for t in times if t > cutoff)
+
+    def hit(self, user_id, now=None):
+        user_id = int(user_id)
+        now = now or time.time()
+
+        def record(current):
+            if current is None:
+                head, times = 0, [0.0] * self.ring_size
+            else:
+                head, times = current[0], list(current[1:])
+            times[head] = now
+            # Expires once its newest trigger leaves the window
+            return [(head + 1) % self.ring_size] + times, now + self.window, self._count(times, now)
+
+        return self._table.update(user_id, now, record)
+
+    def count(self, user_id, now=None):
+        user_id = int(user_id)
+        now = now or time.time()
+        current = self._table.get(user_id, now)
+        return self._count(current[1:], now) if current else 0
+
+
+def make_counter(shared_name=None):
+    if shared_name:
+        return SharedSlidingWindowCounter(f'{shared_name}-sos')
+    return SlidingWindowCounter()
+
+
+def load_from_db(conn, counter):
+    # Replays the triggers still inside the window, oldest first
+    rows = conn.execute('''
+        SELECT user_id, CAST(strftime('%s', timestamp) AS REAL) AS ts
+        FROM sos_triggers
+        WHERE timestamp > datetime('now', ?)
+        ORDER BY timestamp
+    ''', (f'-{int(counter.window)} seconds',)).fetchall()
+    for row in rows:
+        counter.hit(row['user_id'], row['ts'])
+    return len(rows)
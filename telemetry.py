@@ -0,0 +1,198 @@
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from geodistance import haversine_km
+
+# Continuous emergency monitoring for active rides. Rider and vehicle pings are
+# queued by the request threads and evaluated by one consumer thread against
+# the rider's monitoring rules (emergency_rules.RuleCache), which only fire on
+# a speed or distance anomaly. Per-ride state is a fixed handful of fields,
+# and the number of tracked rides is capped.
+
+MAX_RIDES = 50000
+QUEUE_SIZE = 100000
+# A ride with no pings for this long is forgotten
+RIDE_IDLE_SECONDS = 15 * 60
+# Consecutive matching pings needed before alerting, to ride out GPS noise
+CONFIRM_EVENTS = 2
+# At most one automatic alert per ride in this window
+ALERT_COOLDOWN_SECONDS = 10 * 60
+
+
+class RideState:
+    __slots__ = ('ride_id', 'user_id', 'vehicle_id', 'last_seen', 'latitude', 'longitude',
+                 'timestamp', 'streak', 'last_alert_at')
+
+    def __init__(self, ride_id, user_id, vehicle_id):
+        self.ride_id = ride_id
+        self.user_id = user_id
+        self.vehicle_id = vehicle_id
+        self.last_seen = time.monotonic()
+        self.latitude = None
+        self.longitude = None
+        self.timestamp = None
+        self.streak = 0
+        self.last_alert_at = None
+
+
+class TelemetryMonitor:
+    def __init__(self, rules, on_alert, max_rides=MAX_RIDES, queue_size=QUEUE_SIZE,
+                 idle_seconds=RIDE_IDLE_SECONDS, confirm_events=CONFIRM_EVENTS,
+                 alert_cooldown=ALERT_COOLDOWN_SECONDS):
+        # rules.get(user_id) returns CompiledRules or None;
+        # on_alert(ride, rules, latitude, longitude, speed) raises the alert
+        self.rules = rules
+        self.on_alert = on_alert
+        self.max_rides = max_rides
+        self.idle_seconds = idle_seconds
+        self.confirm_events = confirm_events
+        self.alert_cooldown = alert_cooldown
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._rides = OrderedDict()  # ride_id -> RideState, least recently seen first
+        self._ride_by_vehicle = {}
+        self._thread = None
+        self._stopped = threading.Event()
+
+        # Metrics
+        self.processed = 0
+        self.dropped = 0
+        self.alerts = 0
+        self.evicted = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='telemetry-monitor', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def start_ride(self, ride_id, user_id, vehicle_id=None):
+        with self._lock:
+            state = self._rides.get(ride_id)
+            if state is None:
+                state = self._rides[ride_id] = RideState(ride_id, user_id, vehicle_id)
+                self._evict_over_capacity()
+            if vehicle_id is not None:
+                state.vehicle_id = vehicle_id
+                self._ride_by_vehicle[vehicle_id] = ride_id
+        self.start()
+
+    def end_ride(self, ride_id):
+        with self._lock:
+            self._forget(ride_id)
+
+    def has_ride(self, ride_id):
+        with self._lock:
+            return ride_id in self._rides
+
+    def submit(self, ride_id, latitude, longitude, speed=None, timestamp=None):
+        # Queues one rider ping; returns False if the queue is full
+        try:
+            self._queue.put_nowait((ride_id, latitude, longitude, speed, timestamp or time.time()))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def submit_vehicle(self, vehicle_id, latitude, longitude, timestamp=None):
+        # Vehicle pings count as ride telemetry while the vehicle is on a tracked ride
+        ride_id = self._ride_by_vehicle.get(vehicle_id)
+        if ride_id is None:
+            return False
+        return self.submit(ride_id, latitude, longitude, None, timestamp)
+
+    def _forget(self, ride_id):
+        state = self._rides.pop(ride_id, None)
+        if state is not None and self._ride_by_vehicle.get(state.vehicle_id) == ride_id:
+            del self._ride_by_vehicle[state.vehicle_id]
+
+    def _evict_over_capacity(self):
+        while len(self._rides) > self.max_rides:
+            self._forget(next(iter(self._rides)))
+            self.evicted += 1
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            while self._rides:
+                ride_id, state = next(iter(self._rides.items()))
+                if state.last_seen >= cutoff:
+                    break
+                self._forget(ride_id)
+                self.evicted += 1
+
+    def _run(self):
+        next_sweep = time.monotonic() + 60
+        while not self._stopped.is_set():
+            try:
+                event = self._queue.get(timeout=1.0)
+            except queue.Empty:
+                event = None
+            if event is not None:
+                try:
+                    self.process(*event)
+                except Exception as e:
+                    print(f"Telemetry error: {str(e)}")  # Debug log
+            if time.monotonic() >= next_sweep:
+                self._evict_idle()
+                next_sweep = time.monotonic() + 60
+
+    def process(self, ride_id, latitude, longitude, speed, timestamp):
+        with self._lock:
+            state = self._rides.get(ride_id)
+            if state is None:
+                return False
+            state.last_seen = time.monotonic()
+            self._rides.move_to_end(ride_id)
+        self.processed += 1
+
+        if state.timestamp is not None and timestamp <= state.timestamp:
+            # Late or duplicate ping: the ride has already moved past it
+            return False
+        if speed is None and state.timestamp is not None:
+            # Vehicle pings carry no speed; derive km/h from the previous point
+            speed = haversine_km(state.latitude, state.longitude, latitude, longitude) * 3600.0 / (timestamp - state.timestamp)
+        state.latitude, state.longitude, state.timestamp = latitude, longitude, timestamp
+
+        rules = self.rules.get(state.user_id)
+        if rules is None:
+            state.streak = 0
+            return False
+        local = time.localtime(timestamp)
+        if not rules.evaluate_monitor(latitude, longitude, speed or 0.0, local.tm_hour * 60 + local.tm_min):
+            state.streak = 0
+            return False
+
+        state.streak += 1
+        if state.streak < self.confirm_events:
+            return False
+        if state.last_alert_at is not None and timestamp - state.last_alert_at < self.alert_cooldown:
+            return False
+        state.last_alert_at = timestamp
+        self.alerts += 1
+        try:
+            self.on_alert(state, rules, latitude, longitude, speed or 0.0)
+        except Exception as e:
+            print(f"Error raising telemetry alert for ride {ride_id}: {str(e)}")  # Debug log
+        return True
+
+    def stats(self):
+        with self._lock:
+            rides = len(self._rides)
+        return {
+            'rides': rides,
+            'queued': self._queue.qsize(),
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'alerts': self.alerts,
+            'evicted': self.evicted
+        }
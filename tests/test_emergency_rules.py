@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from emergency_rules import TimeRule, compile_legacy, compile_rule
+
+# Compiled emergency-condition predicates, evaluated at fixed minutes of the day.
+
+HOME = (12.9716, 77.5946)
+
+
+def minute(text):
+    hours, minutes = text.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+@pytest.mark.parametrize('at, within', [
+    ('21:59', False), ('22:00', True), ('23:30', True), ('00:00', True),
+    ('03:15', True), ('06:00', True), ('06:01', False), ('12:00', False),
+])
+def test_time_window_wrapping_midnight(at, within):
+    inside = TimeRule('inside', '22:00', '06:00')
+    outside = TimeRule('outside', '22:00', '06:00')
+
+    assert inside.evaluate(None, None, 0, minute(at)) is within
+    assert outside.evaluate(None, None, 0, minute(at)) is not within
+
+
+@pytest.mark.parametrize('at, within', [('08:59', False), ('09:00', True), ('13:00', True), ('17:00', True), ('17:01', False)])
+def test_time_window_within_a_day(at, within):
+    assert TimeRule('inside', '09:00', '17:00').evaluate(None, None, 0, minute(at)) is within
+
+
+def test_composite_rule_needs_every_part():
+    rule = compile_rule({'all': [
+        {'time': {'condition': 'inside', 'start': '22:00', 'end': '06:00'}},
+        {'any': [
+            {'speed': {'condition': 'above', 'threshold': 100}},
+            {'distance': {'condition': 'away', 'threshold': 5}},
+        ]},
+    ]}, HOME)
+
+    assert not rule.evaluate(HOME[0], HOME[1], 40, minute('23:00'))
+    assert rule.evaluate(HOME[0], HOME[1], 130, minute('23:00'))
+    assert rule.evaluate(HOME[0] + 0.1, HOME[1], 40, minute('01:00'))
+    assert not rule.evaluate(HOME[0] + 0.1, HOME[1], 130, minute('12:00'))
+
+
+def test_legacy_defaults_at_night_near_home():
+    # The defaults init_emergency_conditions writes for every new user
+    conditions = {
+        'location_condition': 'away', 'distance_threshold': 10,
+        'time_condition': 'outside', 'time_start': '22:00', 'time_end': '06:00',
+        'speed_condition': 'above', 'speed_threshold': 120,
+    }
+    rule = compile_legacy(conditions, HOME)
+
+    assert not rule.evaluate(HOME[0], HOME[1], 30, minute('23:00'))
+    assert rule.evaluate(HOME[0], HOME[1], 150, minute('23:00'))
+
+
+@pytest.mark.parametrize('definition', [
+    {'time': {'condition': 'during', 'start': '22:00', 'end': '06:00'}},
+    {'time': {'condition': 'inside', 'start': '25:00', 'end': '06:00'}},
+    {'distance': {'condition': 'away', 'threshold': 5}, 'speed': {'condition': 'above', 'threshold': 1}},
+    {'all': []},
+])
+def test_invalid_rules_are_rejected(definition):
+    with pytest.raises(ValueError):
+        compile_rule(definition, HOME)
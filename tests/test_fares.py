@@ -0,0 +1,39 @@
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dispatch import DispatchIndex
+from fares import DEMAND_WINDOW_SECONDS, FareEngine
+
+# Per-zone booking demand behind surge pricing, with an empty dispatch index.
+
+NOW = 1700000000.0
+ZONE_DEGREES = 1.0
+
+
+def engine():
+    return FareEngine(DispatchIndex(loader=lambda index: None))
+
+
+def test_demand_counts_bookings_inside_the_window():
+    fares = engine()
+    fares.record_demand((12.97, 77.59), NOW - DEMAND_WINDOW_SECONDS)
+    fares.record_demand((12.97, 77.59), NOW - 60)
+    fares.record_demand((12.97, 77.59), NOW)
+
+    assert fares.demand((12.97, 77.59), NOW) == 2
+
+
+def test_quiet_zones_are_dropped():
+    fares = engine()
+    # One booking each in many zones, then a window of nothing
+    for i in range(500):
+        fares.record_demand((i * ZONE_DEGREES, 77.59), NOW + i)
+    assert fares.stats()['demand_zones'] == 500
+
+    fares.record_demand((12.97, 77.59), NOW + 500 + DEMAND_WINDOW_SECONDS)
+
+    assert fares.stats()['demand_zones'] == 1
+    assert fares.demand((12.97, 77.59), NOW + 500 + DEMAND_WINDOW_SECONDS) == 1
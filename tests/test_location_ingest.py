@@ -0,0 +1,96 @@
+import os
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from db_pool import ConnectionPool
+from location_ingest import MAX_CLOCK_SKEW_SECONDS, LocationIngestBuffer, parse_ping
+from migrations import migrate
+
+# Ping parsing and the batched writes behind /update_location, against a
+# real migrated database. Buffers are flushed by hand, never started.
+
+NOW = 1700000000
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'locations.db'), max_size=2)
+    conn = pool.acquire()
+    migrate(conn)
+    conn.close()
+    yield pool
+    pool.close_all()
+
+
+def latest(pool, vehicle_id):
+    conn = pool.acquire()
+    try:
+        return tuple(conn.execute(
+            'SELECT latitude, longitude, timestamp FROM vehicle_latest_location WHERE vehicle_id = ?', (vehicle_id,)
+        ).fetchone())
+    finally:
+        conn.close()
+
+
+def test_ping_without_timestamp_gets_server_time():
+    assert parse_ping({'vehicle_id': '7', 'latitude': '12.5', 'longitude': 77}, NOW) == (7, 12.5, 77.0, NOW)
+
+
+def test_ping_keeps_device_time_within_skew():
+    ping = {'vehicle_id': 7, 'latitude': 12.5, 'longitude': 77, 'timestamp': NOW + MAX_CLOCK_SKEW_SECONDS}
+    assert parse_ping(ping, NOW)[3] == NOW + MAX_CLOCK_SKEW_SECONDS
+    assert parse_ping(dict(ping, timestamp=NOW - 3600), NOW)[3] == NOW - 3600
+
+
+@pytest.mark.parametrize('timestamp', [NOW * 1000, NOW + MAX_CLOCK_SKEW_SECONDS + 1, 'soon'])
+def test_ping_rejects_bad_timestamps(timestamp):
+    with pytest.raises(ValueError):
+        parse_ping({'vehicle_id': 7, 'latitude': 12.5, 'longitude': 77, 'timestamp': timestamp}, NOW)
+
+
+@pytest.mark.parametrize('ping', [{'vehicle_id': 7, 'latitude': 12.5}, {'vehicle_id': 7, 'latitude': 91, 'longitude': 0}])
+def test_ping_rejects_bad_positions(ping):
+    with pytest.raises(ValueError):
+        parse_ping(ping, NOW)
+
+
+def test_latest_position_ignores_older_pings(pool):
+    buffer = LocationIngestBuffer(pool)
+    now = int(time.time())
+    buffer.submit([(1, 10.0, 20.0, now), (1, 11.0, 21.0, now - 5)])
+    buffer.flush()
+    buffer.submit([(1, 12.0, 22.0, now - 10)])
+    buffer.flush()
+
+    assert latest(pool, 1) == (10.0, 20.0, now)
+
+
+def test_position_pinned_in_the_future_is_replaced(pool):
+    # A millisecond timestamp stored before pings were checked
+    conn = pool.acquire()
+    conn.execute('INSERT INTO vehicle_latest_location (vehicle_id, latitude, longitude, timestamp) VALUES (1, 0, 0, ?)',
+                 (NOW * 1000,))
+    conn.commit()
+    conn.close()
+
+    buffer = LocationIngestBuffer(pool)
+    now = int(time.time())
+    buffer.submit([(1, 10.0, 20.0, now)])
+    buffer.flush()
+
+    assert latest(pool, 1) == (10.0, 20.0, now)
+
+
+def test_pending_pings_are_capped_oldest_first(pool):
+    buffer = LocationIngestBuffer(pool, max_pending=3)
+    buffer.submit([(1, 0.0, 0.0, t) for t in range(5)])
+
+    assert buffer.stats()['pending'] == 3
+    assert buffer.stats()['dropped'] == 2
+    assert buffer.flush() == 3
+    assert latest(pool, 1)[2] == 4
@@ -0,0 +1,158 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from db_pool import ConnectionPool
+from migrations import migrate
+from notifications import SENDING_LEASE_SECONDS, NotificationDispatcher
+
+# The outbox against a real migrated database and a local stand-in for the
+# SMS gateway. Backoffs and poll intervals are scaled down so the real poller
+# runs the retries within a test.
+
+BACKOFF = 0.05
+POLL = 0.02
+CONTACTS = [{'name': 'Asha', 'phone': '+15550001'}]
+
+
+class StandInGateway:
+    # Answers from a script of results: True/False, or an exception to raise.
+    # Once the script runs out the last answer repeats.
+    def __init__(self, *script):
+        self.script = list(script)
+        self.calls = []
+
+    def __call__(self, phone, message):
+        self.calls.append((time.monotonic(), phone, message))
+        result = self.script[min(len(self.calls), len(self.script)) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'outbox.db'), max_size=4)
+    conn = pool.acquire()
+    migrate(conn)
+    conn.close()
+    yield pool
+    pool.close_all()
+
+
+@pytest.fixture
+def make_dispatcher(pool):
+    dispatchers = []
+
+    def make(gateway, **options):
+        options.setdefault('base_backoff', BACKOFF)
+        options.setdefault('poll_interval', POLL)
+        dispatcher = NotificationDispatcher(pool, gateway, workers=2, **options)
+        dispatchers.append(dispatcher)
+        return dispatcher
+
+    yield make
+    for dispatcher in dispatchers:
+        dispatcher.stop()
+
+
+def wait_for_status(pool, dispatch_id, status, attempts=None, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        conn = pool.acquire()
+        try:
+            rows = conn.execute(
+                'SELECT * FROM notification_outbox WHERE dispatch_id = ?', (dispatch_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+        if rows and all(row['status'] == status and attempts in (None, row['attempts']) for row in rows):
+            return rows
+        time.sleep(POLL)
+    pytest.fail(f'dispatch {dispatch_id} never reached {status}')
+
+
+def test_retries_with_backoff_until_sent(pool, make_dispatcher):
+    gateway = StandInGateway(False, ConnectionError('gateway down'), True)
+    dispatcher = make_dispatcher(gateway)
+
+    dispatch_id = dispatcher.enqueue(1, 'SOS', CONTACTS)
+    row, = wait_for_status(pool, dispatch_id, 'sent')
+
+    assert row['attempts'] == 3
+    assert len(gateway.calls) == 3
+    assert dispatcher.stats()['retried'] == 2
+    assert dispatcher.stats()['sent'] == 1
+    # Second retry waits about twice as long as the first (jitter is +-20%)
+    gaps = [later[0] - earlier[0] for earlier, later in zip(gateway.calls, gateway.calls[1:])]
+    assert gaps[0] >= BACKOFF * 0.8
+    assert gaps[1] >= BACKOFF * 2 * 0.8
+
+
+def test_pending_retry_holds_no_thread(pool, make_dispatcher):
+    # A retry due in a minute is left to the poller, not to a timer thread
+    gateway = StandInGateway(False)
+    dispatcher = make_dispatcher(gateway, base_backoff=60.0)
+
+    dispatch_id = dispatcher.enqueue(1, 'SOS', CONTACTS)
+    row, = wait_for_status(pool, dispatch_id, 'pending', attempts=1)
+
+    assert row['next_attempt_at'] - row['updated_at'] >= 60.0 * 0.8
+    assert not any(isinstance(thread, threading.Timer) for thread in threading.enumerate())
+
+
+def test_gives_up_after_max_attempts(pool, make_dispatcher):
+    gateway = StandInGateway(ConnectionError('gateway down'))
+    dispatcher = make_dispatcher(gateway, max_attempts=3)
+
+    dispatch_id = dispatcher.enqueue(1, 'SOS', CONTACTS)
+    row, = wait_for_status(pool, dispatch_id, 'failed')
+
+    assert row['attempts'] == 3
+    assert row['last_error'] == 'gateway down'
+    assert len(gateway.calls) == 3
+    assert dispatcher.stats()['failed'] == 1
+    # Nothing is retried once the row has failed
+    time.sleep(BACKOFF * 4)
+    assert len(gateway.calls) == 3
+
+
+def test_recovers_rows_whose_lease_expired(pool, make_dispatcher):
+    # Two rows left in 'sending': one by a worker that died long ago, one
+    # still within its lease
+    now = time.time()
+    conn = pool.acquire()
+    dispatch_id = conn.execute(
+        'INSERT INTO sos_dispatches (user_id, message, created_at) VALUES (1, ?, ?)', ('SOS', now)
+    ).lastrowid
+    conn.executemany('''
+        INSERT INTO notification_outbox (
+            dispatch_id, channel, recipient, message, status, attempts,
+            next_attempt_at, created_at, updated_at
+        ) VALUES (?, 'sms', ?, 'SOS', 'sending', 1, ?, ?, ?)
+    ''', [
+        (dispatch_id, '+15550001', now, now, now - SENDING_LEASE_SECONDS - 1),
+        (dispatch_id, '+15550002', now, now, now),
+    ])
+    conn.commit()
+    conn.close()
+
+    gateway = StandInGateway(True)
+    dispatcher = make_dispatcher(gateway)
+    dispatcher.start()
+    deadline = time.monotonic() + 5.0
+    while not gateway.calls and time.monotonic() < deadline:
+        time.sleep(POLL)
+    time.sleep(POLL * 5)
+
+    rows = {row['recipient']: row for row in dispatcher.status(dispatch_id)['deliveries']}
+    assert rows['+15550001']['status'] == 'sent'
+    assert rows['+15550001']['attempts'] == 2
+    assert rows['+15550002']['status'] == 'sending'
+    assert [call[1] for call in gateway.calls] == ['+15550001']
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import otp_store
+from db_pool import ConnectionPool
+from migrations import migrate
+from otp_store import MAX_VERIFY_ATTEMPTS, OtpStore
+
+# One-time codes against a real migrated database. Separate OtpStore
+# instances stand in for separate worker processes sharing that database.
+
+USER_ID = 1
+
+
+@pytest.fixture
+def conn(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'otps.db'), max_size=1)
+    conn = pool.acquire()
+    migrate(conn)
+    yield conn
+    conn.close()
+    pool.close_all()
+
+
+def wrong(code):
+    return str((int(code) + 1) % 10 ** len(code)).zfill(len(code))
+
+
+def test_code_is_accepted_once(conn):
+    store = OtpStore()
+    code = store.issue(conn, USER_ID)
+
+    assert store.verify(conn, USER_ID, code) is None
+    assert store.verify(conn, USER_ID, code) == 'OTP already used'
+    assert store.stats()['verified'] == 1
+
+
+def test_new_code_replaces_the_old_one(conn):
+    store = OtpStore()
+    old = store.issue(conn, USER_ID)
+    new = store.issue(conn, USER_ID)
+
+    if old != new:
+        assert store.verify(conn, USER_ID, old) == 'Invalid OTP'
+    assert store.verify(conn, USER_ID, new) is None
+    assert conn.execute('SELECT COUNT(*) FROM otps WHERE used = 0').fetchone()[0] == 0
+
+
+def test_code_is_burned_after_too_many_wrong_guesses(conn):
+    store = OtpStore()
+    code = store.issue(conn, USER_ID)
+
+    for _ in range(MAX_VERIFY_ATTEMPTS - 1):
+        assert store.verify(conn, USER_ID, wrong(code)) == 'Invalid OTP'
+    assert store.verify(conn, USER_ID, wrong(code)).startswith('Too many invalid attempts')
+    assert store.verify(conn, USER_ID, code) == 'OTP already used'
+    assert store.stats()['burned'] == 1
+
+
+def test_expired_code_is_rejected(conn, monkeypatch):
+    store = OtpStore()
+    code = store.issue(conn, USER_ID)
+    later = time.time() + store.ttl + 1
+    monkeypatch.setattr(otp_store.time, 'time', lambda: later)
+
+    assert store.verify(conn, USER_ID, code) == 'OTP expired'
+    assert OtpStore().verify(conn, USER_ID, code) == 'OTP expired'
+
+
+def test_code_issued_by_another_worker_is_read_from_the_database(conn):
+    issuer, verifier = OtpStore(), OtpStore()
+    code = issuer.issue(conn, USER_ID)
+
+    assert verifier.verify(conn, USER_ID, code) is None
+    assert verifier.stats()['db_fallbacks'] == 1
+    assert issuer.verify(conn, USER_ID, code) == 'OTP already used'
+
+
+def test_newer_code_from_another_worker_replaces_the_cached_one(conn):
+    issuer, verifier = OtpStore(), OtpStore()
+    first = issuer.issue(conn, USER_ID)
+    assert verifier.verify(conn, USER_ID, wrong(first)) == 'Invalid OTP'
+
+    second = issuer.issue(conn, USER_ID)
+
+    assert verifier.verify(conn, USER_ID, second) is None
@@ -0,0 +1,95 @@
+import hashlib
+import os
+import sys
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import passwords
+from db_pool import ConnectionPool, bind_to_app
+from passwords import HasherBusy, PasswordHasher
+
+# scrypt hashing on the bounded pool, with tiny cost parameters so each hash
+# takes microseconds. Saturation is simulated by blocking the workers.
+
+
+@pytest.fixture
+def hasher():
+    hasher = PasswordHasher(n=2 ** 4, r=1, p=1, workers=1, queue_limit=1)
+    yield hasher
+    hasher._executor.shutdown(wait=False)
+
+
+def block_workers(hasher):
+    # Every hash waits on the returned event
+    release = threading.Event()
+    scrypt = hasher._scrypt
+    hasher._scrypt = lambda *args: release.wait() and scrypt(*args)
+    return release
+
+
+def test_hash_round_trip(hasher):
+    stored = hasher.hash('Secret123')
+
+    assert stored.startswith('scrypt$16$1$1$')
+    assert hasher.verify('Secret123', stored) == (True, None)
+    assert hasher.verify('Secret124', stored) == (False, None)
+
+
+def test_legacy_hash_is_upgraded(hasher):
+    matches, new_hash = hasher.verify('Secret123', hashlib.sha256(b'Secret123').hexdigest())
+
+    assert matches
+    assert not hasher.needs_rehash(new_hash)
+    assert hasher.verify('Secret123', new_hash) == (True, None)
+
+
+def test_full_queue_is_rejected(hasher):
+    release = block_workers(hasher)
+    waiting = [threading.Thread(target=hasher.hash, args=('Secret123',)) for _ in range(2)]
+    for thread in waiting:
+        thread.start()
+    while hasher.stats()['running'] + hasher.stats()['queue_depth'] < 2:
+        time.sleep(0.001)
+    try:
+        with pytest.raises(HasherBusy):
+            hasher.hash('Secret123')
+        assert hasher.stats()['rejected'] == 1
+    finally:
+        release.set()
+        for thread in waiting:
+            thread.join()
+
+
+def test_slow_hash_times_out_as_busy(hasher, monkeypatch):
+    monkeypatch.setattr(passwords, 'HASH_TIMEOUT_SECONDS', 0.05)
+    release = block_workers(hasher)
+    try:
+        with pytest.raises(HasherBusy):
+            hasher.hash('Secret123')
+        assert hasher.stats()['timeouts'] == 1
+    finally:
+        release.set()
+
+
+def test_request_connection_can_be_released_before_hashing(tmp_path, hasher):
+    pool = ConnectionPool(str(tmp_path / 'users.db'), max_size=1, timeout=0.1)
+    app = Flask(__name__)
+    get_db_connection = bind_to_app(app, pool)
+
+    with app.app_context():
+        get_db_connection().execute('SELECT 1')
+        get_db_connection.release()
+        # Another request can borrow the only connection meanwhile
+        other = pool.acquire()
+        hasher.hash('Secret123')
+        other.close()
+        get_db_connection().execute('SELECT 1')
+        assert pool.stats()['in_use'] == 1
+    assert pool.stats()['in_use'] == 0
+    pool.close_all()
@@ -0,0 +1,199 @@
+import ast
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from migrations import migrate
+from location_ingest import UPSERT_LATEST_SQL
+from retention import _ensure_partition
+
+# Runs EXPLAIN QUERY PLAN on every SQL statement in the app's modules against
+# the fully migrated schema. A statement fails if it cannot be prepared or if
+# it scans a table outside ALLOWED_SCANS. Statements built with f-strings
+# cannot be planned from source, so each template is rendered by hand in
+# RENDERED; a template without a rendering fails too.
+#
+#   python -m pytest tests/test_query_plans.py
+
+# Modules that run queries at request time or in background workers
+MODULES = [
+    'app.py',
+    'dispatch.py',
+    'emergency_rules.py',
+    'location_ingest.py',
+    'notifications.py',
+    'otp_store.py',
+    'rental_calendar.py',
+    'retention.py',
+    'sos_counter.py',
+    'vehicle_catalog.py',
+]
+# Modules that only build the schema
+SCHEMA_MODULES = ['db_indexes.py', 'db_pool.py', 'init_db.py', 'migrations.py']
+
+STATEMENT_START = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+
+# Statements that read a whole table on purpose, by leading text
+ALLOWED_SCANS = [
+    # Admin and test pages
+    'SELECT COUNT(*) FROM users',
+    'SELECT COUNT(*) FROM vehicles',
+    'SELECT COUNT(*) FROM bookings',
+    'SELECT name, email, phone FROM users ORDER BY name',
+    'SELECT * FROM vehicles WHERE 1=1',
+    # Schema lookups
+    "SELECT name FROM sqlite_master WHERE type='table'",
+    "SELECT name FROM sqlite_master WHERE type = 'table'",
+    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+    # One row per vehicle by design
+    'SELECT v.id as vehicle_id, v.driver_name, v.car_model, v.car_number, l.latitude, l.longitude, l.timestamp FROM vehicle_latest_location l',
+    # Dispatch index loads every vehicle once at startup
+    'SELECT id, car_type, status, driver_gender, customer_gender_preference, is_rental FROM vehicles',
+    'SELECT vehicle_id, latitude, longitude, timestamp FROM vehicle_latest_location',
+    # OTP purge walks otps in id order; the filter still reads every live row
+    'DELETE FROM otps WHERE id IN ( SELECT id FROM otps WHERE expires_at < ? ORDER BY id LIMIT ? )',
+]
+
+# Statements that do not match the schema, by leading text; these have been
+# broken since before the migrations and fail if they start to prepare
+KNOWN_BROKEN = {
+    'INSERT INTO vehicles (name, type, category, subcategory, available)':
+        'add_vehicle writes columns the vehicles table never had',
+    'INSERT INTO sos_triggers (user_id, vehicle_id, trigger_count':
+        'premium_sos writes a vehicle_id column sos_triggers does not have',
+}
+
+# Renderings of every f-string statement, keyed by module and template. The
+# retention partitions are created by the schema fixture.
+ACTIVE_STATUSES = "'pending', 'confirmed', 'active'"
+RIDE_MATCH = 'v.car_type = ? AND v.is_rental = 0'
+RIDER_MATCH = (
+    RIDE_MATCH + " AND (v.customer_gender_preference IS NULL OR v.customer_gender_preference = ? "
+    "OR v.customer_gender_preference = 'any') AND v.driver_gender = ?"
+)
+CLAIM_VEHICLE = '''
+    UPDATE vehicles SET status = ?
+    WHERE id = (SELECT v.id FROM vehicles v WHERE v.status = 'available' AND {} LIMIT 1)
+    AND status = 'available'
+    RETURNING *
+'''
+BOOKINGS_PAGE = 'SELECT {} FROM bookings b{} WHERE b.user_id = ?{} ORDER BY b.created_at DESC, b.id DESC LIMIT ?'
+RENDERED = {
+    ('app.py', "UPDATE vehicles SET status = ? WHERE id = ( SELECT v.id FROM vehicles v WHERE v.status = 'available' AND {where} LIMIT 1 ) AND status = 'available' RETURNING *"): [
+        CLAIM_VEHICLE.format(RIDE_MATCH),
+        CLAIM_VEHICLE.format(RIDE_MATCH + ' AND v.id = ?'),
+        CLAIM_VEHICLE.format(RIDER_MATCH),
+        CLAIM_VEHICLE.format(RIDER_MATCH + ' AND v.id = ?'),
+    ],
+    ('app.py', "SELECT {', '.join(columns + ['b.created_at', 'b.id'])} FROM bookings b"): [
+        BOOKINGS_PAGE.format('b.id, b.status, b.created_at, b.id', '', ''),
+        BOOKINGS_PAGE.format('b.id, b.status, b.created_at, b.id', '', ' AND (b.created_at, b.id) < (?, ?)'),
+        BOOKINGS_PAGE.format('b.id, v.car_model, b.created_at, b.id', ' LEFT JOIN vehicles v ON b.vehicle_id = v.id', ''),
+        BOOKINGS_PAGE.format('b.id, v.car_model, b.created_at, b.id', ' LEFT JOIN vehicles v ON b.vehicle_id = v.id',
+                             ' AND (b.created_at, b.id) < (?, ?)'),
+    ],
+    ('app.py', "SELECT id FROM rentals WHERE vehicle_id = ? AND start_date < ? AND end_date > ? AND status IN ({', '.join(('?' for _ in ACTIVE_RENTAL_STATUSES))}) LIMIT 1"): [
+        f'SELECT id FROM rentals WHERE vehicle_id = ? AND start_date < ? AND end_date > ? AND status IN ({ACTIVE_STATUSES}) LIMIT 1',
+    ],
+    ('location_ingest.py', "INSERT INTO vehicle_latest_location (vehicle_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?) ON CONFLICT(vehicle_id) DO UPDATE SET latitude = excluded.latitude, longitude = excluded.longitude, timestamp = excluded.timestamp WHERE excluded.timestamp >= vehicle_latest_location.timestamp OR vehicle_latest_location.timestamp > CAST(strftime('%s', 'now') AS INTEGER) + {MAX_CLOCK_SKEW_SECONDS}"): [
+        UPSERT_LATEST_SQL,
+    ],
+    ('rental_calendar.py', 'SELECT id, vehicle_id, start_date, end_date FROM rentals WHERE id > ? AND id <= ? AND status IN ({placeholders}) AND end_date >= ?'): [
+        f'SELECT id, vehicle_id, start_date, end_date FROM rentals WHERE id > ? AND id <= ? AND status IN ({ACTIVE_STATUSES}) AND end_date >= ?',
+    ],
+    ('retention.py', 'INSERT INTO {table} (id, vehicle_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?, ?)'): [
+        'INSERT INTO vehicle_locations_archive_20240101 (id, vehicle_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?, ?)',
+    ],
+    ('retention.py', 'INSERT INTO {table} SELECT * FROM sos_triggers WHERE id = ?'): [
+        'INSERT INTO sos_triggers_archive_20240101 SELECT * FROM sos_triggers WHERE id = ?',
+    ],
+}
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+def template(node):
+    # f-string source with each expression kept as {expr}
+    parts = []
+    for value in node.values:
+        if isinstance(value, ast.Constant):
+            parts.append(value.value)
+        else:
+            parts.append('{' + ast.unparse(value.value) + '}')
+    return normalize(''.join(parts))
+
+
+def statements(module):
+    # (lineno, sql, is_template) for every SQL statement in module
+    with open(os.path.join(REPO_DIR, module)) as f:
+        tree = ast.parse(f.read(), module)
+    fragments = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.JoinedStr):
+            fragments.update(id(value) for value in node.values)
+            text = template(node)
+            if STATEMENT_START.match(text):
+                yield node.lineno, text, True
+        elif isinstance(node, ast.Constant) and isinstance(node.value, str) and id(node) not in fragments:
+            if STATEMENT_START.match(node.value):
+                yield node.lineno, normalize(node.value), False
+
+
+def planned_statements():
+    cases = []
+    for module in MODULES:
+        for lineno, sql, is_template in statements(module):
+            renderings = RENDERED.get((module, sql), []) if is_template else [sql]
+            for index, rendered in enumerate(renderings):
+                marks = [
+                    pytest.mark.xfail(strict=True, raises=sqlite3.OperationalError, reason=reason)
+                    for prefix, reason in KNOWN_BROKEN.items() if sql.startswith(prefix)
+                ]
+                suffix = f'-{index}' if is_template else ''
+                cases.append(pytest.param(normalize(rendered), marks=marks, id=f'{module}:{lineno}{suffix}'))
+    return cases
+
+
+@pytest.fixture(scope='module')
+def schema():
+    # The schema the app runs against: every migration, including the index set
+    conn = sqlite3.connect(':memory:')
+    migrate(conn)
+    _ensure_partition(conn, 'vehicle_locations', '20240101')
+    _ensure_partition(conn, 'sos_triggers', '20240101')
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('sql', planned_statements())
+def test_statement_uses_indexes(schema, sql):
+    # Raises for statements that do not prepare against the schema
+    plan = schema.execute('EXPLAIN QUERY PLAN ' + sql, [None] * sql.count('?')).fetchall()
+    if any(sql.startswith(allowed) for allowed in ALLOWED_SCANS):
+        return
+    scans = [row[-1] for row in plan if row[-1].startswith('SCAN') and 'CONSTANT ROW' not in row[-1]]
+    assert not scans, f'{sql[:160]}: {", ".join(scans)}'
+
+
+def test_every_template_is_rendered():
+    templates = {(module, sql) for module in MODULES for _, sql, is_template in statements(module) if is_template}
+    assert templates - set(RENDERED) == set(), 'f-string statements without a rendering in RENDERED'
+    assert set(RENDERED) - templates == set(), 'RENDERED entries whose template no longer exists'
+
+
+def test_every_query_module_is_checked():
+    querying = set()
+    for name in os.listdir(REPO_DIR):
+        if name.endswith('.py'):
+            with open(os.path.join(REPO_DIR, name)) as f:
+                if re.search(r'\.execute(many)?\(', f.read()):
+                    querying.add(name)
+    assert querying - set(MODULES) - set(SCHEMA_MODULES) == set()
@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from db_pool import ConnectionPool
+from migrations import migrate
+from retention import LOCATION_HOT_DAYS, RetentionWorker
+
+# History retention against a real migrated database. Batches are run by
+# hand; the worker thread is never started.
+
+NOW = 1700000000.0
+OLD = int(NOW - (LOCATION_HOT_DAYS + 1) * 86400)
+FRESH = int(NOW - 60)
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'history.db'), max_size=3)
+    conn = pool.acquire()
+    migrate(conn)
+    conn.close()
+    yield pool
+    pool.close_all()
+
+
+def add_pings(pool, pings):
+    conn = pool.acquire()
+    conn.executemany('INSERT INTO vehicle_locations (vehicle_id, latitude, longitude, timestamp) VALUES (?, ?, ?, ?)',
+                     pings)
+    conn.commit()
+    conn.close()
+
+
+def hot_timestamps(pool):
+    conn = pool.acquire()
+    try:
+        return sorted(row[0] for row in conn.execute('SELECT timestamp FROM vehicle_locations'))
+    finally:
+        conn.close()
+
+
+def test_archives_only_old_pings(pool):
+    # Old pings arrive out of id order, as backfilled device history would
+    add_pings(pool, [(1, 12.0, 77.0, FRESH), (1, 12.0, 77.0, OLD), (1, 12.001, 77.0, OLD + 1), (2, 13.0, 78.0, FRESH)])
+    worker = RetentionWorker(pool)
+
+    assert worker.archive_locations_batch(int(NOW - LOCATION_HOT_DAYS * 86400)) == 2
+    assert hot_timestamps(pool) == [FRESH, FRESH]
+    assert worker.archive_locations_batch(int(NOW - LOCATION_HOT_DAYS * 86400)) == 0
+    conn = pool.acquire()
+    partitions = conn.execute('SELECT table_name, row_count FROM history_partitions').fetchall()
+    conn.close()
+    assert [tuple(row) for row in partitions] == [('vehicle_locations_archive_20231111', 2)]
+
+
+def test_archives_rows_beyond_the_size_cap(pool):
+    add_pings(pool, [(1, 12.0, 77.0, FRESH + i) for i in range(5)])
+    worker = RetentionWorker(pool, batch_size=2)
+
+    # Ids 1-3 are over the cap; batches of two
+    assert worker.archive_locations_batch(OLD, id_cutoff=3) == 2
+    assert worker.archive_locations_batch(OLD, id_cutoff=3) == 1
+    assert worker.archive_locations_batch(OLD, id_cutoff=3) == 0
+    assert hot_timestamps(pool) == [FRESH + 3, FRESH + 4]
+
+
+def test_idle_run_does_not_wait_for_the_write_lock(pool):
+    add_pings(pool, [(1, 12.0, 77.0, FRESH)])
+    # Ingest holds the write lock
+    writer = sqlite3.connect(pool.database, isolation_level=None)
+    writer.execute('BEGIN IMMEDIATE')
+    try:
+        worker = RetentionWorker(pool)
+        started = time.perf_counter()
+        assert worker.archive_locations_batch(OLD) == 0
+        assert worker.archive_sos_batch(NOW) == 0
+        assert time.perf_counter() - started < 1.0
+    finally:
+        writer.rollback()
+        writer.close()
+
+
+def test_archives_oldest_sos_triggers_first(pool):
+    conn = pool.acquire()
+    conn.executemany('INSERT INTO sos_triggers (user_id, latitude, longitude, timestamp) VALUES (1, 0, 0, ?)', [
+        ('2023-11-14 20:00:00',),  # Recent
+        ('2023-09-02 10:00:00',),
+        ('2023-09-01 10:00:00',),
+    ])
+    conn.commit()
+    conn.close()
+    worker = RetentionWorker(pool, batch_size=1)
+
+    assert worker.archive_sos_batch(NOW) == 1
+    conn = pool.acquire()
+    archived = conn.execute('SELECT timestamp FROM sos_triggers_archive_20230901').fetchall()
+    conn.close()
+    assert [row[0] for row in archived] == ['2023-09-01 10:00:00']
+    assert worker.archive_sos_batch(NOW) == 1
+    assert worker.archive_sos_batch(NOW) == 0
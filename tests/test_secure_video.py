@@ -0,0 +1,97 @@
+import io
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from secure_video import HEADER_SIZE, TAG_SIZE, ChunkedCipher, VideoDecryptionError, is_chunked_file
+
+# Chunked AES-GCM video files: round trips around chunk boundaries, range
+# reads, and the tampering the frame layout is meant to catch. A small chunk
+# size keeps every case to a few frames.
+
+CHUNK = 64
+FRAME = CHUNK + TAG_SIZE
+
+
+@pytest.fixture
+def cipher():
+    return ChunkedCipher.from_fernet_key(b'0' * 44, chunk_size=CHUNK)
+
+
+def encrypt(cipher, tmp_path, data):
+    path = str(tmp_path / 'video.enc')
+    assert cipher.encrypt_stream(io.BytesIO(data), path) == len(data)
+    return path
+
+
+@pytest.mark.parametrize('size', [0, 1, CHUNK - 1, CHUNK, CHUNK + 1, 3 * CHUNK, 3 * CHUNK + 17])
+def test_round_trip(cipher, tmp_path, size):
+    data = os.urandom(size)
+    path = encrypt(cipher, tmp_path, data)
+
+    assert is_chunked_file(path)
+    assert cipher.plaintext_size(path) == size
+    assert cipher.decrypt_file(path) == data
+    assert not os.path.exists(path + '.part')
+
+
+@pytest.mark.parametrize('start, stop', [(0, 10), (CHUNK - 5, CHUNK + 5), (CHUNK, 2 * CHUNK), (150, 10 ** 6), (500, 600)])
+def test_range_reads(cipher, tmp_path, start, stop):
+    data = os.urandom(3 * CHUNK + 17)
+    path = encrypt(cipher, tmp_path, data)
+
+    assert b''.join(cipher.iter_range(path, start, stop)) == data[start:stop]
+
+
+def rewrite(path, change):
+    with open(path, 'rb') as f:
+        raw = bytearray(f.read())
+    with open(path, 'wb') as f:
+        f.write(change(raw))
+
+
+def flip_byte(raw):
+    raw[HEADER_SIZE + FRAME + 3] ^= 1
+    return raw
+
+
+def drop_last_frame(raw):
+    return raw[:HEADER_SIZE + 2 * FRAME]
+
+
+def swap_frames(raw):
+    first, second = HEADER_SIZE, HEADER_SIZE + FRAME
+    return raw[:first] + raw[second:second + FRAME] + raw[first:second] + raw[second + FRAME:]
+
+
+@pytest.mark.parametrize('change', [flip_byte, drop_last_frame, swap_frames])
+def test_tampering_fails_authentication(cipher, tmp_path, change):
+    path = encrypt(cipher, tmp_path, os.urandom(3 * CHUNK))
+    rewrite(path, change)
+
+    with pytest.raises(VideoDecryptionError):
+        cipher.decrypt_file(path)
+
+
+def test_other_key_cannot_decrypt(cipher, tmp_path):
+    path = encrypt(cipher, tmp_path, os.urandom(CHUNK))
+
+    with pytest.raises(VideoDecryptionError):
+        ChunkedCipher.from_fernet_key(b'1' * 44, chunk_size=CHUNK).decrypt_file(path)
+
+
+def test_failed_upload_leaves_no_file(cipher, tmp_path):
+    class BrokenUpload(io.BytesIO):
+        def read(self, size=-1):
+            if self.tell() >= CHUNK:
+                raise OSError('client went away')
+            return super().read(size)
+
+    path = str(tmp_path / 'video.enc')
+    with pytest.raises(OSError):
+        cipher.encrypt_stream(BrokenUpload(os.urandom(4 * CHUNK)), path)
+    assert os.listdir(tmp_path) == []
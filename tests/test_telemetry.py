@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from db_pool import ConnectionPool
+from emergency_rules import RuleCache
+from migrations import migrate
+from telemetry import TelemetryMonitor
+
+# Background ride monitoring against rules loaded from a real database, with
+# the defaults init_emergency_conditions gives every new user. Pings are fed
+# to process() directly.
+
+HOME = (12.9716, 77.5946)
+USER_ID = 1
+# ~0.28 km of latitude per 30 s ping, about 33 km/h
+CITY_STEP = 0.0025
+
+
+def local_time(hour, minute=0):
+    return time.mktime((2024, 1, 10, hour, minute, 0, 0, 0, -1))
+
+
+@pytest.fixture
+def rules(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'rides.db'), max_size=2)
+    conn = pool.acquire()
+    migrate(conn)
+    conn.execute('UPDATE users SET home_location = ? WHERE id = ?',
+                 (json.dumps({'latitude': HOME[0], 'longitude': HOME[1]}), USER_ID))
+    conn.execute('''
+        INSERT INTO emergency_conditions (
+            user_id, distance_threshold, location_condition, time_start, time_end,
+            time_condition, speed_threshold, speed_condition, emergency_contacts
+        ) VALUES (?, 10, 'away', '22:00', '06:00', 'outside', 120, 'above', ?)
+    ''', (USER_ID, json.dumps([{'name': 'Asha', 'phone': '+15550001'}])))
+    conn.commit()
+    conn.close()
+    yield RuleCache(pool)
+    pool.close_all()
+
+
+@pytest.fixture
+def monitor(rules):
+    alerts = []
+    monitor = TelemetryMonitor(rules, on_alert=lambda ride, rules, lat, lon, speed: alerts.append((lat, lon, speed)))
+    monitor.alerts_raised = alerts
+    # Pings go straight to process(); no consumer thread
+    monitor.start = lambda: None
+    yield monitor
+    monitor.stop()
+
+
+def ride(monitor, started_at, step, pings=10):
+    monitor.start_ride(1, USER_ID, vehicle_id=7)
+    for i in range(pings):
+        monitor.process(1, HOME[0] + i * step, HOME[1], None, started_at + i * 30)
+
+
+@pytest.mark.parametrize('hour', [3, 12, 23])
+def test_benign_ride_raises_no_alert(monitor, hour):
+    # Around home at city speed, at night, in the day, and across the
+    # configured 22:00-06:00 window
+    ride(monitor, local_time(hour), CITY_STEP)
+
+    assert monitor.alerts_raised == []
+    assert monitor.stats()['processed'] == 10
+
+
+def test_sos_press_keeps_or_semantics(rules):
+    # Pressing SOS outside 22:00-06:00 still matches on the time check alone
+    compiled = rules.get(USER_ID)
+    assert compiled.evaluate(HOME[0], HOME[1], 30, 12 * 60)
+    assert not compiled.evaluate(HOME[0], HOME[1], 30, 23 * 60)
+    assert not compiled.evaluate_monitor(HOME[0], HOME[1], 30, 12 * 60)
+
+
+def test_speeding_outside_the_window_alerts_once_confirmed(monitor):
+    # ~150 km/h; the first ping has no previous point, the next two confirm
+    ride(monitor, local_time(12), 0.0112, pings=3)
+
+    assert len(monitor.alerts_raised) == 1
+    assert monitor.alerts_raised[0][2] > 120
+
+
+def test_speeding_inside_the_window_does_not_alert(monitor):
+    # The defaults alert outside 22:00-06:00 only
+    ride(monitor, local_time(23), 0.0112, pings=3)
+
+    assert monitor.alerts_raised == []
+
+
+def test_far_from_home_alerts(monitor):
+    monitor.start_ride(1, USER_ID, vehicle_id=7)
+    for i in range(3):
+        monitor.process(1, HOME[0] + 0.2, HOME[1] + i * 0.001, None, local_time(12) + i * 30)
+
+    assert len(monitor.alerts_raised) == 1
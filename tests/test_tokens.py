@@ -0,0 +1,77 @@
+import os
+import sys
+import time
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from shared_state import SharedSlotTable, SlotTableFull
+from tokens import InvalidToken, RevocationList, RevocationListFull, TokenSigner, ephemeral_keys
+
+# Bearer tokens and the revocation list behind logout. A revocation must
+# outlive the token it revokes, so a full list refuses new entries rather
+# than dropping live ones.
+
+NOW = time.time()
+
+
+def signer(max_revoked=10):
+    return TokenSigner(ephemeral_keys(), revocations=RevocationList(max_entries=max_revoked))
+
+
+def test_token_round_trip():
+    tokens = signer()
+    claims = tokens.verify(tokens.issue(7, 'female', 'any'))
+
+    assert (claims['sub'], claims['g'], claims['dgp']) == (7, 'female', 'any')
+
+
+def test_revoked_token_is_rejected():
+    tokens = signer()
+    token = tokens.issue(7)
+    tokens.revoke(tokens.verify(token))
+
+    with pytest.raises(InvalidToken, match='revoked'):
+        tokens.verify(token)
+
+
+def test_full_list_refuses_instead_of_evicting():
+    tokens = signer(max_revoked=3)
+    revoked = [tokens.issue(user_id) for user_id in range(3)]
+    for token in revoked:
+        tokens.revoke(tokens.verify(token))
+
+    with pytest.raises(RevocationListFull):
+        tokens.revoke(tokens.verify(tokens.issue(99)))
+    for token in revoked:
+        with pytest.raises(InvalidToken, match='revoked'):
+            tokens.verify(token)
+
+
+def test_expired_revocations_make_room():
+    revocations = RevocationList(max_entries=2)
+    revocations.add('old', NOW - 1, NOW - 10)
+    revocations.add('live', NOW + 60, NOW)
+
+    revocations.add('new', NOW + 60, NOW)
+
+    assert 'live' in revocations and 'new' in revocations
+    assert 'old' not in revocations
+
+
+def test_shared_table_refuses_to_overwrite_live_slots():
+    table = SharedSlotTable(f'test-tokens-{os.getpid()}', 2, '')
+    try:
+        for key in ('a', 'b'):
+            table.update(key, NOW, lambda current: ((), NOW + 60, None), evict=False)
+        with pytest.raises(SlotTableFull):
+            table.update('c', NOW, lambda current: ((), NOW + 60, None), evict=False)
+        # Refreshing a live key and reusing expired slots still work
+        table.update('a', NOW, lambda current: ((), NOW + 60, None), evict=False)
+        table.update('c', NOW + 61, lambda current: ((), NOW + 120, None), evict=False)
+        assert table.get('c', NOW + 61) is not None
+    finally:
+        table.close()
+        table.unlink()
@@ -0,0 +1,166 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+
+from shared_state import SharedSlotTable, SlotTableFull
+
+# Signed bearer tokens carrying the claims hot endpoints need (user id,
+# gender, driver gender preference), so they authorize and filter without
+# reading users. Format:
+#   <kid>.<payload b64url>.<HMAC-SHA256 b64url>
+# kid names the signing key. Keys rotate by putting the new one first in
+# TOKEN_SIGNING_KEYS and keeping the old one listed until its tokens expire.
+# Revoked token ids are remembered until the token would have expired anyway;
+# with SHARED_STATE_NAME set the list is shared by every worker. A live
+# revocation is never evicted to make room: when the list is full, revoking
+# fails and the token stays valid until it expires, which the caller reports.
+
+TOKEN_TTL_SECONDS = 8 * 3600
+MAX_REVOKED = 100000
+SHARED_SLOTS = 65536
+
+
+class InvalidToken(Exception):
+    # Raised for malformed, forged, expired or revoked tokens; callers answer 401
+    pass
+
+
+class RevocationListFull(Exception):
+    # Raised when a revocation cannot be stored without dropping a live one;
+    # callers answer 503
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def parse_keys(spec):
+    # 'kid:secret,kid:secret' -> [(kid, secret bytes)], signing key first
+    keys = []
+    for item in (spec or '').split(','):
+        kid, _, secret = item.strip().partition(':')
+        if kid and secret:
+            keys.append((kid, secret.encode()))
+    return keys
+
+
+def ephemeral_keys():
+    # A random key for when none are configured. It lives only as long as the
+    # process, so its tokens fail in other workers and after a restart.
+    return [(f'ephemeral-{secrets.token_hex(4)}', secrets.token_bytes(32))]
+
+
+class RevocationList:
+    def __init__(self, shared_name=None, max_entries=MAX_REVOKED):
+        self._table = SharedSlotTable(f'{shared_name}-revoked', SHARED_SLOTS, '') if shared_name else None
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._revoked = {}  # token id -> expires_at
+
+    def add(self, token_id, expires_at, now=None):
+        now = now or time.time()
+        if self._table:
+            try:
+                self._table.update(token_id, now, lambda current: ((), expires_at, None), evict=False)
+            except SlotTableFull:
+                raise RevocationListFull('Too many revoked tokens')
+            return
+        with self._lock:
+            if token_id not in self._revoked and len(self._revoked) >= self.max_entries:
+                for expired in [key for key, expiry in self._revoked.items() if expiry <= now]:
+                    del self._revoked[expired]
+                if len(self._revoked) >= self.max_entries:
+                    raise RevocationListFull('Too many revoked tokens')
+            self._revoked[token_id] = expires_at
+
+    def __contains__(self, token_id):
+        if self._table:
+            return self._table.get(token_id, time.time()) is not None
+        with self._lock:
+            expires_at = self._revoked.get(token_id)
+            if expires_at is None:
+                return False
+            if expires_at > time.time():
+                return True
+            del self._revoked[token_id]
+            return False
+
+
+class TokenSigner:
+    def __init__(self, keys, ttl=TOKEN_TTL_SECONDS, revocations=None):
+        if not keys:
+            raise ValueError('At least one signing key is required')
+        self.active_kid = keys[0][0]
+        self._keys = dict(keys)
+        self.ttl = ttl
+        self.revocations = revocations if revocations is not None else RevocationList()
+
+        # Metrics
+        self.issued = 0
+        self.verified = 0
+        self.rejected = 0
+        self.revoked = 0
+
+    def _sign(self, kid, payload):
+        return hmac.new(self._keys[kid], f'{kid}.{payload}'.encode(), hashlib.sha256).digest()
+
+    def issue(self, user_id, gender=None, driver_gender_preference=None, now=None):
+        now = now or time.time()
+        claims = {
+            'sub': int(user_id),
+            'g': gender,
+            'dgp': driver_gender_preference,
+            'iat': int(now),
+            'exp': int(now + self.ttl),
+            'jti': _b64encode(secrets.token_bytes(9))
+        }
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode())
+        self.issued += 1
+        return f'{self.active_kid}.{payload}.{_b64encode(self._sign(self.active_kid, payload))}'
+
+    def verify(self, token, now=None):
+        # Returns the claims, or raises InvalidToken
+        try:
+            kid, payload, signature = token.split('.')
+            if kid not in self._keys:
+                raise InvalidToken('Unknown signing key')
+            if not hmac.compare_digest(_b64decode(signature), self._sign(kid, payload)):
+                raise InvalidToken('Bad signature')
+            claims = json.loads(_b64decode(payload))
+        except InvalidToken:
+            self.rejected += 1
+            raise
+        except (ValueError, TypeError):
+            self.rejected += 1
+            raise InvalidToken('Malformed token')
+        if (now or time.time()) >= claims['exp']:
+            self.rejected += 1
+            raise InvalidToken('Token expired')
+        if claims['jti'] in self.revocations:
+            self.rejected += 1
+            raise InvalidToken('Token revoked')
+        self.verified += 1
+        return claims
+
+    def revoke(self, claims):
+        self.revocations.add(claims['jti'], claims['exp'])
+        self.revoked += 1
+
+    def stats(self):
+        return {
+            'active_kid': self.active_kid,
+            'keys': len(self._keys),
+            'issued': self.issued,
+            'verified': self.verified,
+            'rejected': self.rejected,
+            'revoked': self.revoked
+        }
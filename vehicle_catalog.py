@@ -0,0 +1,90 @@
+import hashlib
+import json
+import threading
+
+from shared_state import SharedSlotTable
+from ttl_cache import TTLCache
+
+# Read-through cache of vehicle listings as ready-to-send JSON. Each entry is
+# keyed by its filter tuple and depends on a few tags ('booking', 'rental',
+# 'rental_dates', 'all'); writers bump the generation of the tags their
+# change affects, and an entry is served only while the generations it was
+# built under are current. With SHARED_STATE_NAME set the generations live in
+# shared memory, so a write in one worker invalidates every worker's copy.
+# The TTL only bounds staleness from writes made outside the app.
+
+CATALOG_TTL_SECONDS = 300.0
+MAX_ENTRIES = 1024
+TAGS = ('booking', 'rental', 'rental_dates', 'all')
+
+
+class CatalogEntry:
+    __slots__ = ('generations', 'body', 'etag', 'count')
+
+    def __init__(self, generations, body, etag, count):
+        self.generations = generations
+        self.body = body
+        self.etag = etag
+        self.count = count
+
+
+class VehicleCatalog:
+    def __init__(self, shared_name=None, ttl=CATALOG_TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self._entries = TTLCache(max_entries, ttl)
+        self._table = SharedSlotTable(f'{shared_name}-catalog', 64, 'Q') if shared_name else None
+        self._lock = threading.Lock()
+        self._generations = dict.fromkeys(TAGS, 0)
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _generation(self, tag):
+        if self._table:
+            record = self._table.get(tag, 0.0)
+            return record[0] if record else 0
+        return self._generations[tag]
+
+    def invalidate(self, *tags):
+        with self._lock:
+            self.invalidations += 1
+            if not self._table:
+                for tag in tags:
+                    self._generations[tag] += 1
+        if self._table:
+            for tag in tags:
+                self._table.update(tag, 0.0, lambda current: ((current[0] + 1 if current else 1,), float('inf'), None))
+
+    def vehicle_changed(self, is_rental):
+        # A vehicle was added or changed status
+        if is_rental:
+            self.invalidate('rental', 'rental_dates', 'all')
+        else:
+            self.invalidate('booking', 'all')
+
+    def get(self, key, tags, load):
+        # Returns the CatalogEntry for key, calling load() -> (payload, count) on a miss
+        generations = tuple(self._generation(tag) for tag in tags)
+        entry = self._entries.get(key)
+        if entry is not None and entry.generations == generations:
+            with self._lock:
+                self.hits += 1
+            return entry
+        payload, count = load()
+        body = json.dumps(payload, separators=(',', ':')).encode()
+        # Generations read before the load, so a write during it forces a reload next time
+        entry = CatalogEntry(generations, body, hashlib.blake2b(body, digest_size=12).hexdigest(), count)
+        self._entries.set(key, entry)
+        with self._lock:
+            self.misses += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }